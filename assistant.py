@@ -1,56 +1,323 @@
 # assistant.py
 import os
-import json
+import wave
+import queue
 import datetime
+import threading
+import concurrent.futures
 
-from groq_api import GroqHandler
 from llm_api import get_llm_handler
-from google_cloud_api import GoogleTTSHandler
-from minimax_api import MiniMaxTTSHandler
-from utils import parse_and_clean_llm_response
-from config import SYSTEM_PROMPT, CONVERSATIONS_DIR, TTS_PROVIDER, TTS_MAX_CHARACTERS
+from llm_router import LLMRouter
+from providers import create_provider
+from tts_cache import TTSCache, CachedTTSHandler
+from chunked_tts import ChunkedTTSHandler
+from scheduler import ScheduledHandler, get_scheduler
+from context_manager import ContextWindowManager
+from conversation_log import ConversationLog
+from segment_transcriber import SegmentTranscriber
+from metrics import TurnMetrics
+from utils import parse_and_clean_llm_response, IncrementalTTSCleaner, SentenceSegmenter
+from config import (
+    SYSTEM_PROMPT, CONVERSATIONS_DIR, STT_PROVIDER, LLM_PROVIDER, TTS_PROVIDER, TTS_MAX_CHARACTERS, STREAMING_RESPONSE,
+    TTS_STREAMING, TTS_CACHE_ENABLED, TTS_CHUNKING, TRANSCRIPTION_WORKERS, SCHEDULER_ENABLED, STREAMING_TTS_WORKERS
+)
+
+class TurnCancelled(BaseException):
+    """
+    Raised when a turn is cancelled while the assistant is working on it.
+    It is a BaseException so that the handlers' 'except Exception' blocks, which turn provider failures into error
+    results, let it through when it is raised from a streaming callback.
+    """
+
+# Creates the handler of the configured TTS provider, with chunked synthesis and behind the TTS cache if enabled.
+def create_tts_handler():
+    print(f"Using {TTS_PROVIDER} TTS")
+    tts_handler = create_provider("tts", TTS_PROVIDER)
+    if TTS_CHUNKING:
+        tts_handler = ChunkedTTSHandler(tts_handler)
+    if TTS_CACHE_ENABLED:
+        tts_handler = CachedTTSHandler(tts_handler, TTSCache())
+    return tts_handler
 
 class VoiceAssistant:
     """
     Manages the core voice assistant logic, decoupling it from the UI.
     """
     # Initializes the assistant's components and conversation setup.
-    def __init__(self, conversation_id):
-        self.transcription_handler = GroqHandler()
-        self.llm_handler = get_llm_handler()
-        
-        if TTS_PROVIDER == "minimax":
-            print("Using MiniMax TTS")
-            self.tts_handler = MiniMaxTTSHandler()
-        else:
-            print("Using Google Cloud TTS")
-            self.tts_handler = GoogleTTSHandler()
+    # Handlers that are not given are created for the configured providers. Stateless handlers (transcription, TTS)
+    # can be shared by several assistants; the LLM handler may keep per-conversation state, so each needs its own.
+    # Streamed responses are synthesized on tts_executor, which several assistants may share; by default each
+    # assistant creates its own when first needed. Responses are cleaned on cpu_executor if given.
+    def __init__(self, conversation_id, transcription_handler=None, llm_handler=None, tts_handler=None,
+                 tts_executor=None, cpu_executor=None):
+        # Provider modules (and their SDKs) are imported here, only for the configured providers
+        self.transcription_handler = transcription_handler or create_provider("stt", STT_PROVIDER)
+        self.llm_handler = llm_handler or get_llm_handler()
+        self.tts_handler = tts_handler or create_tts_handler()
 
         self.conversation_id = conversation_id
+        if SCHEDULER_ENABLED:
+            self._schedule_handlers()
         self.conversation_path = os.path.join(CONVERSATIONS_DIR, self.conversation_id)
         os.makedirs(self.conversation_path, exist_ok=True)
         print(f"Assistant logic initialized. Saving conversation to: {self.conversation_path}")
 
-        self.chat_history = [{"role": "system", "content": SYSTEM_PROMPT}]
+        # Guards the history: a cancelled turn's request may still be finishing while the next turn records its messages
+        self.history_lock = threading.RLock()
+        self.conversation_log = ConversationLog(self.conversation_path)
+        if self.conversation_log.recovered_messages:
+            self.chat_history = self.conversation_log.recovered_messages
+            print(f"Recovered {len(self.chat_history)} messages from the conversation log.")
+        else:
+            self.chat_history = []
+            self._append_message({"role": "system", "content": SYSTEM_PROMPT})
+        self.context = ContextWindowManager(summarizer_factory=self._create_summarizer)
+        self.transcription_executor = None  # Created when segmented transcription is first used
+        self.tts_executor = tts_executor
+        self.owns_tts_executor = tts_executor is None
+        self.cpu_executor = cpu_executor
+
+    # Puts the handlers behind the shared provider schedulers, so this conversation's requests are rate limited and
+    # queued fairly with those of the other conversations. TTS cache hits don't go through the scheduler.
+    def _schedule_handlers(self):
+        self.transcription_handler = ScheduledHandler(
+            self.transcription_handler, get_scheduler("stt", STT_PROVIDER), self.conversation_id
+        )
+        self.llm_handler = self._schedule_llm_handler(self.llm_handler)
+        self.tts_handler = self._schedule_tts_handler(self.tts_handler, get_scheduler("tts", TTS_PROVIDER))
 
-    # Transcribes user audio and updates the chat history.
-    def transcribe_and_update_history(self, user_audio_path):
-        transcribed_text = self.transcription_handler.transcribe(user_audio_path)
+    # Puts an LLM handler behind its provider's scheduler. A router's providers are scheduled one by one, so each request
+    # is admitted by the scheduler of the provider it actually goes to and a busy provider is skipped.
+    def _schedule_llm_handler(self, llm_handler):
+        if isinstance(llm_handler, LLMRouter):
+            for name, handler in llm_handler.handlers.items():
+                llm_handler.handlers[name] = ScheduledHandler(handler, get_scheduler("llm", name), self.conversation_id)
+            return llm_handler
+        return ScheduledHandler(llm_handler, get_scheduler("llm", LLM_PROVIDER), self.conversation_id)
+
+    # Creates the LLM handler used for context summaries, behind the schedulers like the conversation's own.
+    def _create_summarizer(self):
+        summarizer = get_llm_handler()
+        return self._schedule_llm_handler(summarizer) if SCHEDULER_ENABLED else summarizer
+
+    # Puts the scheduler right in front of the provider handler, below the cache and chunking wrappers,
+    # so each chunk is admitted on its own.
+    def _schedule_tts_handler(self, tts_handler, scheduler):
+        if isinstance(tts_handler, CachedTTSHandler):
+            return CachedTTSHandler(self._schedule_tts_handler(tts_handler.tts_handler, scheduler), tts_handler.cache)
+        if isinstance(tts_handler, ChunkedTTSHandler):
+            return ChunkedTTSHandler(self._schedule_tts_handler(tts_handler.tts_handler, scheduler), tts_handler.executor)
+        return ScheduledHandler(tts_handler, scheduler, self.conversation_id)
+
+    # Transcribes user audio (a file path, int16 samples, or an encoded file's bytes named by filename)
+    # and updates the chat history.
+    def transcribe_and_update_history(self, user_audio, filename="audio.wav"):
+        return self.record_transcription(self.transcription_handler.transcribe(user_audio, filename))
+
+    # Returns a SegmentTranscriber that transcribes the segments of a recording in the background.
+    def new_segment_transcriber(self):
+        if self.transcription_executor is None:
+            self.transcription_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=TRANSCRIPTION_WORKERS, thread_name_prefix="transcription"
+            )
+        return SegmentTranscriber(self.transcription_handler.transcribe, self.transcription_executor)
+
+    # Adds the transcribed user message to the chat history.
+    def record_transcription(self, transcribed_text):
         if not transcribed_text or transcribed_text.startswith("Error:"):
             return {"error": "Failed to understand the audio.", "user_text": ""}
 
         user_message = {"role": "user", "content": transcribed_text, "timestamp": datetime.datetime.now().isoformat()}
-        self.chat_history.append(user_message)
+        self._append_message(user_message)
         
         return {"user_text": transcribed_text, "error": None}
 
     # Generates the LLM response, synthesizes it to speech, and saves the history.
-    def generate_assistant_response(self, turn_counter):
-        # 1. Get response from the LLM
-        llm_data = self.llm_handler.get_chat_completion(self.chat_history)
+    # If streaming is enabled and on_audio is given, each synthesized sentence is passed to on_audio as soon as it is ready.
+    # If cancel_event is given and gets set, the turn stops at its next step and TurnCancelled is raised.
+    # The time spent in each stage is added to metrics (a TurnMetrics), if given.
+    def generate_assistant_response(self, turn_counter, on_audio=None, cancel_event=None, metrics=None):
+        metrics = metrics or TurnMetrics()
+        if STREAMING_RESPONSE and on_audio:
+            return self._generate_streamed_response(turn_counter, on_audio, cancel_event, metrics)
+
+        processed_text = self.complete_response(cancel_event, metrics)
+        if processed_text.get("error"):
+            return {"error": processed_text["error"]}
+        audio_content = self.synthesize_response(processed_text, turn_counter, on_audio, cancel_event, metrics)
+
+        return {
+            "assistant_ui_text": processed_text["for_ui"],
+            "audio_content": audio_content,
+            "error": None
+        }
+
+    # Gets the response from the LLM and records it in the history.
+    # Returns the processed text, or a dictionary with an 'error' key.
+    def complete_response(self, cancel_event=None, metrics=None):
+        metrics = metrics or TurnMetrics()
+        self._check_cancelled(cancel_event)
+        with metrics.span("llm"):
+            llm_data = self.llm_handler.get_chat_completion(self._build_context())
+        return self._record_llm_response_unless_cancelled(llm_data, metrics, cancel_event)
+
+    # Synthesizes speech for the processed response and saves it. Without TTS_CHUNKING, texts over the character limit
+    # are not synthesized.
+    # Returns the audio for the caller to play, or None if there is none or it was already handed to on_audio.
+    def synthesize_response(self, processed_text, turn_counter, on_audio=None, cancel_event=None, metrics=None):
+        metrics = metrics or TurnMetrics()
+        self._check_cancelled(cancel_event)
+        audio_content = None
+        tts_text = processed_text["for_tts"]
+
+        if len(tts_text) > TTS_MAX_CHARACTERS and not TTS_CHUNKING:
+            print(f"TTS skipped: text length ({len(tts_text)} chars) exceeds limit ({TTS_MAX_CHARACTERS} chars)")
+        elif on_audio and self._tts_streaming_enabled():
+            # Audio is handed to on_audio chunk by chunk, so nothing is left for the caller to play
+            with metrics.span("tts"):
+                audio = self._stream_tts(tts_text, on_audio, cancel_event)
+            self._check_cancelled(cancel_event)
+            with metrics.span("file_write"):
+                self._save_assistant_audio(audio, turn_counter, self.tts_handler.stream_format)
+        else:
+            with metrics.span("tts"):
+                audio_content = self.tts_handler.synthesize_speech(tts_text)
+            self._check_cancelled(cancel_event)
+            with metrics.span("file_write"):
+                self._save_assistant_audio(audio_content, turn_counter)
+        return audio_content
+
+    # Streams the LLM response sentence by sentence into TTS, handing each audio segment to on_audio in order.
+    def _generate_streamed_response(self, turn_counter, on_audio, cancel_event, metrics):
+        self._check_cancelled(cancel_event)
+        cleaner = IncrementalTTSCleaner()
+        segmenter = SentenceSegmenter()
+        tts_queue = queue.Queue()
+        audio_segments = []
+        tts_worker = self._get_tts_executor().submit(
+            self._tts_worker, tts_queue, audio_segments, on_audio, cancel_event, metrics
+        )
+
+        # 1. Stream the response from the LLM, cleaning it as it arrives and queuing sentences for TTS as they complete
+        spoken_characters = 0
+        def queue_sentence(tts_text):
+            nonlocal spoken_characters
+            if not tts_text:
+                return
+            spoken_characters += len(tts_text)
+            if spoken_characters > TTS_MAX_CHARACTERS and not TTS_CHUNKING:
+                print(f"TTS stopped: streamed text exceeds limit ({TTS_MAX_CHARACTERS} chars)")
+                return
+            tts_queue.put(tts_text)
+
+        def on_delta(delta):
+            # Raising aborts the provider stream, which closes its connection
+            self._check_cancelled(cancel_event)
+            metrics.mark("first_token")
+            for sentence in segmenter.feed(cleaner.feed(delta)):
+                queue_sentence(sentence)
+
+        try:
+            with metrics.span("llm"):
+                llm_data = self.llm_handler.stream_chat_completion(self._build_context(), on_delta)
+            if not llm_data.get("error"):
+                # The cleaner drops the trailing expression from the remaining text
+                for sentence in segmenter.feed(cleaner.finish()):
+                    queue_sentence(sentence)
+                queue_sentence(segmenter.flush())
+        except BaseException:
+            # The turn failed or was cancelled, so the sentences not synthesized yet are dropped
+            self._clear_queue(tts_queue)
+            raise
+        finally:
+            # The sentinel is queued on every path, so the worker never waits for more sentences forever
+            tts_queue.put(None)
+
+        # 2. Process and record the complete response while the remaining sentences are synthesized
+        try:
+            processed_text = self._record_llm_response_unless_cancelled(llm_data, metrics, cancel_event)
+        finally:
+            concurrent.futures.wait((tts_worker,))
+        if tts_worker.exception():
+            print(f"TTS failed: {tts_worker.exception()}")
+        if processed_text.get("error"):
+            return {"error": processed_text["error"]}
+        self._check_cancelled(cancel_event)
+
+        audio_format = self.tts_handler.stream_format if self._tts_streaming_enabled() else "mp3"
+        with metrics.span("file_write"):
+            self._save_assistant_audio(b"".join(audio_segments), turn_counter, audio_format)
+        return {
+            "assistant_ui_text": processed_text["for_ui"],
+            "audio_content": None,
+            "error": None
+        }
+
+    # Synthesizes queued sentences in order until a None sentinel is received or the turn is cancelled.
+    def _tts_worker(self, tts_queue, audio_segments, on_audio, cancel_event, metrics):
+        while True:
+            tts_text = tts_queue.get()
+            if tts_text is None or (cancel_event is not None and cancel_event.is_set()):
+                return
+            if self._tts_streaming_enabled():
+                with metrics.span("tts"):
+                    audio_segments.append(self._stream_tts(tts_text, on_audio, cancel_event))
+                continue
+            with metrics.span("tts"):
+                audio_content = self.tts_handler.synthesize_speech(tts_text)
+            if audio_content:
+                audio_segments.append(audio_content)
+                on_audio(audio_content)
+
+    # Returns the executor synthesizing streamed responses, creating the assistant's own if none was given.
+    def _get_tts_executor(self):
+        if self.tts_executor is None:
+            self.tts_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=STREAMING_TTS_WORKERS, thread_name_prefix="tts"
+            )
+        return self.tts_executor
+
+    # Runs CPU-bound work on the shared CPU pool if the assistant was given one, otherwise in the calling thread.
+    def _run_cpu(self, function, *args):
+        if self.cpu_executor is None:
+            return function(*args)
+        return self.cpu_executor.submit(function, *args).result()
+
+    # Removes the items still waiting in a queue.
+    @staticmethod
+    def _clear_queue(pending):
+        while True:
+            try:
+                pending.get_nowait()
+            except queue.Empty:
+                return
+
+    # Returns True if TTS audio should be streamed in chunks.
+    def _tts_streaming_enabled(self):
+        return TTS_STREAMING and self.tts_handler.supports_streaming
+
+    # Streams speech for the text, passing PCM chunks to on_audio as they arrive. Returns all the audio received.
+    # Setting cancel_event closes the stream (and its connection) at the next chunk.
+    def _stream_tts(self, tts_text, on_audio, cancel_event=None):
+        audio_format = self.tts_handler.stream_format
+        chunks = []
+        for chunk in self.tts_handler.stream_speech(tts_text):
+            if cancel_event is not None and cancel_event.is_set():
+                return b""
+            chunks.append(chunk)
+            if audio_format == "pcm":
+                on_audio(chunk, audio_format="pcm", sample_rate=self.tts_handler.sample_rate)
+        audio_content = b"".join(chunks)
+        # Partial MP3 chunks can't be played on their own, so the MP3 is queued once complete
+        if audio_format != "pcm" and audio_content:
+            on_audio(audio_content)
+        return audio_content
+
+    # Validates the LLM result, cleans its text and appends the assistant message to the history.
+    # Returns the processed text, or a dictionary with an 'error' key.
+    def _record_llm_response(self, llm_data, metrics):
         if llm_data.get("error"):
-            self.chat_history.append({"role": "system", "content": f"[ERROR] {llm_data['error']}"})
-            self.save_chat_history()
+            self._append_message({"role": "system", "content": f"[ERROR] {llm_data['error']}"})
             return {"error": llm_data["error"]}
 
         raw_llm_response = llm_data["response"]
@@ -58,12 +325,12 @@ class VoiceAssistant:
 
         if not raw_llm_response or not raw_llm_response.strip():
             error_msg = "Could not generate a response. Please try again."
-            self.chat_history.append({"role": "assistant", "content": f"[{error_msg}]"})
-            self.save_chat_history()
+            self._append_message({"role": "assistant", "content": f"[{error_msg}]"})
             return {"error": error_msg}
         
         # 2. Process and clean text for UI and TTS
-        processed_text = parse_and_clean_llm_response(raw_llm_response)
+        with metrics.span("parse"):
+            processed_text = self._run_cpu(parse_and_clean_llm_response, raw_llm_response)
 
         expression = processed_text.get("expression")
         if expression:
@@ -80,39 +347,78 @@ class VoiceAssistant:
             if "prompt_tokens" in usage_info:
                 # User message is the second to last in history
                 self.chat_history[-1]["prompt_tokens"] = usage_info["prompt_tokens"]
+                self.conversation_log.update(len(self.chat_history) - 1, {"prompt_tokens": usage_info["prompt_tokens"]})
+                self.context.record_usage(usage_info["prompt_tokens"])
             if "completion_tokens" in usage_info:
                 assistant_message["completion_tokens"] = usage_info["completion_tokens"]
             if "completion_time" in usage_info:
                 assistant_message["completion_time"] = usage_info["completion_time"]
         
-        self.chat_history.append(assistant_message)
-        self.save_chat_history()
+        self._append_message(assistant_message)
+        metrics.message_index = len(self.chat_history) - 1
+        return processed_text
 
-        # 3. Synthesize speech (only if text is within character limit)
-        audio_content = None
-        tts_text = processed_text["for_tts"]
-        
-        if len(tts_text) > TTS_MAX_CHARACTERS:
-            print(f"TTS skipped: text length ({len(tts_text)} chars) exceeds limit ({TTS_MAX_CHARACTERS} chars)")
+    # Stores the latency spans of a turn with its assistant message, in the history and the conversation log.
+    def record_turn_metrics(self, metrics):
+        if metrics.message_index is None:
+            return
+        latency = metrics.summary()
+        with self.history_lock:
+            self.chat_history[metrics.message_index]["latency"] = latency
+            self.conversation_log.update(metrics.message_index, {"latency": latency})
+
+    # Returns the messages to send to the LLM for the current history.
+    def _build_context(self):
+        with self.history_lock:
+            return self.context.build(self.chat_history)
+
+    # Records the LLM response, unless the turn was cancelled while it was being generated: the next turn may have
+    # started, so the late response is discarded rather than recorded.
+    def _record_llm_response_unless_cancelled(self, llm_data, metrics, cancel_event):
+        with self.history_lock:
+            self._check_cancelled(cancel_event)
+            return self._record_llm_response(llm_data, metrics)
+
+    # Saves the assistant's audio for this turn to the conversation folder.
+    # Raw PCM audio is wrapped in a WAV container.
+    def _save_assistant_audio(self, audio_content, turn_counter, audio_format="mp3"):
+        if not audio_content:
+            return
+        if audio_format == "pcm":
+            assistant_audio_path = os.path.join(self.conversation_path, f"assistant_{turn_counter}.wav")
+            with wave.open(assistant_audio_path, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(self.tts_handler.sample_rate)
+                f.writeframes(audio_content)
         else:
-            audio_content = self.tts_handler.synthesize_speech(tts_text)
-            if audio_content:
-                assistant_audio_path = os.path.join(self.conversation_path, f"assistant_{turn_counter}.mp3")
-                with open(assistant_audio_path, "wb") as f:
-                    f.write(audio_content)
+            assistant_audio_path = os.path.join(self.conversation_path, f"assistant_{turn_counter}.mp3")
+            with open(assistant_audio_path, "wb") as f:
+                f.write(audio_content)
 
-        return {
-            "assistant_ui_text": processed_text["for_ui"],
-            "audio_content": audio_content,
-            "error": None
-        }
+    # Raises TurnCancelled if the turn's cancel event has been set.
+    @staticmethod
+    def _check_cancelled(cancel_event):
+        if cancel_event is not None and cancel_event.is_set():
+            raise TurnCancelled()
+
+    # Appends a message to the chat history and queues it for the conversation log.
+    def _append_message(self, message):
+        with self.history_lock:
+            self.chat_history.append(message)
+            self.conversation_log.append(message)
 
-    # Saves the current chat history to a JSON file.
+    # Exports the chat history to chat_history.json from the conversation log.
     def save_chat_history(self):
-        log_path = os.path.join(self.conversation_path, "chat_history.json")
         try:
-            with open(log_path, "w", encoding="utf-8") as f:
-                json.dump(self.chat_history, f, ensure_ascii=False, indent=2)
+            log_path = self.conversation_log.export_json()
             print(f"Chat history saved to {log_path}")
         except Exception as e:
-            print(f"Failed to save chat history: {e}")
\ No newline at end of file
+            print(f"Failed to save chat history: {e}")
+
+    # Flushes the conversation log and exports the final chat history.
+    def close(self):
+        self.save_chat_history()
+        self.conversation_log.close()
+        if self.owns_tts_executor and self.tts_executor:
+            self.tts_executor.shutdown(wait=False)
@@ -1,32 +1,154 @@
 # audio.py
 import os
+import threading
 import sounddevice as sd
 from scipy.io.wavfile import write
 import numpy as np
 import datetime
 
-from config import SAMPLE_RATE, CHANNELS
+from vad import VoiceActivityDetector
+from config import (
+    SAMPLE_RATE, CHANNELS, VAD_ENABLED, VAD_AUTO_STOP, VAD_TRIM_SILENCE, CAPTURE_BUFFER_SECONDS,
+    BARGE_IN_MIN_SPEECH_SECONDS, BARGE_IN_ENERGY_THRESHOLD_DB, BARGE_IN_PREROLL_SECONDS, VAD_FRAME_MS,
+    SEGMENT_PAUSE_SECONDS, SEGMENT_MIN_SECONDS, SEGMENT_OVERLAP_SECONDS
+)
+
+class CaptureBuffer:
+    """
+    Preallocated int16 sample store that the audio callback writes into without allocating per block.
+    Readers get views of the recorded samples instead of copies.
+    """
+    # Allocates room for the given number of seconds. Pages are only touched as they are written.
+    def __init__(self, channels=CHANNELS, seconds=CAPTURE_BUFFER_SECONDS):
+        self.data = np.zeros((int(SAMPLE_RATE * seconds), channels), dtype=np.int16)
+        self.length = 0
+
+    # Copies a block into the buffer and returns a view of it. Grows (doubling) only if the buffer is full.
+    def write(self, block):
+        start = self.length
+        end = start + len(block)
+        if end > len(self.data):
+            self._grow(end)
+        self.data[start:end] = block
+        self.length = end
+        return self.data[start:end]
+
+    # Reallocates the buffer with at least the needed capacity. Existing views keep pointing at the old samples.
+    def _grow(self, needed):
+        grown = np.zeros((max(needed, 2 * len(self.data)), self.data.shape[1]), dtype=np.int16)
+        grown[:self.length] = self.data[:self.length]
+        self.data = grown
+
+    # Returns a view of everything recorded so far.
+    def view(self):
+        return self.data[:self.length]
+
+    # Moves the most recent samples (at most sample_count) to the start of the buffer and drops the rest.
+    def keep_latest(self, sample_count):
+        start = max(0, self.length - sample_count)
+        kept = self.length - start
+        self.data[:kept] = self.data[start:self.length]
+        self.length = kept
+
+    # Returns a view of the most recent samples (at most sample_count).
+    def latest(self, sample_count):
+        end = self.length
+        return self.data[max(0, end - sample_count):end]
+
+    def __len__(self):
+        return self.length
 
 class AudioRecorder:
     # Initializes the audio recorder.
-    def __init__(self, waveform_callback=None):
+    # on_auto_stop is called (from the audio thread) once the user has stopped speaking.
+    def __init__(self, waveform_callback=None, on_auto_stop=None):
         self.is_recording = False
-        self.audio_data = []
+        self.is_monitoring = False
+        self.buffer = CaptureBuffer()
         self.stream = None
+        self.lock = threading.Lock()
         self.waveform_callback = waveform_callback
+        self.on_auto_stop = on_auto_stop
+        self.vad = VoiceActivityDetector() if VAD_ENABLED else None
+        self.auto_stop_sent = False
 
-    # Callback function to process audio chunks during recording.
+        self.on_segment = None
+        self.segment_start = 0  # Buffer index where the current segment starts
+        self.segment_speech_frames = 0  # VAD speech frames counted when the current segment started
+        self.segment_pause_frames = int(SEGMENT_PAUSE_SECONDS * 1000 / VAD_FRAME_MS)
+        self.segment_min_samples = int(SAMPLE_RATE * SEGMENT_MIN_SECONDS)
+        self.segment_overlap_samples = int(SAMPLE_RATE * SEGMENT_OVERLAP_SECONDS)
+
+        self.on_barge_in = None
+        self.barge_in_vad = VoiceActivityDetector(energy_threshold_db=BARGE_IN_ENERGY_THRESHOLD_DB)
+        self.preroll_samples = int(SAMPLE_RATE * BARGE_IN_PREROLL_SECONDS)
+        self.monitor_buffer = None
+
+    # Callback function to process audio chunks during recording or monitoring.
     def _audio_callback(self, indata, frames, time, status):
         if status:
             print(status)
-        self.audio_data.append(indata.copy())
+        if self.is_monitoring:
+            self._monitor_block(indata)
+            return
+        block = self.buffer.write(indata)
         if self.waveform_callback:
-            self.waveform_callback(indata.copy())
+            self.waveform_callback(block)
+        if not self.vad:
+            return
+        if self.vad.process(block) and VAD_AUTO_STOP and self.on_auto_stop and not self.auto_stop_sent:
+            self.auto_stop_sent = True
+            self.on_auto_stop()
+        elif self.on_segment:
+            self._cut_segment_at_pause()
+
+    # Hands the audio since the last cut to on_segment when the user pauses after enough speech.
+    def _cut_segment_at_pause(self):
+        if self.vad.silence_run < self.segment_pause_frames or self.vad.speech_frames == self.segment_speech_frames:
+            return
+        end = len(self.buffer)
+        if end - self.segment_start < self.segment_min_samples:
+            return
+        self.on_segment(self.buffer.view()[self.segment_start:end])
+        self.segment_start = max(0, end - self.segment_overlap_samples)
+        self.segment_speech_frames = self.vad.speech_frames
 
-    # Starts the audio recording stream.
-    def start(self):
-        self.audio_data = []
+    # Keeps the latest audio for pre-roll and starts recording once the user has spoken long enough.
+    def _monitor_block(self, indata):
+        if len(self.monitor_buffer) + len(indata) > len(self.monitor_buffer.data):
+            self.monitor_buffer.keep_latest(self.preroll_samples)
+        self.monitor_buffer.write(indata)
+        self.barge_in_vad.process(indata)
+        if not self.barge_in_vad.speaking_for(BARGE_IN_MIN_SPEECH_SECONDS):
+            return
+        with self.lock:
+            if not self.is_monitoring:
+                return
+            self._begin_recording(self.monitor_buffer.latest(self.preroll_samples))
+        print("Barge-in detected; recording started.")
+        if self.on_barge_in:
+            self.on_barge_in()
+
+    # Switches to recording, starting with the given samples (e.g. the pre-roll before a barge-in).
+    # Called with the lock held.
+    def _begin_recording(self, initial_samples=None):
+        # A fresh buffer, since the previous recording may still be in use by transcription or archiving
+        buffer = CaptureBuffer()
+        self.auto_stop_sent = False
+        self.segment_start = 0
+        self.segment_speech_frames = 0
+        if self.vad:
+            self.vad.reset()
+        if initial_samples is not None and len(initial_samples):
+            block = buffer.write(initial_samples)
+            if self.vad:
+                self.vad.process(block)
+        self.buffer = buffer
         self.is_recording = True
+        self.is_monitoring = False
+
+    # Opens the input stream.
+    def _open_stream(self):
         self.stream = sd.InputStream(
             samplerate=SAMPLE_RATE,
             channels=CHANNELS,
@@ -34,23 +156,100 @@ class AudioRecorder:
             dtype='int16'
         )
         self.stream.start()
+
+    # Opens and closes an input stream ahead of the first recording, so the audio device is initialized and opening
+    # the recording's stream is quick. The microphone is not kept open until start() or start_monitor() is called.
+    def warm_up(self):
+        with self.lock:
+            if self.stream:
+                return
+            stream = sd.InputStream(samplerate=SAMPLE_RATE, channels=CHANNELS, dtype='int16')
+            try:
+                stream.start()
+                stream.stop()
+            finally:
+                stream.close()
+        print("Microphone input device ready.")
+
+    # Starts the audio recording stream. If the microphone is being monitored, the open stream is reused.
+    # If on_segment is given, it is called from the audio thread with each part of the recording that ends
+    # in a pause (see SEGMENTED_TRANSCRIPTION); the rest is returned by get_final_segment().
+    def start(self, on_segment=None):
+        with self.lock:
+            # After a barge-in recording has already started; only the segment callback is attached
+            self.on_segment = on_segment
+            if self.is_recording:
+                return
+            self._begin_recording()
+            if not self.stream:
+                self._open_stream()
         print("Recording started.")
 
-    # Stops the audio recording stream.
+    # Starts listening for the user speaking over the assistant (barge-in).
+    # Once they have spoken for BARGE_IN_MIN_SPEECH_SECONDS, recording starts by itself, including the
+    # BARGE_IN_PREROLL_SECONDS before that moment, and on_barge_in is called from the audio thread.
+    def start_monitor(self, on_barge_in):
+        with self.lock:
+            if self.is_recording or self.is_monitoring:
+                return
+            self.on_barge_in = on_barge_in
+            self.barge_in_vad.reset()
+            self.monitor_buffer = CaptureBuffer(seconds=max(1.0, 4 * BARGE_IN_PREROLL_SECONDS))
+            self.is_monitoring = True
+            try:
+                self._open_stream()
+            except Exception as e:
+                self.is_monitoring = False
+                print(f"Could not open the microphone for barge-in: {e}")
+                return
+        print("Listening for barge-in.")
+
+    # Stops listening for barge-in (does nothing while recording).
+    def stop_monitor(self):
+        if self.is_monitoring:
+            self.stop()
+
+    # Stops the audio recording (or monitoring) stream.
     def stop(self):
-        if self.stream:
-            self.stream.stop()
-            self.stream.close()
-        self.is_recording = False
+        with self.lock:
+            stream, self.stream = self.stream, None
+            self.is_recording = False
+            self.is_monitoring = False
+        if stream:
+            stream.stop()
+            stream.close()
         print("Recording stopped.")
 
-    # Saves the recorded audio to a WAV file.
-    def save(self, filepath):
-        if not self.audio_data:
+    # Returns the recorded audio as int16 samples, with silence trimmed if enabled, or None if nothing was recorded.
+    # The result is a view of the capture buffer, so no copy of the recording is made.
+    def get_recording(self):
+        if not len(self.buffer):
             print("No audio data to save.")
             return None
         
-        recording = np.concatenate(self.audio_data, axis=0)
+        recording = self.buffer.view()
+        if self.vad and VAD_TRIM_SILENCE:
+            trimmed = self.vad.trim(recording)
+            print(f"Silence trimmed: {len(recording) / SAMPLE_RATE:.2f}s -> {len(trimmed) / SAMPLE_RATE:.2f}s")
+            recording = trimmed
+        return recording
+
+    # Returns the part of the recording after the last segment handed to on_segment, with silence trimmed,
+    # or None if no speech was detected in it.
+    def get_final_segment(self):
+        if self.vad and self.vad.speech_frames == self.segment_speech_frames:
+            return None
+        segment = self.buffer.view()[self.segment_start:]
+        if not len(segment):
+            return None
+        return self.vad.trim(segment) if self.vad else segment
+
+    # Saves the recorded audio to a WAV file.
+    def save(self, filepath, recording=None):
+        if recording is None:
+            recording = self.get_recording()
+        if recording is None:
+            return None
         
         try:
             write(filepath, SAMPLE_RATE, recording)
@@ -58,4 +257,10 @@ class AudioRecorder:
             return filepath
         except Exception as e:
             print(f"Failed to save audio to {filepath}: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    # Saves a recording to a WAV file in a background thread, off the transcription critical path.
+    def save_async(self, filepath, recording):
+        thread = threading.Thread(target=self.save, args=(filepath, recording), daemon=True)
+        thread.start()
+        return thread
\ No newline at end of file
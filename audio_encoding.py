@@ -0,0 +1,25 @@
+# audio_encoding.py
+import io
+from scipy.io.wavfile import write
+
+# Encodes int16 samples into an in-memory audio file for upload.
+# 'flac' (lossless) and 'ogg' (Opus) need the optional soundfile package; 'wav' or any failure falls back to WAV.
+# Returns the encoded bytes and a filename whose extension matches the encoding.
+def encode_audio(samples, sample_rate, audio_format="flac"):
+    if audio_format in ("flac", "ogg"):
+        try:
+            import soundfile as sf
+            buffer = io.BytesIO()
+            if audio_format == "flac":
+                sf.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+            else:
+                sf.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+            return buffer.getvalue(), f"audio.{audio_format}"
+        except ImportError:
+            print(f"soundfile is not installed; uploading WAV instead of {audio_format.upper()}.")
+        except Exception as e:
+            print(f"Could not encode audio as {audio_format.upper()} ({e}); uploading WAV instead.")
+
+    buffer = io.BytesIO()
+    write(buffer, sample_rate, samples)
+    return buffer.getvalue(), "audio.wav"
@@ -1,34 +1,327 @@
 # audio_player.py
-import pygame
+import sounddevice as sd
+import numpy as np
 import io
+import queue
+import threading
+import collections
+import time
+
+from config import PLAYBACK_LATENCY, PLAYBACK_DECODE_BLOCK_FRAMES, PLAYBACK_IDLE_SECONDS, PLAYBACK_DRAIN_MARGIN_SECONDS
+
+class PlaybackEngine:
+    """
+    Plays queued 16-bit mono PCM chunks in order on a low-latency sounddevice output stream.
+    The stream's callback pulls samples from the queue, so playback starts as soon as the first chunk is written and
+    consecutive chunks join sample to sample, without gaps. If the queue runs dry mid-playback and more audio follows
+    before the stream is stopped as idle, the gap is reported as an underrun. stop() discards everything queued at once.
+    A chunk may carry an on_start callback, called from the audio thread when the device starts consuming it.
+    """
+    # Initializes the engine; the output stream is opened with the first chunk.
+    def __init__(self, latency=PLAYBACK_LATENCY):
+        self.latency = latency
+        self.stream = None
+        self.sample_rate = None
+        self.chunks = collections.deque()
+        self.offset = 0  # Samples of the first chunk already played
+        self.buffered = 0  # Samples queued and not played yet
+        self.played = 0  # Samples played since playback started
+        self.playing = False
+        self.starved_at = None  # When the queue ran dry, until the stream is stopped as idle
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+        self.generation = 0  # Incremented by stop(); writes for an earlier generation are discarded
+        self.lock = threading.Lock()  # Guards the queue; held only briefly, since the callback waits for it
+        self.stream_lock = threading.Lock()  # Serializes opening, starting and aborting the stream
+        self.drained = threading.Event()
+        self.drained.set()
+
+    # Queues int16 samples at sample_rate, unless stop() was called since generation was read.
+    # If the sample rate changes, the audio already queued finishes before the stream is reopened at the new rate.
+    # on_start, if given, is called once the device starts consuming these samples.
+    def write(self, samples, sample_rate, generation=None, on_start=None):
+        if not len(samples):
+            return
+        if sample_rate != self.sample_rate:
+            if not self.wait_drained():
+                print("The audio output stalled; reopening it.")
+            self._clear_queue()
+            self._open_stream(sample_rate)
+        if not self.stream:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self.starved_at is not None:
+                gap = time.monotonic() - self.starved_at
+                self.underruns += 1
+                self.underrun_seconds += gap
+                print(f"Playback underrun: {gap * 1000:.0f} ms gap after {self.played / self.sample_rate:.2f}s.")
+                self.starved_at = None
+            self.chunks.append((samples, on_start))
+            self.buffered += len(samples)
+            self.playing = True
+            self.drained.clear()
+        with self.stream_lock:
+            try:
+                if self.stream and not self.stream.active:
+                    self.stream.start()
+            except Exception as e:
+                print(f"Could not start the audio output stream: {e}")
+                started = False
+            else:
+                started = True
+        if not started:
+            self.stop()
+
+    # Waits until the queued audio has played, for at most its duration plus PLAYBACK_DRAIN_MARGIN_SECONDS.
+    # Returns False if it hasn't by then, i.e. the device stopped consuming audio.
+    def wait_drained(self):
+        with self.lock:
+            remaining = self.buffered / self.sample_rate if self.sample_rate else 0.0
+        return self.drained.wait(remaining + PLAYBACK_DRAIN_MARGIN_SECONDS)
+
+    # Stops the stream once the queued audio has played, so it doesn't output silence indefinitely.
+    # Audio written afterwards starts a new playback rather than counting as an underrun. Returns True if idle.
+    def stop_if_idle(self):
+        with self.lock:
+            if self.playing:
+                return False
+            self.starved_at = None
+        with self.stream_lock:
+            if self.stream and self.stream.active:
+                self.stream.stop()
+        return True
+
+    # Discards the queued audio.
+    def _clear_queue(self):
+        with self.lock:
+            self.chunks.clear()
+            self.offset = 0
+            self.buffered = 0
+            self.playing = False
+            self.drained.set()
+
+    # Discards the queued audio and silences the stream immediately. Returns True if audio was playing.
+    def stop(self):
+        with self.lock:
+            self.generation += 1
+            interrupted = self.playing
+            self.played = 0
+            self.starved_at = None
+            self.underruns = 0
+            self.underrun_seconds = 0.0
+        self._clear_queue()
+        with self.stream_lock:
+            if interrupted and self.stream and self.stream.active:
+                # Aborting also drops the audio already handed to the device
+                self.stream.abort()
+        return interrupted
+
+    # Returns True while queued audio remains to be played.
+    def is_busy(self):
+        return self.playing
+
+    # Returns the playback position and queued audio in seconds, and the underruns since playback started.
+    def stats(self):
+        with self.lock:
+            sample_rate = self.sample_rate or 1
+            return {
+                "position": self.played / sample_rate,
+                "buffered": self.buffered / sample_rate,
+                "underruns": self.underruns,
+                "underrun_seconds": self.underrun_seconds,
+            }
+
+    # Stops playback and closes the output stream.
+    def close(self):
+        self.stop()
+        with self.stream_lock:
+            self._close_stream()
+
+    # Opens the output stream at a sample rate, replacing any stream at another rate.
+    def _open_stream(self, sample_rate):
+        with self.stream_lock:
+            self._close_stream()
+            try:
+                self.stream = sd.OutputStream(
+                    samplerate=sample_rate, channels=1, dtype="int16", latency=self.latency, callback=self._callback
+                )
+                self.sample_rate = sample_rate
+            except Exception as e:
+                print(f"Could not open the audio output stream: {e}")
+                self.stream = None
+                self.sample_rate = None
+
+    # Closes the output stream, if open. Called with stream_lock held.
+    def _close_stream(self):
+        stream, self.stream = self.stream, None
+        if stream:
+            try:
+                stream.abort()
+                stream.close()
+            except Exception as e:
+                print(f"Error closing the audio output stream: {e}")
+
+    # Fills the device buffer from the queue, with silence once it runs dry. Runs on the audio thread.
+    def _callback(self, outdata, frames, time_info, status):
+        filled = 0
+        started = []
+        with self.lock:
+            while filled < frames and self.chunks:
+                chunk, on_start = self.chunks[0]
+                if on_start and self.offset == 0:
+                    started.append(on_start)
+                count = min(frames - filled, len(chunk) - self.offset)
+                outdata[filled:filled + count, 0] = chunk[self.offset:self.offset + count]
+                filled += count
+                self.offset += count
+                if self.offset == len(chunk):
+                    self.chunks.popleft()
+                    self.offset = 0
+            self.buffered -= filled
+            if self.playing:
+                self.played += filled
+                if not self.chunks:
+                    self.playing = False
+                    self.starved_at = time.monotonic()
+                    self.drained.set()
+        outdata[filled:] = 0
+        for on_start in started:
+            on_start()
 
 class AudioPlayer:
     """
-    Plays audio data using pygame in a non-blocking way.
+    Plays audio data in a non-blocking way: segments are queued and played in order through a PlaybackEngine.
+    PCM segments go straight to the output stream; MP3 segments are decoded block by block while they play,
+    and played with pygame only if they can't be decoded. Both soundfile and pygame are optional, imported when needed.
     """
-    # Initializes the pygame mixer.
+    # Initializes the playback engine.
     def __init__(self):
+        self.segment_queue = queue.Queue()
+        self.playback_thread = None
+        self.lock = threading.Lock()
+        self.engine = PlaybackEngine()
+        self.mixer = None  # The pygame mixer, only initialized when first needed
+        self.decoder_available = True  # False once soundfile turned out not to be installed
+        self.handling_segment = False  # A segment has left the queue but may not have reached the engine yet
+        print("AudioPlayer initialized.")
+
+    # Starts playing audio from a byte stream (an MP3 file), after any audio already queued.
+    def play(self, audio_bytes, on_start=None):
+        self.enqueue(audio_bytes, on_start=on_start)
+
+    # Queues an audio segment to be played after the ones already queued.
+    # Segments are MP3 files, or raw 16-bit mono PCM chunks when audio_format is 'pcm'.
+    # on_start, if given, is called (from the audio thread) when the segment actually starts playing.
+    # Safe to call from background threads.
+    def enqueue(self, audio_bytes, audio_format="mp3", sample_rate=None, on_start=None):
+        if not audio_bytes:
+            return
+        with self.lock:
+            self.segment_queue.put((self.engine.generation, audio_bytes, audio_format, sample_rate, on_start))
+            if not self.playback_thread or not self.playback_thread.is_alive():
+                self.playback_thread = threading.Thread(target=self._playback_worker, daemon=True)
+                self.playback_thread.start()
+
+    # Hands queued segments to the engine in order, decoding MP3 segments as they go.
+    def _playback_worker(self):
+        while True:
+            try:
+                generation, audio_bytes, audio_format, sample_rate, on_start = self.segment_queue.get(
+                    timeout=PLAYBACK_IDLE_SECONDS
+                )
+            except queue.Empty:
+                # Nothing new for a while: the worker ends once the queued audio has played and the stream is stopped
+                with self.lock:
+                    if self.segment_queue.empty() and self.engine.stop_if_idle():
+                        self.playback_thread = None
+                        return
+                continue
+            # Segments queued before the last stop() are discarded
+            if generation != self.engine.generation:
+                continue
+            self.handling_segment = True
+            if audio_format == "pcm":
+                samples = np.frombuffer(audio_bytes[:len(audio_bytes) // 2 * 2], dtype=np.int16)
+                self.engine.write(samples, sample_rate, generation, on_start)
+            elif not self._decode_mp3(audio_bytes, generation, on_start):
+                self._play_with_pygame(audio_bytes, generation, on_start)
+            self.handling_segment = False
+
+    # Decodes an MP3 segment into the engine block by block, so playback starts after the first block.
+    # Returns False if the segment can't be decoded.
+    def _decode_mp3(self, audio_bytes, generation, on_start=None):
+        if not self.decoder_available:
+            return False
         try:
-            pygame.mixer.init()
-            print("AudioPlayer (pygame) initialized.")
+            import soundfile as sf
+        except ImportError:
+            print("soundfile is not installed; playing MP3 audio with pygame.")
+            self.decoder_available = False
+            return False
+        try:
+            with sf.SoundFile(io.BytesIO(audio_bytes)) as f:
+                for block in f.blocks(blocksize=PLAYBACK_DECODE_BLOCK_FRAMES, dtype="int16", always_2d=True):
+                    if generation != self.engine.generation:
+                        break
+                    samples = block[:, 0].copy() if block.shape[1] == 1 else block.mean(axis=1).astype(np.int16)
+                    self.engine.write(samples, f.samplerate, generation, on_start)
+                    on_start = None
+            return True
         except Exception as e:
-            print(f"Could not initialize pygame mixer: {e}")
+            print(f"Could not decode MP3 audio ({e}); playing it with pygame.")
+            return False
 
-    # Starts playing audio from a byte stream.
-    def play(self, audio_bytes):
-        if not audio_bytes or not pygame.mixer.get_init():
-            return
-        
+    # Plays an MP3 segment with pygame once the audio before it has finished, and waits for it to end.
+    def _play_with_pygame(self, audio_bytes, generation, on_start=None):
+        self.engine.wait_drained()
         try:
-            audio_stream = io.BytesIO(audio_bytes)
-            pygame.mixer.music.load(audio_stream)
-            pygame.mixer.music.play()
-            print("Started playback of assistant's response...")
+            if not self.mixer:
+                import pygame
+                pygame.mixer.init()
+                self.mixer = pygame.mixer
+            if generation != self.engine.generation:
+                return
+            self.mixer.music.load(io.BytesIO(audio_bytes))
+            self.mixer.music.play()
+            if on_start:
+                on_start()
+        except ImportError:
+            print("pygame is not installed; cannot play MP3 audio that soundfile can't decode.")
+            return
         except Exception as e:
             print(f"Error playing audio: {e}")
+            return
+        while self.mixer.music.get_busy() and generation == self.engine.generation:
+            time.sleep(0.01)
+
+    # Returns True while audio is playing or queued.
+    def is_busy(self):
+        if not self.segment_queue.empty() or self.handling_segment or self.engine.is_busy():
+            return True
+        return bool(self.mixer and self.mixer.music.get_busy())
+
+    # Returns the playback position, queued audio and underruns of the current response, in seconds.
+    def playback_stats(self):
+        return self.engine.stats()
 
     # Stops any currently playing audio.
     def stop(self):
-        if pygame.mixer.get_init() and pygame.mixer.music.get_busy():
-            pygame.mixer.music.stop()
-            print("Audio playback interrupted.")
\ No newline at end of file
+        with self.lock:
+            interrupted = self.engine.stop()
+            while not self.segment_queue.empty():
+                try:
+                    self.segment_queue.get_nowait()
+                except queue.Empty:
+                    break
+        if self.mixer and self.mixer.music.get_busy():
+            self.mixer.music.stop()
+            interrupted = True
+        if interrupted:
+            print("Audio playback interrupted.")
+
+    # Stops playback and releases the output stream.
+    def close(self):
+        self.stop()
+        self.engine.close()
@@ -0,0 +1,87 @@
+# bench_cleaner.py
+# Compares the response cleaner in utils.py against the original multi-pass implementation.
+# Run from the project root: python benchmarks/bench_cleaner.py
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import EXPRESSIONS_LIST
+from utils import parse_and_clean_llm_response, IncrementalTTSCleaner
+
+# The original implementation, kept verbatim as the reference.
+def legacy_parse_and_clean_llm_response(text: str) -> dict:
+    if not isinstance(text, str):
+        return {"for_ui": "", "for_tts": "", "expression": None}
+
+    raw_text = text.strip()
+    expression_found = None
+
+    for expression in EXPRESSIONS_LIST:
+        if raw_text.endswith(expression):
+            expression_found = expression
+            raw_text = raw_text[:-len(expression)].strip()
+            break
+
+    ui_text = re.sub(r'```.*?```', '', raw_text, flags=re.DOTALL)
+    ui_text = re.sub(r'`[^`]*`', '', ui_text)
+    ui_text = re.sub(r'!\[.*?\]\(.*?\)', '', ui_text)
+    ui_text = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', ui_text)
+    ui_text = ui_text.strip()
+
+    tts_text = raw_text
+    tts_text = re.sub(r'`[^`]*`', '', tts_text)
+    tts_text = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', tts_text)
+    tts_text = re.sub(r'\s?\*.*?\*\.?\s?', ' ', tts_text)
+    tts_text = re.sub(r'\*\*(.*?)\*\*', r'\1', tts_text)
+    tts_text = re.sub(r'^\s*[-*#]+\s*', '', tts_text, flags=re.MULTILINE)
+    tts_text = re.sub(r'[^\w\s.,¡!¿?áéíóúÁÉÍÓÚñÑ]', '', tts_text)
+    tts_text = re.sub(r'\s+', ' ', tts_text).strip()
+
+    return {
+        "for_ui": ui_text,
+        "for_tts": tts_text,
+        "expression": expression_found
+    }
+
+SAMPLES = {
+    "short": "¡Hola! ¿Qué tal estás hoy?\nHappy",
+    "actions": "*sonríe y se acomoda el pelo* Claro que sí, me encantaría ayudarte. *guiña un ojo*. ¿Empezamos?\nJoyous",
+    "markdown": (
+        "Aquí tienes un resumen:\n\n"
+        "# Pasos\n"
+        "- **Primero**, instala las dependencias con `pip install -r requirements.txt`.\n"
+        "- Después, revisa la [documentación oficial](https://example.com/docs).\n"
+        "* Por último, ejecuta el programa.\n\n"
+        "```python\nprint('hola')\n```\n"
+        "![captura](https://example.com/img.png) ¿Te sirve? *se cruza de brazos*\nDetermined"
+    ),
+    # Code is removed before actions are matched, so a '*' inside it neither opens nor closes one
+    "overlap": "Use x*y and `a*b` *mira `x\ny` aquí* a*. `b.b *x y\nNormal",
+}
+SAMPLES["long"] = "\n".join([SAMPLES["actions"].rsplit("\n", 1)[0], SAMPLES["markdown"].rsplit("\n", 1)[0]] * 10) + "\nNormal"
+
+# Feeds a response to the incremental cleaner in small deltas, like a streamed reply.
+def clean_streamed(text, delta_size=7):
+    cleaner = IncrementalTTSCleaner()
+    parts = [cleaner.feed(text[i:i + delta_size]) for i in range(0, len(text), delta_size)]
+    parts.append(cleaner.finish())
+    return " ".join("".join(parts).split())
+
+def main():
+    for name, text in SAMPLES.items():
+        legacy = legacy_parse_and_clean_llm_response(text)
+        current = parse_and_clean_llm_response(text)
+        streamed = clean_streamed(text)
+        status = "same output" if legacy == current and streamed == current["for_tts"] else "OUTPUT DIFFERS"
+
+        number = 20000 if len(text) < 1000 else 2000
+        legacy_time = min(timeit.repeat(lambda: legacy_parse_and_clean_llm_response(text), number=number, repeat=5)) / number
+        current_time = min(timeit.repeat(lambda: parse_and_clean_llm_response(text), number=number, repeat=5)) / number
+        print(f"{name:10} {len(text):5} chars  legacy {legacy_time * 1e6:8.1f} us  "
+              f"current {current_time * 1e6:8.1f} us  x{legacy_time / current_time:4.1f}  {status}")
+
+if __name__ == "__main__":
+    main()
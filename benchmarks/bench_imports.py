@@ -0,0 +1,84 @@
+# bench_imports.py
+# Measures the import time of the app with -X importtime and checks it against a budget.
+# Fails (exit status 1) if the import exceeds the budget or loads the SDK of a provider that is not configured.
+# Run from the project root: python benchmarks/bench_imports.py [--module assistant] [--budget-ms 800] [--runs 5]
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import LLM_PROVIDER, LLM_ROUTER_PROVIDERS, STT_PROVIDER, TTS_PROVIDER
+
+DEFAULT_BUDGET_MS = 800
+SLOWEST_SHOWN = 10
+
+# SDK modules loaded by each provider, as (kind, name) -> top modules.
+PROVIDER_SDKS = {
+    ("llm", "groq"): ["groq"],
+    ("llm", "gemini"): ["google.generativeai"],
+    ("llm", "openrouter"): ["openai"],
+    ("stt", "groq"): ["groq"],
+    ("tts", "google"): ["google.cloud.texttospeech"],
+}
+
+# Returns the SDK modules that the configured providers are allowed to load.
+def configured_sdks():
+    llm_providers = LLM_ROUTER_PROVIDERS if LLM_PROVIDER == "router" else [LLM_PROVIDER]
+    selected = [("llm", name) for name in llm_providers] + [("stt", STT_PROVIDER), ("tts", TTS_PROVIDER)]
+    return {sdk for provider in selected for sdk in PROVIDER_SDKS.get(provider, [])}
+
+# Imports a module in a fresh interpreter and returns {module: (self_us, cumulative_us)}.
+def measure_imports(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"'import {module}' failed:\n{result.stderr.strip().splitlines()[-1]}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        # Format: "import time:      self |  cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the import time of the app against a budget.")
+    parser.add_argument("--module", default="assistant", help="Module to import (default: assistant)")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Import time budget in milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="Imports measured; the fastest one is reported")
+    args = parser.parse_args()
+
+    # The fastest run is the least disturbed by the OS; all runs load the same modules
+    runs = [measure_imports(args.module) for _ in range(args.runs)]
+    timings = min(runs, key=lambda run: run[args.module][1])
+    total_ms = timings[args.module][1] / 1000
+
+    print(f"import {args.module}: {total_ms:.1f} ms ({len(timings)} modules), budget {args.budget_ms:.0f} ms")
+    print("Slowest modules (self time):")
+    for name, (self_us, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][0])[:SLOWEST_SHOWN]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    allowed = configured_sdks()
+    unexpected = sorted(
+        sdk for sdks in PROVIDER_SDKS.values() for sdk in sdks
+        if sdk in timings and sdk not in allowed
+    )
+    failed = False
+    if unexpected:
+        print(f"FAIL: SDKs of providers that are not configured were imported: {', '.join(sorted(set(unexpected)))}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import time over budget by {total_ms - args.budget_ms:.1f} ms")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# bench_replay.py
+# Replays recorded conversations through VoiceAssistant and the turn engine against local fake providers
+# (fake_servers.py), and reports the latency of each stage, end-to-end latency and throughput.
+# Each turn's recording (user_N.wav) is transcribed to the text in chat_history.json and answered with the recorded
+# reply, so runs are reproducible and need no network access or API keys.
+# Run from the project root: python benchmarks/bench_replay.py [--conversations conversations] [--streaming]
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from scipy.io import wavfile
+
+import config
+from fake_servers import FakeProviderServer, FakeLatency, DEFAULT_TRANSCRIPT, DEFAULT_REPLY
+
+SYNTHETIC_RECORDING_SECONDS = 3.0
+
+class ReplayRecorder:
+    """
+    Stands in for AudioRecorder in the turn engine: archives recordings like the app does.
+    """
+    # Saves a recording to a WAV file.
+    def save(self, filepath, recording):
+        wavfile.write(filepath, config.SAMPLE_RATE, recording)
+        return filepath
+
+class NullPlayer:
+    """
+    Stands in for AudioPlayer: accepts audio without playing it. Playback counts as started when the audio arrives.
+    """
+    # Discards a complete response's audio.
+    def play(self, audio_bytes, on_start=None):
+        self.enqueue(audio_bytes, on_start=on_start)
+
+    # Discards a streamed audio segment.
+    def enqueue(self, audio_bytes, audio_format="mp3", sample_rate=None, on_start=None):
+        if on_start:
+            on_start()
+
+    # Nothing to stop.
+    def stop(self):
+        pass
+
+    # Never busy, since nothing is played.
+    def is_busy(self):
+        return False
+
+# Returns the recorded turns of a conversation folder as [(wav_path, user_text, reply)], in order.
+# The N-th user message of chat_history.json is matched with user_N.wav and answered with the next assistant message.
+def load_conversation(folder):
+    history_path = os.path.join(folder, "chat_history.json")
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, encoding="utf-8") as f:
+        history = json.load(f)
+    turns = []
+    for i, msg in enumerate(history):
+        if msg.get("role") != "user":
+            continue
+        reply = next(
+            (m.get("content_raw") or m.get("content") for m in history[i + 1:] if m.get("role") == "assistant"), None
+        )
+        wav_path = os.path.join(folder, f"user_{len(turns)}.wav")
+        if not os.path.exists(wav_path):
+            break
+        turns.append((wav_path, msg["content"], reply))
+    return turns
+
+# Reads a recording as int16 samples shaped like the recorder's, resampled crudely if needed.
+def read_recording(wav_path):
+    sample_rate, samples = wavfile.read(wav_path)
+    if samples.dtype != np.int16:
+        samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16) if samples.dtype.kind == "f" else samples.astype(np.int16)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    if sample_rate != config.SAMPLE_RATE:
+        positions = np.linspace(0, len(samples) - 1, int(len(samples) * config.SAMPLE_RATE / sample_rate))
+        samples = samples[positions.astype(int)]
+    return samples
+
+# Points the app at the fake server and applies the benchmark settings. Must run before the app modules are imported.
+def configure_app(server, args, output_dir):
+    config.GROQ_BASE_URL = server.base_url
+    config.OPENROUTER_BASE_URL = f"{server.base_url}/api/v1"
+    config.MINIMAX_BASE_URL = server.base_url
+    config.LLM_PROVIDER = args.llm
+    config.STT_PROVIDER = "groq"
+    config.TTS_PROVIDER = "minimax"
+    config.STREAMING_RESPONSE = args.streaming
+    config.TTS_STREAMING = args.tts_streaming
+    config.TTS_CACHE_ENABLED = args.tts_cache
+    config.CONVERSATIONS_DIR = output_dir
+    config.METRICS_EXPORT = False
+    for key in ("GROQ_API_KEY", "OPENROUTER_API_KEY", "MINIMAX_API_KEY"):
+        os.environ[key] = "fake"
+
+# Replays the turns of one conversation on a new assistant and returns the number of failed turns.
+def replay_conversation(name, turns, server, stats):
+    from assistant import VoiceAssistant
+    from turn_engine import TurnEngine
+    from metrics import TurnMetrics
+
+    assistant = VoiceAssistant(f"replay_{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    for handler in (assistant.transcription_handler, assistant.llm_handler, assistant.tts_handler):
+        if hasattr(handler, "warm_up"):
+            handler.warm_up()
+    engine = TurnEngine(assistant, ReplayRecorder(), NullPlayer())
+    engine.latency_stats = stats
+    failed = 0
+
+    def on_update(turn_id, event, data):
+        nonlocal failed
+        if event == "failed":
+            failed += 1
+            print(f"Turn {turn_id} failed: {data.get('error')}")
+
+    for recording, user_text, reply in turns:
+        server.queue_turn(user_text, reply)
+        # Timed from here, as the app times turns from the moment the recording stops
+        engine.submit_turn(recording, on_update, None, TurnMetrics())
+        future, _ = engine.current_turn
+        future.result()
+    engine.close()
+    assistant.close()
+    return failed
+
+# Prints the percentiles of every stage in milliseconds.
+def print_report(stats, turn_count, failed, audio_seconds, wall_seconds):
+    print()
+    print(f"{'stage':20} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in sorted(stats.percentiles().items(), key=lambda item: item[1]["p50"]):
+        print(f"{name:20} {values['count']:6} {values['p50'] * 1000:9.1f} {values['p95'] * 1000:9.1f} {values['p99'] * 1000:9.1f}")
+    print()
+    print(f"{turn_count} turns ({failed} failed) in {wall_seconds:.1f}s: {turn_count / wall_seconds * 60:.1f} turns/min, "
+          f"{audio_seconds / wall_seconds:.2f}s of speech processed per second")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays recorded conversations against fake providers.")
+    parser.add_argument("--conversations", default=config.CONVERSATIONS_DIR, help="Folder of recorded conversations")
+    parser.add_argument("--limit", type=int, default=0, help="Maximum turns per conversation (0: all)")
+    parser.add_argument("--repeat", type=int, default=1, help="Times each conversation is replayed")
+    parser.add_argument("--synthetic", type=int, default=5, help="Turns of silence replayed if no recordings are found")
+    parser.add_argument("--llm", choices=["groq", "openrouter"], default="groq")
+    parser.add_argument("--streaming", action="store_true", help="Enable STREAMING_RESPONSE")
+    parser.add_argument("--tts-streaming", action="store_true", help="Enable TTS_STREAMING")
+    parser.add_argument("--tts-cache", action="store_true", help="Keep the TTS cache enabled")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Seconds to the first chat token")
+    parser.add_argument("--transcription-latency", type=float, default=0.3)
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="Seconds to the first audio")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the latency jitter")
+    parser.add_argument("--csv", help="Write one row per turn to this CSV file")
+    parser.add_argument("--json", help="Write the percentiles and turns to this JSON file")
+    args = parser.parse_args()
+
+    conversations = []
+    for folder in sorted(glob.glob(os.path.join(args.conversations, "*"))):
+        turns = load_conversation(folder)[:args.limit or None]
+        if turns:
+            conversations.append((os.path.basename(folder), [(read_recording(p), text, reply) for p, text, reply in turns]))
+    if not conversations:
+        print(f"No recorded turns in {args.conversations}; replaying {args.synthetic} synthetic turns.")
+        silence = np.zeros((int(config.SAMPLE_RATE * SYNTHETIC_RECORDING_SECONDS), config.CHANNELS), dtype=np.int16)
+        conversations = [("synthetic", [(silence, f"{DEFAULT_TRANSCRIPT} ({i})", DEFAULT_REPLY) for i in range(args.synthetic)])]
+
+    random.seed(args.seed)
+    server = FakeProviderServer(
+        chat=FakeLatency(args.chat_latency, args.jitter, 0.03),
+        transcription=FakeLatency(args.transcription_latency, args.jitter, 0.0),
+        tts=FakeLatency(args.tts_latency, args.jitter, 0.05)
+    ).start()
+    output_dir = tempfile.mkdtemp(prefix="replay_")
+    configure_app(server, args, output_dir)
+
+    from metrics import LatencyStats
+    stats = LatencyStats(window=sys.maxsize)
+    turn_count = failed = 0
+    audio_seconds = 0.0
+    start = time.monotonic()
+    for _ in range(args.repeat):
+        for name, turns in conversations:
+            print(f"Replaying {name} ({len(turns)} turns)...")
+            failed += replay_conversation(name, turns, server, stats)
+            turn_count += len(turns)
+            audio_seconds += sum(len(recording) for recording, _, _ in turns) / config.SAMPLE_RATE
+    wall_seconds = time.monotonic() - start
+    server.stop()
+
+    print_report(stats, turn_count, failed, audio_seconds, wall_seconds)
+    print(f"Requests served: {dict(server.request_counts)}. Replayed conversations saved to {output_dir}")
+    if args.csv:
+        stats.export_csv(args.csv)
+    if args.json:
+        stats.export_json(args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# fake_servers.py
+# Local stand-ins for the HTTP provider APIs, for benchmarking without network access or API keys:
+# the OpenAI-compatible chat completions API (Groq and OpenRouter), Whisper transcription (Groq) and MiniMax t2a_v2.
+# Each API answers after a configurable latency with jitter, and streams in chunks at a configurable interval.
+# Run from the project root to serve them until Ctrl+C: python benchmarks/fake_servers.py [--port 8900]
+# then point GROQ_BASE_URL, OPENROUTER_BASE_URL and MINIMAX_BASE_URL in config.py at the printed URLs.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import EXPRESSIONS_LIST
+
+DEFAULT_TRANSCRIPT = "Hola, ¿qué tal?"
+DEFAULT_REPLY = "*sonríe* Muy bien, gracias por preguntar. ¿Y tú qué tal estás hoy?\nHappy"
+CHAT_WORDS_PER_CHUNK = 2
+TTS_SECONDS_PER_CHARACTER = 0.06  # Length of the synthesized (silent) audio per character of text
+TTS_CHUNK_SECONDS = 0.2  # Audio per streamed TTS chunk
+
+class FakeLatency:
+    """
+    Response timing of one fake API: the delay before the response (or its first chunk), uniformly jittered,
+    and the interval between streamed chunks.
+    """
+    def __init__(self, first=0.3, jitter=0.05, chunk_interval=0.03):
+        self.first = first
+        self.jitter = jitter
+        self.chunk_interval = chunk_interval
+
+    # Waits as long as the API takes to start answering.
+    def wait_first(self):
+        time.sleep(max(0.0, self.first + random.uniform(-self.jitter, self.jitter)))
+
+    # Waits between two streamed chunks.
+    def wait_chunk(self):
+        time.sleep(self.chunk_interval)
+
+class FakeProviderServer:
+    """
+    One local HTTP server answering the chat, transcription and TTS APIs on every path they are called with.
+    Transcripts are served in the order they are queued; chat replies are looked up by the last user message,
+    so a recorded conversation can be replayed turn by turn. Both fall back to a default text.
+    """
+    # Creates the server; port 0 picks a free port.
+    def __init__(self, chat=None, transcription=None, tts=None, host="127.0.0.1", port=0):
+        self.latency = {
+            "chat": chat or FakeLatency(first=0.5, chunk_interval=0.03),
+            "transcription": transcription or FakeLatency(first=0.3, chunk_interval=0.0),
+            "tts": tts or FakeLatency(first=0.3, chunk_interval=0.05),
+        }
+        self.transcripts = collections.deque()
+        self.replies = {}
+        self.request_counts = collections.Counter()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    # Returns the base URL of the server.
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # Queues the transcript of the next recording and the reply to that transcript.
+    def queue_turn(self, transcript, reply=None):
+        self.transcripts.append(transcript)
+        if reply is not None:
+            self.replies[transcript] = reply
+
+    # Starts serving in a background thread.
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    # Stops serving.
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # Builds the request handler class bound to this server.
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                # Used by http_client.preconnect
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.split("?")[0]
+                if path.endswith("/chat/completions"):
+                    server.request_counts["chat"] += 1
+                    server._chat(self, json.loads(body))
+                elif path.endswith("/audio/transcriptions"):
+                    server.request_counts["transcription"] += 1
+                    server._transcription(self)
+                elif path.endswith("/t2a_v2"):
+                    server.request_counts["tts"] += 1
+                    server._tts(self, json.loads(body))
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+    # Answers a chat completion, as JSON or as a server-sent event stream.
+    def _chat(self, handler, request):
+        user_messages = [msg for msg in request.get("messages", []) if msg.get("role") == "user"]
+        last_user_text = user_messages[-1]["content"] if user_messages else ""
+        reply = self.replies.get(last_user_text, DEFAULT_REPLY)
+        prompt_tokens = sum(len(str(msg.get("content", "")).split()) for msg in request.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(reply.split()), "total_tokens": 0}
+        base = {"id": "fake", "created": int(time.time()), "model": request.get("model", "fake")}
+        latency = self.latency["chat"]
+        latency.wait_first()
+
+        if not request.get("stream"):
+            content = reply
+            if request.get("response_format", {}).get("type") == "json_schema":
+                content = json.dumps(self._structured_reply(reply), ensure_ascii=False)
+            message = {"role": "assistant", "content": content}
+            self._send_json(handler, {
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}]
+            })
+            return
+
+        self._start_stream(handler)
+        words = reply.split(" ")
+        for i in range(0, len(words), CHAT_WORDS_PER_CHUNK):
+            text = " ".join(words[i:i + CHAT_WORDS_PER_CHUNK]) + (" " if i + CHAT_WORDS_PER_CHUNK < len(words) else "")
+            choice = {"index": 0, "delta": {"content": text}, "finish_reason": None}
+            self._send_event(handler, {**base, "object": "chat.completion.chunk", "choices": [choice]})
+            latency.wait_chunk()
+        # Usage as OpenRouter ('usage') and Groq ('x_groq') report it
+        self._send_event(handler, {
+            **base, "object": "chat.completion.chunk", "choices": [], "usage": usage, "x_groq": {"usage": usage}
+        })
+        self._send_chunk(handler, b"data: [DONE]\n\n")
+        self._end_stream(handler)
+
+    # Splits a reply into the structured output requested by the Groq handler.
+    @staticmethod
+    def _structured_reply(reply):
+        text, _, last_line = reply.strip().rpartition("\n")
+        if last_line.strip() in EXPRESSIONS_LIST:
+            return {"response_text": text, "expression": last_line.strip()}
+        return {"response_text": reply, "expression": "Normal"}
+
+    # Answers a transcription with the next queued transcript.
+    def _transcription(self, handler):
+        transcript = self.transcripts.popleft() if self.transcripts else DEFAULT_TRANSCRIPT
+        self.latency["transcription"].wait_first()
+        self._send_json(handler, {"text": transcript})
+
+    # Answers a MiniMax t2a_v2 request with silent audio as long as the text would take to say, hex encoded.
+    def _tts(self, handler, request):
+        audio_setting = request.get("audio_setting", {})
+        sample_rate = audio_setting.get("sample_rate", 32000)
+        audio_format = audio_setting.get("format", "mp3")
+        duration = len(request.get("text", "")) * TTS_SECONDS_PER_CHARACTER
+        audio = self._fake_audio(duration, sample_rate, audio_format)
+        latency = self.latency["tts"]
+        latency.wait_first()
+
+        ok = {"status_code": 0, "status_msg": "success"}
+        if not request.get("stream"):
+            self._send_json(handler, {"data": {"audio": audio.hex(), "status": 2}, "base_resp": ok})
+            return
+
+        self._start_stream(handler)
+        chunk_size = max(2, int(sample_rate * TTS_CHUNK_SECONDS) * 2)
+        for i in range(0, len(audio), chunk_size):
+            self._send_event(handler, {"data": {"audio": audio[i:i + chunk_size].hex(), "status": 1}, "base_resp": ok})
+            latency.wait_chunk()
+        # The final event repeats the complete audio, as the real API does
+        self._send_event(handler, {"data": {"audio": audio.hex(), "status": 2}, "base_resp": ok})
+        self._end_stream(handler)
+
+    # Returns silent audio: 16-bit mono PCM, or MP3-sized filler bytes (not decodable) for other formats.
+    @staticmethod
+    def _fake_audio(duration, sample_rate, audio_format):
+        if audio_format == "pcm":
+            return bytes(int(duration * sample_rate) * 2)
+        return bytes(int(duration * 128000 / 8))
+
+    # Sends a complete JSON response.
+    @staticmethod
+    def _send_json(handler, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    # Starts a chunked server-sent event stream.
+    @staticmethod
+    def _start_stream(handler):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+    # Sends one server-sent event.
+    def _send_event(self, handler, data):
+        self._send_chunk(handler, f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    # Sends one chunk of a chunked response and flushes it to the client.
+    @staticmethod
+    def _send_chunk(handler, data):
+        handler.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        handler.wfile.flush()
+
+    # Ends a chunked response.
+    @staticmethod
+    def _end_stream(handler):
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves fake chat, transcription and TTS APIs.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Seconds to the first chat token")
+    parser.add_argument("--transcription-latency", type=float, default=0.3)
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="Seconds to the first audio")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Uniform jitter in seconds applied to each latency")
+    args = parser.parse_args()
+
+    server = FakeProviderServer(
+        chat=FakeLatency(args.chat_latency, args.jitter, 0.03),
+        transcription=FakeLatency(args.transcription_latency, args.jitter, 0.0),
+        tts=FakeLatency(args.tts_latency, args.jitter, 0.05),
+        port=args.port
+    ).start()
+    print(f"GROQ_BASE_URL = \"{server.base_url}\"")
+    print(f"OPENROUTER_BASE_URL = \"{server.base_url}/api/v1\"")
+    print(f"MINIMAX_BASE_URL = \"{server.base_url}\"")
+    print("Serving fake providers; press Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# chunked_tts.py
+import concurrent.futures
+
+from utils import split_for_tts
+from config import TTS_CHUNK_CHARACTERS, TTS_CHUNK_WORKERS, TTS_MAX_CHARACTERS
+
+# Returns MP3 audio without the ID3v2 tag at its start and the ID3v1 tag at its end, leaving only MPEG frames.
+def strip_id3(audio_content):
+    if audio_content[:3] == b"ID3" and len(audio_content) >= 10:
+        # The tag size is a 28-bit 'syncsafe' integer, excluding the 10-byte header and the optional 10-byte footer
+        size = 0
+        for byte in audio_content[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        size += 20 if audio_content[5] & 0x10 else 10
+        audio_content = audio_content[size:]
+    if len(audio_content) >= 128 and audio_content[-128:-125] == b"TAG":
+        audio_content = audio_content[:-128]
+    return audio_content
+
+# Joins the audio of consecutive chunks into one: raw PCM is concatenated as is, and MP3 chunks are joined frame to
+# frame, keeping only the first chunk's leading tag.
+def join_audio(audio_contents, audio_format="mp3"):
+    if audio_format == "pcm":
+        return b"".join(audio_contents)
+    return b"".join([audio_contents[0]] + [strip_id3(audio_content) for audio_content in audio_contents[1:]])
+
+class ChunkedTTSHandler:
+    """
+    Wraps a TTS handler so long texts are split at sentence or clause boundaries (see utils.split_for_tts) and the
+    chunks are synthesized in parallel, at most TTS_CHUNK_WORKERS at a time, then joined in order.
+    Streamed, each chunk is yielded as soon as it and the chunks before it are ready; with PCM the chunks play back
+    without gaps, and a handler that streams natively still streams the first chunk so playback starts just as early.
+    """
+    # Initializes the wrapper around a TTS handler. Wrappers may share an executor to bound parallelism across them.
+    def __init__(self, tts_handler, executor=None):
+        self.tts_handler = tts_handler
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=TTS_CHUNK_WORKERS, thread_name_prefix="tts-chunk"
+        )
+        self.chunk_characters = min(TTS_CHUNK_CHARACTERS, TTS_MAX_CHARACTERS)
+        self.supports_streaming = True
+        self.stream_format = getattr(tts_handler, "stream_format", "pcm")
+
+    # Delegates everything else (warm_up, cache_params, sample_rate, ...) to the wrapped handler.
+    def __getattr__(self, name):
+        return getattr(self.tts_handler, name)
+
+    # Synthesizes speech for the text, in parallel chunks if it is long. Returns None if any chunk fails.
+    def synthesize_speech(self, text, audio_format="mp3"):
+        chunks = split_for_tts(text, self.chunk_characters)
+        if len(chunks) <= 1:
+            return self.tts_handler.synthesize_speech(text, audio_format)
+        audio_contents = list(self.executor.map(
+            lambda chunk: self.tts_handler.synthesize_speech(chunk, audio_format), chunks
+        ))
+        if not all(audio_contents):
+            print(f"Chunked TTS failed: {audio_contents.count(None)} of {len(chunks)} chunks were not synthesized.")
+            return None
+        print(f"Speech synthesized in {len(chunks)} parallel chunks.")
+        return join_audio(audio_contents, audio_format)
+
+    # Streams speech chunk by chunk, in order. The generator returns True only if every chunk was synthesized.
+    def stream_speech(self, text, audio_format=None):
+        audio_format = audio_format or self.stream_format
+        chunks = split_for_tts(text, self.chunk_characters)
+        if not chunks:
+            return False
+        streams_natively = bool(getattr(self.tts_handler, "supports_streaming", False))
+        if len(chunks) == 1 and streams_natively:
+            return (yield from self.tts_handler.stream_speech(text, audio_format=audio_format))
+
+        # Every chunk not streamed is requested at once; the executor bounds how many run at the same time
+        pending = chunks[1:] if streams_natively else chunks
+        futures = [self.executor.submit(self.tts_handler.synthesize_speech, chunk, audio_format) for chunk in pending]
+        try:
+            if streams_natively and not (yield from self.tts_handler.stream_speech(chunks[0], audio_format=audio_format)):
+                return False
+            for i, future in enumerate(futures):
+                audio_content = future.result()
+                if not audio_content:
+                    print(f"Chunked TTS stopped: chunk {len(chunks) - len(futures) + i + 1} of {len(chunks)} failed.")
+                    return False
+                # Only the start of the stream may carry an MP3 tag
+                if audio_format != "pcm" and (streams_natively or i > 0):
+                    audio_content = strip_id3(audio_content)
+                yield audio_content
+            return True
+        finally:
+            # Chunks not started yet are dropped when the stream is abandoned (e.g. the turn is cancelled)
+            for future in futures:
+                future.cancel()
@@ -3,15 +3,73 @@
 # --- AUDIO RECORDING ---
 SAMPLE_RATE = 16000
 CHANNELS = 1
+CAPTURE_BUFFER_SECONDS = 120  # Preallocated recording length; longer recordings grow the buffer
+
+# --- AUDIO PLAYBACK ---
+# Responses play through one low-latency output stream fed from a queue of PCM chunks, so consecutive segments
+# play back without gaps. MP3 audio is decoded block by block as it plays; pygame is only used if that fails.
+PLAYBACK_LATENCY = "low"  # Output latency requested from the device: 'low', 'high' or seconds
+PLAYBACK_DECODE_BLOCK_FRAMES = 4096  # MP3 frames decoded at a time; playback starts after the first block
+PLAYBACK_START_TIMEOUT_SECONDS = 5  # How long a turn waits for its queued audio to start playing before finishing
+PLAYBACK_IDLE_SECONDS = 2.0  # The output stream stops this long after the queued audio has played; later audio starts afresh
+PLAYBACK_DRAIN_MARGIN_SECONDS = 2.0  # Extra time queued audio gets to finish before the output is considered stalled
+
+# --- WAVEFORM DISPLAY ---
+WAVEFORM_FPS = 30  # Maximum redraws per second while recording
+WAVEFORM_WINDOW_SECONDS = 1.0  # Length of the most recent audio shown
+
+# --- VOICE ACTIVITY DETECTION ---
+VAD_ENABLED = True
+VAD_AUTO_STOP = False  # Send the recording automatically once the user stops speaking, instead of waiting for Send
+VAD_TRIM_SILENCE = True  # Remove leading and trailing silence before the audio is saved and transcribed
+VAD_TRAILING_SILENCE_SECONDS = 1.2  # Silence after speech that ends the recording
+VAD_MIN_SPEECH_SECONDS = 0.25  # Speech required before the recording can end automatically
+VAD_PADDING_SECONDS = 0.2  # Silence kept around the speech when trimming
+VAD_FRAME_MS = 20
+VAD_ENERGY_THRESHOLD_DB = -45.0  # Minimum frame energy (dBFS) to count as speech
+VAD_NOISE_MARGIN_DB = 10.0  # Frames must also be this far above the estimated noise floor
+VAD_INITIAL_NOISE_FLOOR_DB = -60.0  # Noise floor assumed until non-speech frames have been measured
+VAD_MAX_ZCR = 0.35  # Quiet frames with more zero crossings than this are treated as hiss
+
+# --- BARGE-IN ---
+# When enabled, the microphone stays open while the assistant is thinking or speaking. Speaking over it stops
+# playback, cancels the turn and starts recording right away. Works best with headphones, since the assistant's
+# own voice from the speakers can otherwise trigger it.
+BARGE_IN_ENABLED = False
+BARGE_IN_MIN_SPEECH_SECONDS = 0.3  # Continuous speech needed to interrupt
+BARGE_IN_ENERGY_THRESHOLD_DB = -30.0  # Stricter than VAD_ENERGY_THRESHOLD_DB, to ignore speaker echo and background voices
+BARGE_IN_PREROLL_SECONDS = 0.5  # Audio from before the interruption kept at the start of the new recording
 
 # --- LLM PROVIDER ---
-# Choose provider: 'gemini', 'openrouter' o 'groq'.
+# Choose provider: 'gemini', 'openrouter' o 'groq', or 'router' to use the fastest healthy one of LLM_ROUTER_PROVIDERS.
 LLM_PROVIDER = "gemini"
 
+# --- LLM ROUTER ---
+# Used when LLM_PROVIDER is 'router'. Each turn goes to the provider with the lowest average latency that has not
+# been failing; if it hasn't answered by its p95 latency, the next provider is asked too and the first answer wins.
+LLM_ROUTER_PROVIDERS = ["groq", "gemini", "openrouter"]  # Providers without an API key are skipped
+LLM_ROUTER_HEDGE = True  # Send a second (hedged) request when the first one is slow
+LLM_ROUTER_HEDGE_MIN_SECONDS = 1.0  # Never hedge earlier than this
+LLM_ROUTER_HEDGE_DEFAULT_SECONDS = 4.0  # Hedge delay until a provider has enough latency samples
+LLM_ROUTER_LATENCY_WINDOW = 50  # Recent latencies kept per provider for the p95
+LLM_ROUTER_EWMA_ALPHA = 0.3  # Weight of the newest latency in the moving average
+LLM_ROUTER_MAX_FAILURES = 2  # Consecutive failures before a provider is skipped for a while
+LLM_ROUTER_COOLDOWN_SECONDS = 30.0
+
 # --- GROQ API ---
 TRANSCRIPTION_MODEL = "whisper-large-v3"
 GROQ_LLM_MODEL = "openai/gpt-oss-120b"
 TRANSCRIPTION_LANGUAGE = "es"  # ISO language code used for STT; set to "auto" to let Whisper auto-detect
+TRANSCRIPTION_UPLOAD_FORMAT = "flac"  # Encoding of recorded audio sent to Whisper: 'flac', 'ogg' (Opus) or 'wav'
+
+# --- SEGMENTED TRANSCRIPTION ---
+# When enabled (requires VAD_ENABLED), the recording is cut into segments at pauses while the user is still speaking,
+# and finished segments are transcribed in the background. After Send only the last segment is left to transcribe.
+SEGMENTED_TRANSCRIPTION = False
+SEGMENT_PAUSE_SECONDS = 0.5  # Silence that ends a segment
+SEGMENT_MIN_SECONDS = 3.0  # Shorter segments are not cut, since Whisper is less accurate on very short audio
+SEGMENT_OVERLAP_SECONDS = 0.3  # Each segment starts this long before the previous cut, so no word is lost at the boundary
+TRANSCRIPTION_WORKERS = 3  # Segments transcribed at the same time
 
 # --- OPENROUTER API ---
 OPENROUTER_LLM_MODEL = "qwen/qwen3-30b-a3b:free"
@@ -19,6 +77,10 @@ OPENROUTER_LLM_MODEL = "qwen/qwen3-30b-a3b:free"
 # --- GEMINI API ---
 GEMINI_LLM_MODEL = "gemini-2.5-flash"
 
+# --- STT PROVIDER ---
+# Choose provider: 'groq'. Providers are listed in providers.py, where plugins can register more.
+STT_PROVIDER = "groq"
+
 # --- TTS PROVIDER ---
 # Choose provider: 'google' or 'minimax'
 TTS_PROVIDER = "minimax"
@@ -27,6 +89,7 @@ TTS_PROVIDER = "minimax"
 
 VOICE_NAME = "en-US-Chirp3-HD-Achird"
 LANGUAGE_CODE = "en-US"
+GOOGLE_SAMPLE_RATE = 24000  # Sample rate of PCM audio (chunked TTS streaming)
 # VOICE_NAME = "es-ES-Chirp3-HD-Algenib"
 # LANGUAGE_CODE = "es-ES"
 
@@ -41,15 +104,112 @@ MINIMAX_VOICE_ID = "English_captivating_female1"  # English expressive narrator
 # MINIMAX_VOICE_ID = "Spanish_ExpressiveNarrator_female"  # Spanish female voice
 # MINIMAX_VOICE_ID = "female-shaonv"  # Chinese female voice (default)
 MINIMAX_MODEL = "speech-2.6-turbo"
-
-
-
+MINIMAX_STREAM_FORMAT = "pcm"  # Audio format used when TTS_STREAMING is enabled: 'pcm' (playback starts on the first chunk) or 'mp3'
+MINIMAX_SAMPLE_RATE = 32000
+
+# --- CONTEXT WINDOW ---
+CONTEXT_TOKEN_BUDGET = 4000  # Estimated tokens of system prompt and history sent to the LLM each turn
+CONTEXT_TRIM_RATIO = 0.75  # When over budget, older turns are dropped until this fraction of the budget is used
+CONTEXT_SUMMARY_ENABLED = True  # Fold dropped turns into a rolling summary, refreshed in the background
+
+# --- HTTP TRANSPORT ---
+# Shared by all provider handlers so connections are kept alive and reused between turns.
+HTTP_CONNECT_TIMEOUT = 5.0  # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 60.0  # Seconds to wait for a response
+HTTP_MAX_RETRIES = 2  # Retries for connection failures, rate limits and transient server errors
+HTTP_BACKOFF_FACTOR = 0.5  # First retry delay in seconds, doubled on each attempt
+HTTP_POOL_SIZE = 10  # Maximum pooled connections
+HTTP_KEEPALIVE_EXPIRY = 120.0  # Seconds an idle connection is kept open
+HTTP2_ENABLED = False  # Requires the 'h2' package (pip install httpx[http2])
+
+# --- PROVIDER ENDPOINTS ---
+# Base URLs of the HTTP APIs. Point them at local stand-ins (benchmarks/fake_servers.py) to run without the real services.
+GROQ_BASE_URL = "https://api.groq.com"  # Used for both transcription and the Groq LLM
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+MINIMAX_BASE_URL = "https://api.minimax.io"
 
 # --- FILE SYSTEM ---
 CONVERSATIONS_DIR = "conversations"
 
+# --- TRANSCRIPT ---
+TRANSCRIPT_MAX_MESSAGES = 100  # Messages kept in the chat widget; older ones are paged back in when scrolling up
+TRANSCRIPT_PAGE_SIZE = 20  # Messages restored per page
+
+# --- CONVERSATION LOG ---
+# chat_history.jsonl is appended by a background thread; chat_history.json is exported from it on exit.
+LOG_FSYNC_BATCH = 8  # Records written between fsyncs
+LOG_FSYNC_INTERVAL = 1.0  # Maximum seconds a written record waits for an fsync
+
 # --- TTS SETTINGS ---
-TTS_MAX_CHARACTERS = 500  # Maximum characters for TTS. If exceeded, TTS will be skipped.
+TTS_MAX_CHARACTERS = 500  # Maximum characters per TTS request. Longer texts are chunked, or skipped if TTS_CHUNKING is off.
+TTS_STREAMING = False  # Stream synthesized audio in chunks as it is generated (MiniMax; Google with TTS_CHUNKING).
+
+# --- CHUNKED TTS ---
+# Text longer than TTS_CHUNK_CHARACTERS is split at sentence or clause boundaries and the chunks are synthesized in
+# parallel, then joined in order: long replies take about as long as their slowest chunk instead of the sum of all.
+# With TTS_STREAMING each chunk is played as soon as it and the ones before it are ready, as PCM, without gaps.
+TTS_CHUNKING = True
+TTS_CHUNK_CHARACTERS = 200  # Maximum characters per chunk (at most TTS_MAX_CHARACTERS)
+TTS_CHUNK_WORKERS = 4  # Chunks synthesized at the same time
+
+# --- TTS CACHE ---
+# Synthesized speech is cached on disk, keyed by provider, voice, model, audio settings and text.
+TTS_CACHE_ENABLED = True
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Least recently used entries are evicted beyond this size
+
+# --- RESPONSE STREAMING ---
+# When enabled, the LLM response is streamed and each finished sentence is synthesized and played
+# while the rest of the response is still being generated.
+STREAMING_RESPONSE = False
+STREAMING_TTS_WORKERS = 2  # Streamed responses synthesized at the same time (a cancelled turn's may still be finishing)
+
+# --- TURN ENGINE ---
+# Turns run on a background event loop; starting a new recording cancels the turn in progress.
+TURN_DEADLINE_SECONDS = 90.0  # A turn still transcribing, generating or synthesizing after this long is cancelled
+TURN_WORKER_THREADS = 4  # Threads running the blocking provider calls
+
+# --- HEADLESS SERVER ---
+# server.py serves many conversations over WebSocket on one event loop (requires 'pip install websockets').
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_MAX_SESSIONS = 200  # Connections beyond this are refused with an error message
+SERVER_IO_WORKERS = 64  # Threads shared by all sessions for blocking provider calls
+SERVER_CPU_WORKERS = 4  # Threads shared by all sessions for audio encoding, archiving and response cleaning
+SERVER_TTS_WORKERS = 16  # Threads shared by all sessions synthesizing streamed responses (STREAMING_RESPONSE)
+SERVER_MAX_RECORDING_SECONDS = 60  # Audio received beyond this length in one turn is dropped
+
+# --- LATENCY METRICS ---
+# Every turn is timed stage by stage (record stop, WAV save, transcription, LLM, parsing, TTS, file write and
+# playback start); the timings are stored with the assistant message in the conversation log.
+METRICS_WINDOW = 200  # Recent turns kept for the p50/p95/p99 statistics
+METRICS_EXPORT = True  # On exit, write latency.csv (one row per turn) and latency.json (percentiles) to the conversation folder
+
+# --- WARM-UP ---
+# At startup the window is shown right away while the audio player, the assistant and its provider clients are
+# created at the same time in the background.
+WARMUP_CONNECTIONS = True  # Open the connections to the configured providers before the first turn
+WARMUP_MICROPHONE = True  # Open and close the microphone input stream once, so the first recording starts quickly
+WARMUP_WORKERS = 4
+
+# --- PROVIDER SCHEDULER ---
+# Admission control in front of the provider APIs, shared by every conversation in the process (see scheduler.py).
+# Requests are rate limited and capped per provider and API key, and queued fairly across conversations; when a
+# provider's queue is too long, the turn fails at once with a "busy" error instead of timing out.
+# Recommended for the headless server (server.py); a single desktop conversation doesn't need it.
+SCHEDULER_ENABLED = False
+# Limits per "<stt|llm|tts>:<provider>": requests per second, burst size and maximum concurrent requests
+SCHEDULER_LIMITS = {
+    "stt:groq": {"rate": 0.3, "burst": 5, "concurrency": 8},
+    "llm:groq": {"rate": 0.5, "burst": 10, "concurrency": 8},
+    "llm:openrouter": {"rate": 2.0, "burst": 20, "concurrency": 16},
+    "llm:gemini": {"rate": 0.25, "burst": 5, "concurrency": 4},
+    "tts:google": {"rate": 5.0, "burst": 20, "concurrency": 16},
+    "tts:minimax": {"rate": 1.0, "burst": 10, "concurrency": 8},
+}
+SCHEDULER_DEFAULT_LIMITS = {"rate": 1.0, "burst": 10, "concurrency": 8}  # For providers not listed above
+SCHEDULER_MAX_QUEUE = 100  # Requests waiting per provider before new ones are refused
+SCHEDULER_MAX_WAIT_SECONDS = 10  # Longest a request may wait to be admitted before it is refused
 
 # --- EXPRESSIONS ---
 EXPRESSIONS_LIST = [
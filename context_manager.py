@@ -0,0 +1,154 @@
+# context_manager.py
+import math
+import threading
+
+from utils import parse_and_clean_llm_response
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_TRIM_RATIO, CONTEXT_SUMMARY_ENABLED
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You summarize conversations between a user and an assistant. "
+    "Write a short factual summary in the third person that keeps names, facts, preferences "
+    "and open topics. Do not add anything that was not said."
+)
+
+class ContextWindowManager:
+    """
+    Keeps the messages sent to the LLM within a token budget.
+    The system prompt and the most recent turns are sent verbatim; older turns are folded into a rolling summary
+    that is refreshed in a background thread.
+    """
+    CHARS_PER_TOKEN = 4
+    TOKENS_PER_MESSAGE = 4  # Role and formatting overhead
+
+    # Initializes the manager. summarizer_factory creates the LLM handler used for summaries when first needed.
+    def __init__(self, summarizer_factory=None, token_budget=CONTEXT_TOKEN_BUDGET):
+        self.summarizer_factory = summarizer_factory
+        self.summarizer = None
+        self.token_budget = token_budget
+        self.token_scale = 1.0  # Calibrated from the prompt_tokens reported by the provider
+        self.lock = threading.Lock()
+
+        self.message_tokens = []  # Estimated tokens of each chat history message
+        self.window_start = 1  # Index of the first history message sent verbatim
+        self.window_tokens = 0  # Estimated tokens of the messages from window_start onwards
+
+        self.summary = ""
+        self.summarized_until = 1  # History messages before this index are covered by the summary
+        self.summary_thread = None
+        self.system_message = None  # Cached system message including the summary
+        self.system_message_key = None
+        self.last_estimate = 0
+
+    # Estimates the number of tokens in a text without calling a tokenizer.
+    def estimate_tokens(self, text):
+        if not text:
+            return 0
+        return math.ceil(len(text) / self.CHARS_PER_TOKEN * self.token_scale)
+
+    # Returns the text of a message as it is sent to the LLM.
+    @staticmethod
+    def _message_text(msg):
+        return (msg.get("content_raw") if msg.get("role") == "assistant" else msg.get("content")) or ""
+
+    # Returns the messages to send for the current turn: the system prompt (with summary) and the recent turns.
+    def build(self, chat_history):
+        if len(chat_history) < len(self.message_tokens):
+            self._reset()
+
+        # Count only the messages added since the last turn
+        for msg in chat_history[len(self.message_tokens):]:
+            tokens = self.estimate_tokens(self._message_text(msg)) + self.TOKENS_PER_MESSAGE
+            self.message_tokens.append(tokens)
+            if len(self.message_tokens) - 1 >= self.window_start:
+                self.window_tokens += tokens
+
+        system_message = self._system_message(chat_history[0])
+        system_tokens = self.estimate_tokens(system_message["content"]) + self.TOKENS_PER_MESSAGE
+
+        # Trim well below the budget, so the window (and any provider-side session) stays stable for several turns
+        if system_tokens + self.window_tokens > self.token_budget:
+            target = self.token_budget * CONTEXT_TRIM_RATIO
+            last_index = len(chat_history) - 1
+            while self.window_start < last_index and system_tokens + self.window_tokens > target:
+                self.window_tokens -= self.message_tokens[self.window_start]
+                self.window_start += 1
+            # Never start the window with an assistant reply
+            while self.window_start < last_index and chat_history[self.window_start].get("role") != "user":
+                self.window_tokens -= self.message_tokens[self.window_start]
+                self.window_start += 1
+            print(f"Context trimmed: sending history from message {self.window_start} (~{system_tokens + self.window_tokens} tokens).")
+            self._refresh_summary_async(chat_history)
+
+        self.last_estimate = system_tokens + self.window_tokens
+        return [system_message] + chat_history[self.window_start:]
+
+    # Adjusts the token estimate using the prompt size reported by the provider for the last request.
+    def record_usage(self, prompt_tokens):
+        if not prompt_tokens or not self.last_estimate:
+            return
+        ratio = prompt_tokens / self.last_estimate
+        self.token_scale = min(4.0, max(0.25, self.token_scale * (0.8 + 0.2 * ratio)))
+
+    # Returns the system message, with the current summary appended. The same object is reused until the summary changes.
+    def _system_message(self, base_message):
+        with self.lock:
+            summary = self.summary
+        key = (id(base_message), base_message.get("content"), summary)
+        if key != self.system_message_key:
+            content = base_message.get("content", "")
+            if summary:
+                content = f"{content}\n\nSummary of the earlier conversation:\n{summary}"
+            self.system_message = {"role": "system", "content": content}
+            self.system_message_key = key
+        return self.system_message
+
+    # Starts a background refresh of the summary if trimmed messages are not yet covered by it.
+    def _refresh_summary_async(self, chat_history):
+        if not CONTEXT_SUMMARY_ENABLED or not self.summarizer_factory:
+            return
+        if self.summary_thread and self.summary_thread.is_alive():
+            return
+        if self.summarized_until >= self.window_start:
+            return
+        messages = chat_history[self.summarized_until:self.window_start]
+        self.summary_thread = threading.Thread(
+            target=self._summarize, args=(messages, self.window_start), daemon=True
+        )
+        self.summary_thread.start()
+
+    # Folds the given messages into the rolling summary. Runs off the critical path.
+    def _summarize(self, messages, summarized_until):
+        try:
+            if not self.summarizer:
+                self.summarizer = self.summarizer_factory()
+            transcript = "\n".join(
+                f"{msg.get('role')}: {self._message_text(msg)}" for msg in messages
+                if msg.get("role") in ("user", "assistant") and self._message_text(msg)
+            )
+            with self.lock:
+                previous_summary = self.summary
+            prompt = f"Previous summary:\n{previous_summary or '(none)'}\n\nNew conversation turns:\n{transcript}\n\nWrite the updated summary."
+            result = self.summarizer.get_chat_completion([
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ])
+            if result.get("error") or not result.get("response"):
+                print(f"Context summary failed: {result.get('error')}")
+                return
+            summary = parse_and_clean_llm_response(result["response"])["for_ui"]
+            with self.lock:
+                self.summary = summary
+                self.summarized_until = summarized_until
+            print(f"Context summary refreshed (covers {summarized_until - 1} messages).")
+        except Exception as e:
+            print(f"Context summary failed: {e}")
+
+    # Forgets all state, e.g. when the history was replaced by a shorter one.
+    def _reset(self):
+        self.message_tokens = []
+        self.window_start = 1
+        self.window_tokens = 0
+        with self.lock:
+            self.summary = ""
+            self.summarized_until = 1
+        self.system_message_key = None
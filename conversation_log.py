@@ -0,0 +1,152 @@
+# conversation_log.py
+import os
+import json
+import time
+import queue
+import threading
+
+from config import LOG_FSYNC_BATCH, LOG_FSYNC_INTERVAL
+
+class ConversationLog:
+    """
+    Append-only JSONL log of a conversation, written by a background thread.
+    Each line is either a new message ({"op": "append", ...}) or an update to an earlier one ({"op": "update", ...}),
+    so saving a turn costs the same no matter how long the conversation is.
+    """
+    LOG_FILENAME = "chat_history.jsonl"
+    JSON_FILENAME = "chat_history.json"
+
+    # Initializes the log for a conversation folder, recovers any existing log and starts the writer thread.
+    def __init__(self, conversation_path):
+        self.log_path = os.path.join(conversation_path, self.LOG_FILENAME)
+        self.json_path = os.path.join(conversation_path, self.JSON_FILENAME)
+        self.recovered_messages = self.load(self.log_path)
+        self.record_queue = queue.Queue()
+        self.closed = False
+        self.writer_thread = threading.Thread(target=self._writer, daemon=True)
+        self.writer_thread.start()
+
+    # Queues a new message. The message is copied, so later changes must be logged with update().
+    def append(self, message):
+        self._put({"op": "append", "message": dict(message)})
+
+    # Queues an update of some fields of the message at the given index.
+    def update(self, index, fields):
+        self._put({"op": "update", "index": index, "fields": dict(fields)})
+
+    # Hands a record to the writer thread.
+    def _put(self, record):
+        if self.closed:
+            print("Conversation log is closed; record dropped.")
+            return
+        self.record_queue.put(record)
+
+    # Writes queued records, fsyncing every LOG_FSYNC_BATCH records or LOG_FSYNC_INTERVAL seconds.
+    def _writer(self):
+        unsynced = 0
+        last_sync = time.monotonic()
+        stop = False
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            while not stop:
+                # With records pending a sync, wake up in time to honor the sync interval
+                timeout = max(0.0, LOG_FSYNC_INTERVAL - (time.monotonic() - last_sync)) if unsynced else None
+                batch = []
+                try:
+                    batch.append(self.record_queue.get(timeout=timeout))
+                    # Write everything already queued with a single write
+                    while True:
+                        batch.append(self.record_queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+                records = [record for record in batch if record is not None]
+                stop = len(records) < len(batch)
+                if records:
+                    try:
+                        f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+                        f.flush()
+                        unsynced += len(records)
+                    except (OSError, TypeError, ValueError) as e:
+                        print(f"Failed to write conversation log: {e}")
+
+                if unsynced and (stop or unsynced >= LOG_FSYNC_BATCH or time.monotonic() - last_sync >= LOG_FSYNC_INTERVAL):
+                    try:
+                        os.fsync(f.fileno())
+                    except OSError as e:
+                        print(f"Failed to sync conversation log: {e}")
+                    unsynced = 0
+                    last_sync = time.monotonic()
+
+                for _ in batch:
+                    self.record_queue.task_done()
+
+    # Blocks until every queued record has been written.
+    def flush(self):
+        self.record_queue.join()
+
+    # Writes the remaining records and stops the writer thread.
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.record_queue.put(None)
+        self.writer_thread.join()
+
+    # Replays the log and returns the messages it describes.
+    # A truncated last line (e.g. after a crash) is cut off so later appends start on a clean line.
+    @classmethod
+    def load(cls, log_path):
+        messages = []
+        if not os.path.exists(log_path):
+            return messages
+        valid_bytes = 0
+        with open(log_path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Conversation log {log_path} is truncated after {len(messages)} messages; recovering.")
+                    break
+                if record.get("op") == "append":
+                    messages.append(record["message"])
+                elif record.get("op") == "update" and 0 <= record.get("index", -1) < len(messages):
+                    messages[record["index"]].update(record["fields"])
+                valid_bytes += len(line)
+        if valid_bytes < os.path.getsize(log_path):
+            with open(log_path, "r+b") as f:
+                f.truncate(valid_bytes)
+        return messages
+
+    # Returns the messages recovered from this conversation's log.
+    def recover(self):
+        self.flush()
+        return self.load(self.log_path)
+
+    # Exports the log as chat_history.json, in the same format the full history was always saved in.
+    def export_json(self):
+        messages = self.recover()
+        self._write_atomic(self.json_path, json.dumps(messages, ensure_ascii=False, indent=2))
+        return self.json_path
+
+    # Rewrites the log with one append record per message, dropping superseded updates.
+    # Must not run while other threads are still logging to this conversation.
+    def compact(self):
+        messages = self.recover()
+        lines = "".join(json.dumps({"op": "append", "message": msg}, ensure_ascii=False) + "\n" for msg in messages)
+        self.close()
+        self._write_atomic(self.log_path, lines)
+        self.closed = False
+        self.writer_thread = threading.Thread(target=self._writer, daemon=True)
+        self.writer_thread.start()
+
+    # Writes a file through a temporary file, so a crash never leaves it half written.
+    @staticmethod
+    def _write_atomic(path, content):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
@@ -1,7 +1,11 @@
 # google_cloud_api.py
+import io
+import wave
+
 from google.cloud import texttospeech
 
-from config import VOICE_NAME, LANGUAGE_CODE
+from config import VOICE_NAME, LANGUAGE_CODE, GOOGLE_SAMPLE_RATE
+from http_client import get_google_call_options
 
 class GoogleTTSHandler:
     """
@@ -9,22 +13,51 @@ class GoogleTTSHandler:
     """
     # Initializes the Google Cloud TTS client.
     def __init__(self):
+        self.supports_streaming = False
+        self.stream_format = "pcm"  # Format of chunks streamed by ChunkedTTSHandler
+        self.sample_rate = GOOGLE_SAMPLE_RATE
         try:
             self.client = texttospeech.TextToSpeechClient()
             self.voice_params = texttospeech.VoiceSelectionParams(
                 language_code=LANGUAGE_CODE, name=VOICE_NAME
             )
-            self.audio_config = texttospeech.AudioConfig(
-                audio_encoding=texttospeech.AudioEncoding.MP3
-            )
+            self.audio_configs = {
+                "mp3": texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3),
+                "pcm": texttospeech.AudioConfig(
+                    audio_encoding=texttospeech.AudioEncoding.LINEAR16, sample_rate_hertz=self.sample_rate
+                ),
+            }
+            # The gRPC channel stays open for the lifetime of the client; calls get explicit timeouts and bounded retries
+            self.call_options = get_google_call_options()
             print("Google Cloud TTS client initialized successfully.")
         except Exception as e:
             print(f"Error initializing Google Cloud TTS client: {e}")
             print("Please ensure you have authenticated with 'gcloud auth application-default login'")
             self.client = None
 
-    # Synthesizes speech from the input text.
-    def synthesize_speech(self, text):
+    # Returns everything besides the text that determines the synthesized audio, used for TTS cache keys.
+    def cache_params(self, audio_format="mp3"):
+        params = {
+            "provider": "google",
+            "voice": VOICE_NAME,
+            "language_code": LANGUAGE_CODE,
+            "audio_encoding": "MP3" if audio_format == "mp3" else "LINEAR16"
+        }
+        if audio_format == "pcm":
+            params["sample_rate"] = self.sample_rate
+        return params
+
+    # Opens the gRPC channel ahead of the first synthesis with a lightweight call.
+    def warm_up(self):
+        if self.client:
+            try:
+                self.client.list_voices(language_code=LANGUAGE_CODE, **self.call_options)
+            except Exception as e:
+                print(f"Could not warm up Google Cloud TTS: {e}")
+
+    # Synthesizes speech from the input text, as an MP3 file or, when audio_format is 'pcm', as raw 16-bit mono audio
+    # at self.sample_rate.
+    def synthesize_speech(self, text, audio_format="mp3"):
         if not self.client:
             print("TTS client not available.")
             return None
@@ -32,9 +65,14 @@ class GoogleTTSHandler:
         try:
             input_text = texttospeech.SynthesisInput(text=text)
             response = self.client.synthesize_speech(
-                input=input_text, voice=self.voice_params, audio_config=self.audio_config
+                input=input_text, voice=self.voice_params, audio_config=self.audio_configs[audio_format],
+                **self.call_options
             )
             print("Speech synthesized successfully.")
+            if audio_format == "pcm":
+                # LINEAR16 audio comes with a WAV header
+                with wave.open(io.BytesIO(response.audio_content), "rb") as f:
+                    return f.readframes(f.getnframes())
             return response.audio_content
         except Exception as e:
             print(f"Error during speech synthesis: {e}")
@@ -3,7 +3,11 @@ import os
 from groq import Groq
 from dotenv import load_dotenv
 
-from config import TRANSCRIPTION_LANGUAGE, TRANSCRIPTION_MODEL
+from config import (
+    TRANSCRIPTION_LANGUAGE, TRANSCRIPTION_MODEL, TRANSCRIPTION_UPLOAD_FORMAT, SAMPLE_RATE, HTTP_MAX_RETRIES, GROQ_BASE_URL
+)
+from http_client import get_http_client, get_timeout, preconnect
+from audio_encoding import encode_audio
 
 load_dotenv()
 
@@ -14,7 +18,13 @@ class GroqHandler:
     # Initializes the Groq API client.
     def __init__(self):
         try:
-            self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+            self.client = Groq(
+                api_key=os.environ.get("GROQ_API_KEY"),
+                base_url=GROQ_BASE_URL,
+                http_client=get_http_client(),
+                timeout=get_timeout(),
+                max_retries=HTTP_MAX_RETRIES
+            )
             if not self.client.api_key:
                 raise ValueError("GROQ_API_KEY not found in .env file or is invalid.")
             print("Groq client initialized successfully (for transcription).")
@@ -22,22 +32,37 @@ class GroqHandler:
             print(f"Error initializing Groq client: {e}")
             self.client = None
 
-    # Transcribes an audio file to text using the Whisper model.
-    def transcribe(self, filepath):
+    # Opens the connection to the Groq API ahead of the first transcription.
+    def warm_up(self):
+        if self.client:
+            preconnect(str(self.client.base_url))
+
+    # Transcribes audio to text using the Whisper model.
+    # Accepts a file path, an encoded audio file as bytes, or int16 samples, which are encoded in memory
+    # (TRANSCRIPTION_UPLOAD_FORMAT) so nothing has to be written to or read back from disk.
+    def transcribe(self, audio, filename="audio.wav"):
         if not self.client:
             return "Error: Groq client is not initialized."
 
-        print(f"Sending {filepath} for transcription...")
         try:
-            with open(filepath, "rb") as file:
-                request_args = {
-                    "file": (os.path.basename(filepath), file.read()),
-                    "model": TRANSCRIPTION_MODEL,
-                }
-                if TRANSCRIPTION_LANGUAGE:
-                    request_args["language"] = TRANSCRIPTION_LANGUAGE
-
-                transcription = self.client.audio.transcriptions.create(**request_args)
+            if isinstance(audio, str):
+                with open(audio, "rb") as file:
+                    upload = (os.path.basename(audio), file.read())
+            elif isinstance(audio, (bytes, bytearray, memoryview)):
+                upload = (filename, bytes(audio))
+            else:
+                encoded_audio, encoded_filename = encode_audio(audio, SAMPLE_RATE, TRANSCRIPTION_UPLOAD_FORMAT)
+                upload = (encoded_filename, encoded_audio)
+
+            print(f"Sending {upload[0]} ({len(upload[1]) / 1024:.1f} KB) for transcription...")
+            request_args = {
+                "file": upload,
+                "model": TRANSCRIPTION_MODEL,
+            }
+            if TRANSCRIPTION_LANGUAGE:
+                request_args["language"] = TRANSCRIPTION_LANGUAGE
+
+            transcription = self.client.audio.transcriptions.create(**request_args)
             print("Transcription completed successfully.")
             return transcription.text
         except Exception as e:
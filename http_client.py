@@ -0,0 +1,130 @@
+# http_client.py
+import time
+import threading
+import contextlib
+
+from config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_BACKOFF_FACTOR,
+    HTTP_POOL_SIZE, HTTP_KEEPALIVE_EXPIRY, HTTP2_ENABLED
+)
+
+# Status codes worth retrying: timeouts, rate limits and transient server errors.
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+MAX_BACKOFF_SECONDS = 10.0
+
+_client = None
+_client_lock = threading.Lock()
+
+# Returns the shared keep-alive HTTP client used by every provider handler.
+# Connections are pooled per host, so each turn reuses the TCP+TLS sessions of the previous ones.
+def get_http_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _create_http_client()
+        return _client
+
+# Creates the pooled HTTP client, enabling HTTP/2 if configured and available.
+def _create_http_client():
+    import httpx
+
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("HTTP/2 requested but the 'h2' package is not installed (pip install httpx[http2]). Using HTTP/1.1.")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_POOL_SIZE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    # No transport-level retries: each request is retried by a single layer, post() and stream_post() here or the
+    # SDK clients' own retry policy, so the retry budgets never multiply
+    transport = httpx.HTTPTransport(http2=http2, limits=limits)
+    print(f"Shared HTTP client initialized (HTTP/{'2' if http2 else '1.1'}, pool size {HTTP_POOL_SIZE}).")
+    return httpx.Client(transport=transport, timeout=get_timeout())
+
+# Returns the connect/read timeouts applied to every request.
+def get_timeout():
+    import httpx
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+# Returns the delay before the next retry, honoring the server's Retry-After header when present.
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+    return min(HTTP_BACKOFF_FACTOR * (2 ** attempt), MAX_BACKOFF_SECONDS)
+
+# Sends a POST request. A failed connection is waited out and returns None, unless it was the last attempt.
+# Nothing has reached the server then, so the request is always safe to repeat.
+def _send_post(client, url, attempt, stream=False, **kwargs):
+    import httpx
+    try:
+        return client.send(client.build_request("POST", url, **kwargs), stream=stream)
+    except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+        if attempt == HTTP_MAX_RETRIES:
+            raise
+        delay = _retry_delay(None, attempt)
+        print(f"Could not connect to {url} ({e}), retrying in {delay:.1f}s...")
+        time.sleep(delay)
+        return None
+
+# Sends a POST request on the shared client, retrying failed connections and retryable status codes with
+# exponential backoff.
+def post(url, **kwargs):
+    client = get_http_client()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = _send_post(client, url, attempt, **kwargs)
+        if response is None:
+            continue
+        if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+            return response
+        delay = _retry_delay(response, attempt)
+        print(f"HTTP {response.status_code} from {url}, retrying in {delay:.1f}s...")
+        time.sleep(delay)
+
+# Streams a POST response on the shared client. Retries happen before any of the body is consumed.
+@contextlib.contextmanager
+def stream_post(url, **kwargs):
+    client = get_http_client()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = _send_post(client, url, attempt, stream=True, **kwargs)
+        if response is None:
+            continue
+        try:
+            if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+                yield response
+                return
+            delay = _retry_delay(response, attempt)
+        finally:
+            response.close()
+        print(f"HTTP {response.status_code} from {url}, retrying in {delay:.1f}s...")
+        time.sleep(delay)
+
+# Opens a pooled connection to a server ahead of its first request, so that request skips DNS, TCP and TLS setup.
+# Any response (even an error status) means the connection is up. Returns False if the server could not be reached.
+def preconnect(url):
+    try:
+        get_http_client().head(url, timeout=HTTP_CONNECT_TIMEOUT)
+        return True
+    except Exception as e:
+        print(f"Could not pre-connect to {url}: {e}")
+        return False
+
+# Returns the timeout and bounded retry policy for Google API calls, which use their own gRPC channels.
+def get_google_call_options():
+    from google.api_core.retry import Retry
+    retry = Retry(
+        initial=HTTP_BACKOFF_FACTOR,
+        maximum=MAX_BACKOFF_SECONDS,
+        multiplier=2.0,
+        timeout=HTTP_READ_TIMEOUT
+    )
+    return {"timeout": HTTP_READ_TIMEOUT, "retry": retry}
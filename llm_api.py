@@ -2,20 +2,21 @@
 import os
 import json
 import enum
+import threading
 from dotenv import load_dotenv
 from abc import ABC, abstractmethod
 from typing_extensions import TypedDict
 
-# Import API clients
-from groq import Groq
-from openai import OpenAI
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
+# API clients (groq, openai, google.generativeai) are imported by the handlers that use them, so only the
+# configured provider's SDK is loaded
 
 # Import configuration
 from config import (
-    LLM_PROVIDER, GROQ_LLM_MODEL, OPENROUTER_LLM_MODEL, GEMINI_LLM_MODEL, EXPRESSIONS_LIST
+    LLM_PROVIDER, GROQ_LLM_MODEL, OPENROUTER_LLM_MODEL, GEMINI_LLM_MODEL, EXPRESSIONS_LIST, HTTP_MAX_RETRIES,
+    SYSTEM_PROMPT, GROQ_BASE_URL, OPENROUTER_BASE_URL
 )
+from http_client import get_http_client, get_timeout, get_google_call_options, preconnect
+from providers import create_provider
 
 # --- Structured Output Schema for Groq (JSON Schema format) ---
 GROQ_RESPONSE_SCHEMA = {
@@ -58,12 +59,64 @@ class GeminiResponseSchema(TypedDict):
     response_text: str
     expression: ExpressionEnum
 
+# --- Streaming instructions for providers that cannot stream structured output ---
+STREAMING_EXPRESSION_INSTRUCTION = (
+    "\n\nAfter your reply, add a final line containing only one of these expressions "
+    f"that best represents your current state: {', '.join(EXPRESSIONS_LIST)}."
+)
+
 load_dotenv()
 
+class IncrementalMessageConverter:
+    """
+    Converts a growing message history to a provider format, converting only the messages appended since the last call.
+    The cache is rebuilt when any known message is replaced or removed, or the last known one is edited in place.
+    """
+    # Initializes the converter with a function mapping one message to its converted form (or None to skip it).
+    def __init__(self, convert):
+        self.convert = convert
+        self.sources = []  # Message dictionaries already converted
+        self.results = []  # Converted form of each source message, None if skipped
+        self.converted = []  # Converted messages, skipped ones removed
+
+    # Returns True if the history starts with the very message objects already converted.
+    # Identity checks are cheap next to converting, so the whole prefix is compared; only the last known message,
+    # the one a turn may still be updating, is converted again to catch in-place edits.
+    def _extends_cache(self, message_history):
+        count = len(self.sources)
+        if count == 0 or len(message_history) < count:
+            return False
+        if any(msg is not source for msg, source in zip(message_history, self.sources)):
+            return False
+        return self.convert(message_history[count - 1]) == self.results[count - 1]
+
+    # Converts the history and returns (converted messages, number of newly converted messages, whether the cache was rebuilt).
+    def update(self, message_history):
+        rebuilt = not self._extends_cache(message_history)
+        if rebuilt:
+            self.sources, self.results, self.converted = [], [], []
+
+        new_messages = 0
+        for msg in message_history[len(self.sources):]:
+            result = self.convert(msg)
+            self.sources.append(msg)
+            self.results.append(result)
+            if result is not None:
+                self.converted.append(result)
+                new_messages += 1
+        return self.converted, new_messages, rebuilt
+
+    # Discards everything converted so far.
+    def reset(self):
+        self.sources, self.results, self.converted = [], [], []
+
 class LLMHandler(ABC):
     """Abstract base class for LLM handlers."""
     # Initializes the handler and its specific API client.
     def __init__(self):
+        self.openai_converter = IncrementalMessageConverter(self._to_openai_message)
+        # A cancelled turn's request may still be running when the next turn's starts
+        self.converter_lock = threading.Lock()
         self.client = self._initialize_client()
         if not self.client:
             raise ConnectionError(f"Failed to initialize {self.__class__.__name__} client.")
@@ -74,20 +127,46 @@ class LLMHandler(ABC):
     def _initialize_client(self):
         pass
         
+    # Opens the connection to the provider ahead of the first request. OpenAI-compatible clients share the pooled
+    # HTTP client, so a connection opened here is reused by the first completion.
+    def warm_up(self):
+        base_url = getattr(self.client, "base_url", None)
+        if base_url:
+            preconnect(str(base_url))
+
     # Abstract method to get a chat completion from the LLM.
     @abstractmethod
     def get_chat_completion(self, message_history):
         pass
+
+    # Forgets any state the last request left behind, when its response is not used (e.g. a hedged request that lost).
+    def discard_response(self):
+        pass
+
+    # Streams a chat completion, calling on_delta with each new piece of response text.
+    # Returns the same dictionary as get_chat_completion once the stream has finished.
+    # Providers without streaming support fall back to a single delta with the full response.
+    def stream_chat_completion(self, message_history, on_delta):
+        result = self.get_chat_completion(message_history)
+        if result.get("response"):
+            on_delta(result["response"])
+        return result
         
     # Prepares messages for OpenAI-formatted APIs (Groq, OpenRouter).
+    # Messages converted on previous turns are reused, so only new messages are processed.
     def _clean_messages_openai_format(self, message_history):
-        clean_messages = []
-        for msg in message_history:
-            role = msg.get("role")
-            content = msg.get("content_raw") if role == "assistant" else msg.get("content")
-            if role and content:
-                clean_messages.append({"role": role, "content": content})
-        return clean_messages
+        with self.converter_lock:
+            clean_messages, _, _ = self.openai_converter.update(message_history)
+            return list(clean_messages)
+
+    # Converts one message to the OpenAI format, or returns None if it has nothing to send.
+    @staticmethod
+    def _to_openai_message(msg):
+        role = msg.get("role")
+        content = msg.get("content_raw") if role == "assistant" else msg.get("content")
+        if role and content:
+            return {"role": role, "content": content}
+        return None
 
 class GroqLLMHandler(LLMHandler):
     """LLM handler for the Groq API with structured output support."""
@@ -96,7 +175,11 @@ class GroqLLMHandler(LLMHandler):
         try:
             api_key = os.environ.get("GROQ_API_KEY")
             if not api_key: raise ValueError("GROQ_API_KEY not found.")
-            return Groq(api_key=api_key)
+            from groq import Groq
+            return Groq(
+                api_key=api_key, base_url=GROQ_BASE_URL, http_client=get_http_client(), timeout=get_timeout(),
+                max_retries=HTTP_MAX_RETRIES
+            )
         except Exception as e:
             print(f"Error initializing Groq LLM client: {e}")
             return None
@@ -137,6 +220,41 @@ class GroqLLMHandler(LLMHandler):
             print(f"Error in Groq LLM chat: {e}")
             return {"response": None, "usage": None, "error": str(e)}
 
+    # Streams a chat completion from the Groq LLM.
+    # Groq cannot stream structured output, so the expression is requested as a final plain-text line.
+    def stream_chat_completion(self, message_history, on_delta):
+        print(f"Streaming message history to Groq LLM ('{GROQ_LLM_MODEL}')...")
+        messages = self._clean_messages_openai_format(message_history)
+        if messages and messages[0]["role"] == "system":
+            messages[0] = {"role": "system", "content": messages[0]["content"] + STREAMING_EXPRESSION_INSTRUCTION}
+        try:
+            stream = self.client.chat.completions.create(
+                messages=messages,
+                model=GROQ_LLM_MODEL,
+                max_tokens=500,
+                stream=True
+            )
+            response_parts = []
+            usage_info = None
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    response_parts.append(delta)
+                    on_delta(delta)
+                # Groq reports usage in the 'x_groq' field of the final chunk
+                x_groq = getattr(chunk, "x_groq", None)
+                usage = getattr(x_groq, "usage", None) if x_groq else None
+                if usage:
+                    usage_info = {
+                        "prompt_tokens": usage.prompt_tokens,
+                        "completion_tokens": usage.completion_tokens,
+                        "completion_time": getattr(usage, 'completion_time', None)
+                    }
+            return {"response": "".join(response_parts), "usage": usage_info, "error": None}
+        except Exception as e:
+            print(f"Error in Groq LLM stream: {e}")
+            return {"response": None, "usage": None, "error": str(e)}
+
 class OpenRouterLLMHandler(LLMHandler):
     """LLM handler for the OpenRouter API."""
     # Initializes the OpenRouter client.
@@ -144,7 +262,14 @@ class OpenRouterLLMHandler(LLMHandler):
         try:
             api_key = os.environ.get("OPENROUTER_API_KEY")
             if not api_key: raise ValueError("OPENROUTER_API_KEY not found.")
-            return OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
+            from openai import OpenAI
+            return OpenAI(
+                base_url=OPENROUTER_BASE_URL,
+                api_key=api_key,
+                http_client=get_http_client(),
+                timeout=get_timeout(),
+                max_retries=HTTP_MAX_RETRIES
+            )
         except Exception as e:
             print(f"Error initializing OpenRouter LLM client: {e}")
             return None
@@ -167,65 +292,171 @@ class OpenRouterLLMHandler(LLMHandler):
         except Exception as e:
             return {"response": None, "usage": None, "error": str(e)}
 
+    # Streams a chat completion from the OpenRouter LLM.
+    def stream_chat_completion(self, message_history, on_delta):
+        print(f"Streaming message history to OpenRouter ('{OPENROUTER_LLM_MODEL}')...")
+        try:
+            stream = self.client.chat.completions.create(
+                model=OPENROUTER_LLM_MODEL,
+                messages=self._clean_messages_openai_format(message_history),
+                max_tokens=500,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            response_parts = []
+            usage_info = None
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    response_parts.append(delta)
+                    on_delta(delta)
+                if chunk.usage:
+                    usage_info = {
+                        "prompt_tokens": chunk.usage.prompt_tokens,
+                        "completion_tokens": chunk.usage.completion_tokens
+                    }
+            return {"response": "".join(response_parts), "usage": usage_info, "error": None}
+        except Exception as e:
+            return {"response": None, "usage": None, "error": str(e)}
+
 class GeminiLLMHandler(LLMHandler):
     """LLM handler for the Google Gemini API with structured output support."""
-    # Initializes the Gemini client.
+    # Initializes the Gemini client, configured for the default system prompt and structured output.
     def _initialize_client(self):
         try:
             api_key = os.environ.get("GOOGLE_API_KEY")
             if not api_key: raise ValueError("GOOGLE_API_KEY not found.")
+            import google.generativeai as genai
+            from google.generativeai.types import HarmCategory, HarmBlockThreshold
             genai.configure(api_key=api_key)
-            return genai.GenerativeModel(GEMINI_LLM_MODEL)
+            self.genai = genai
+            # Safety settings to prevent unnecessary blocks.
+            self.safety_settings = {
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+            }
+            self.converter = IncrementalMessageConverter(self._to_gemini_message)
+            self.chat = None  # Chat session kept across turns
+            self.chat_turns = 0  # Number of turns in the chat session's history
+            self.call_id = 0  # Id of the latest request; only the latest one may commit its turn to the session
+            self.calls_in_flight = 0
+            self.state_lock = threading.Lock()
+            self.model_system_prompt = SYSTEM_PROMPT.strip()
+            return self._create_model(self.model_system_prompt)
         except Exception as e:
             print(f"Error initializing Gemini LLM client: {e}")
             return None
 
+    # Creates a model with the given system instruction and structured output configuration.
+    def _create_model(self, system_prompt):
+        # Gemini's API with structured output configuration using TypedDict
+        return self.genai.GenerativeModel(
+            GEMINI_LLM_MODEL, 
+            system_instruction=system_prompt,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": GeminiResponseSchema
+            }
+        )
+
+    # Opens the connection to the Gemini API ahead of the first request with a lightweight model lookup.
+    def warm_up(self):
+        try:
+            self.genai.get_model(f"models/{GEMINI_LLM_MODEL}", request_options=get_google_call_options())
+        except Exception as e:
+            print(f"Could not warm up Gemini: {e}")
+
+    # Converts one message to Gemini's format, or returns None if it has nothing to send.
+    @staticmethod
+    def _to_gemini_message(msg):
+        role = msg.get("role")
+        content = msg.get("content_raw") if role == "assistant" else msg.get("content")
+        # System messages are not part of Gemini's history; the first one becomes the system instruction
+        if not role or not content or role == "system":
+            return None
+        # Gemini uses 'model' instead of 'assistant' for the AI's role
+        gemini_role = "model" if role == "assistant" else "user"
+        return {"role": gemini_role, "parts": [content]}
+
+    # Returns the chat session, the message to send for this turn and the request's (id, turns sent) for _commit_turn.
+    # The existing session is reused when the history only grew by the new user message and no other request
+    # (e.g. of a cancelled turn) is still adding its reply to it; otherwise it is rebuilt.
+    def _start_chat(self, message_history):
+        with self.state_lock:
+            gemini_history, _, rebuilt = self.converter.update(message_history)
+            # Later system messages (e.g. error notes) are not sent
+            first_message = message_history[0] if message_history else {}
+            system_prompt = first_message.get("content", "").strip() if first_message.get("role") == "system" else None
+            self.call_id += 1
+            call = (self.call_id, len(gemini_history))
+
+            can_continue = (
+                self.chat is not None and not rebuilt
+                and self.calls_in_flight == 0
+                and system_prompt == self.model_system_prompt
+                and len(gemini_history) == self.chat_turns + 1
+                and gemini_history[-1]["role"] == "user"
+            )
+            self.calls_in_flight += 1
+            if can_continue:
+                return self.chat, gemini_history[-1]['parts'], call
+
+            print("Rebuilding Gemini chat session from the message history...")
+            if system_prompt != self.model_system_prompt:
+                self.client = self._create_model(system_prompt)
+                self.model_system_prompt = system_prompt
+            self.chat = self.client.start_chat(history=gemini_history[:-1]) # History without the last user message
+            return self.chat, gemini_history[-1]['parts'], call # Send only the last user message
+
+    # Records that the session now holds the sent message and the model's reply, unless a newer request has
+    # replaced the session since.
+    def _commit_turn(self, call, chat):
+        with self.state_lock:
+            if call[0] == self.call_id and chat is self.chat:
+                self.chat_turns = call[1] + 1
+
+    # Marks a request started by _start_chat as finished.
+    def _end_call(self):
+        with self.state_lock:
+            self.calls_in_flight -= 1
+
+    # Drops the chat session after a failed request, since its history may be incomplete.
+    # A request that has been superseded leaves the newer request's session alone.
+    def _discard_chat(self, call=None):
+        with self.state_lock:
+            if call is None or call[0] == self.call_id:
+                self.chat = None
+                self.chat_turns = 0
+
+    # Drops the chat session, which holds a reply the assistant did not record.
+    def discard_response(self):
+        self._discard_chat()
+
+    # Parses the structured JSON response into the "text\nExpression" format used by the assistant.
+    def _format_structured_response(self, response_text_json):
+        response_json = json.loads(response_text_json)
+        response_text = response_json.get("response_text", "")
+        expression = response_json.get("expression", "Normal")
+        
+        # Format response with expression appended (for compatibility with existing parsing)
+        return f"{response_text}\n{expression}"
+
     # Gets a chat completion from the Gemini LLM with structured output.
     def get_chat_completion(self, message_history):
         print(f"Sending message history to Gemini ('{GEMINI_LLM_MODEL}') with structured output...")
-        
-        system_prompt = None
-        gemini_history = []
-        for msg in message_history:
-            role = msg.get("role")
-            content = msg.get("content_raw") if role == "assistant" else msg.get("content")
-            
-            if role == "system":
-                system_prompt = content
-                continue
-            
-            # Gemini uses 'model' instead of 'assistant' for the AI's role
-            gemini_role = "model" if role == "assistant" else "user"
-            gemini_history.append({"role": gemini_role, "parts": [content]})
             
+        call = None
         try:
-            # Gemini's API with structured output configuration using TypedDict
-            model = genai.GenerativeModel(
-                GEMINI_LLM_MODEL, 
-                system_instruction=system_prompt,
-                generation_config={
-                    "response_mime_type": "application/json",
-                    "response_schema": GeminiResponseSchema
-                }
-            )
-            chat = model.start_chat(history=gemini_history[:-1]) # History without the last user message
+            chat, last_message, call = self._start_chat(message_history)
             response = chat.send_message(
-                gemini_history[-1]['parts'], # Send only the last user message
-                safety_settings={ # Safety settings to prevent unnecessary blocks
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                }
+                last_message, safety_settings=self.safety_settings, request_options=get_google_call_options()
             )
+            self._commit_turn(call, chat)
             
             # Parse structured JSON response
-            response_json = json.loads(response.text)
-            response_text = response_json.get("response_text", "")
-            expression = response_json.get("expression", "Normal")
-            
-            # Format response with expression appended (for compatibility with existing parsing)
-            formatted_response = f"{response_text}\n{expression}"
+            formatted_response = self._format_structured_response(response.text)
             
             # Gemini returns usage info in 'usage_metadata'
             usage_info = {
@@ -236,16 +467,128 @@ class GeminiLLMHandler(LLMHandler):
 
         except Exception as e:
             print(f"Error in Gemini LLM chat: {e}")
+            self._discard_chat(call)
             return {"response": None, "usage": None, "error": str(e)}
+        finally:
+            if call:
+                self._end_call()
+
+    # Streams a chat completion from the Gemini LLM, emitting the 'response_text' field as it arrives.
+    def stream_chat_completion(self, message_history, on_delta):
+        print(f"Streaming message history to Gemini ('{GEMINI_LLM_MODEL}') with structured output...")
+
+        call = None
+        try:
+            chat, last_message, call = self._start_chat(message_history)
+            # Retries are not applied to streams, since a retried stream would repeat the text already emitted
+            response = chat.send_message(
+                last_message, safety_settings=self.safety_settings, stream=True,
+                request_options={"timeout": get_google_call_options()["timeout"]}
+            )
+
+            field_stream = JsonStringFieldStream("response_text")
+            json_parts = []
+            for chunk in response:
+                json_parts.append(chunk.text)
+                delta = field_stream.feed(chunk.text)
+                if delta:
+                    on_delta(delta)
+            self._commit_turn(call, chat)
+
+            formatted_response = self._format_structured_response("".join(json_parts))
+            usage_info = {
+                "prompt_tokens": response.usage_metadata.prompt_token_count,
+                "completion_tokens": response.usage_metadata.candidates_token_count
+            }
+            return {"response": formatted_response, "usage": usage_info, "error": None}
+
+        except Exception as e:
+            print(f"Error in Gemini LLM stream: {e}")
+            self._discard_chat(call)
+            return {"response": None, "usage": None, "error": str(e)}
+        except BaseException:
+            # Stopped by on_delta (e.g. a cancelled turn): the session may hold a half-received reply
+            self._discard_chat(call)
+            raise
+        finally:
+            if call:
+                self._end_call()
+
+class JsonStringFieldStream:
+    """
+    Incrementally extracts the value of one top-level string field from a streamed JSON object.
+    """
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    # Initializes the extractor for the given field name.
+    def __init__(self, field_name):
+        self.key = json.dumps(field_name)
+        self.buffer = ""
+        self.pos = 0
+        self.state = "key"  # key -> value_start -> value -> done
+
+    # Feeds a chunk of JSON text and returns the newly decoded part of the field value.
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.state == "key":
+            key_index = self.buffer.find(self.key, self.pos)
+            if key_index == -1:
+                return ""
+            self.pos = key_index + len(self.key)
+            self.state = "value_start"
+        if self.state == "value_start":
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n:':
+                self.pos += 1
+            if self.pos >= len(self.buffer):
+                return ""
+            if self.buffer[self.pos] != '"':
+                self.state = "done"
+                return ""
+            self.pos += 1
+            self.state = "value"
+        if self.state != "value":
+            return ""
+
+        decoded = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if char == '"':
+                self.state = "done"
+                self.pos += 1
+                break
+            if char != '\\':
+                decoded.append(char)
+                self.pos += 1
+                continue
+            # Wait for the rest of an escape sequence split across chunks
+            if self.pos + 1 >= len(self.buffer):
+                break
+            escape = self.buffer[self.pos + 1]
+            if escape == 'u':
+                hex_digits = self.buffer[self.pos + 2:self.pos + 6]
+                if len(hex_digits) < 4:
+                    break
+                code_point = int(hex_digits, 16)
+                # Surrogate pairs need the second escape before they can be decoded
+                if 0xD800 <= code_point < 0xDC00:
+                    low = self.buffer[self.pos + 6:self.pos + 12]
+                    if len(low) < 6:
+                        break
+                    if low.startswith('\\u'):
+                        low_point = int(low[2:], 16)
+                        code_point = 0x10000 + ((code_point - 0xD800) << 10) + (low_point - 0xDC00)
+                        self.pos += 6
+                decoded.append(chr(code_point))
+                self.pos += 6
+            else:
+                decoded.append(self.ESCAPES.get(escape, escape))
+                self.pos += 2
+        return "".join(decoded)
 
 # Factory function to get the configured LLM handler.
 def get_llm_handler() -> LLMHandler:
-    provider = LLM_PROVIDER.lower()
-    if provider == 'groq':
-        return GroqLLMHandler()
-    elif provider == 'gemini':
-        return GeminiLLMHandler()
-    elif provider == 'openrouter':
-        return OpenRouterLLMHandler()
-    else:
-        raise ValueError(f"Unsupported LLM provider: '{LLM_PROVIDER}'. Check config.py.")
\ No newline at end of file
+    return create_llm_handler(LLM_PROVIDER)
+
+# Creates the handler of an LLM provider by name ('groq', 'gemini', 'openrouter', 'router' or a registered plugin).
+def create_llm_handler(provider) -> LLMHandler:
+    return create_provider("llm", provider)
@@ -0,0 +1,264 @@
+# llm_router.py
+import time
+import threading
+import collections
+import concurrent.futures
+
+from llm_api import LLMHandler, create_llm_handler
+from scheduler import ProviderBusy
+from config import (
+    LLM_ROUTER_PROVIDERS, LLM_ROUTER_HEDGE, LLM_ROUTER_HEDGE_MIN_SECONDS, LLM_ROUTER_HEDGE_DEFAULT_SECONDS,
+    LLM_ROUTER_LATENCY_WINDOW, LLM_ROUTER_EWMA_ALPHA, LLM_ROUTER_MAX_FAILURES, LLM_ROUTER_COOLDOWN_SECONDS
+)
+
+MIN_SAMPLES_FOR_P95 = 5
+
+class HedgeLost(Exception):
+    """
+    Raised inside a streamed request to abort it once another provider has started answering.
+    """
+
+class ProviderStats:
+    """
+    Latency and error statistics of one provider: a moving average and recent samples for percentiles.
+    """
+    # Initializes empty statistics.
+    def __init__(self, window=LLM_ROUTER_LATENCY_WINDOW):
+        self.ewma = None
+        self.latencies = collections.deque(maxlen=window)
+        self.error_rate = 0.0  # Moving average of failures (0 to 1)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+
+    # Records the latency of a successful request.
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.ewma = latency if self.ewma is None else self.ewma + LLM_ROUTER_EWMA_ALPHA * (latency - self.ewma)
+        self.error_rate *= 1 - LLM_ROUTER_EWMA_ALPHA
+        self.consecutive_failures = 0
+
+    # Records a failed request, putting the provider in cooldown after repeated failures.
+    def record_failure(self, now):
+        self.error_rate += LLM_ROUTER_EWMA_ALPHA * (1 - self.error_rate)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= LLM_ROUTER_MAX_FAILURES:
+            self.cooldown_until = now + LLM_ROUTER_COOLDOWN_SECONDS
+
+    # Returns the given percentile (0-100) of the recent latencies, or None without enough samples.
+    def percentile(self, percent):
+        if len(self.latencies) < MIN_SAMPLES_FOR_P95:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    # Returns True unless the provider is in cooldown.
+    def is_healthy(self, now):
+        return now >= self.cooldown_until
+
+class _Attempt:
+    """
+    One request of a turn to one provider.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.start = time.monotonic()
+        self.first_delta = None
+        self.aborted = False  # Stopped by the router or the caller, so its outcome says nothing about the provider
+        self.lost = False  # Another attempt's result was used; whatever this one left in its handler is discarded
+        self.finished = False
+        self.busy = False  # Refused by the provider's scheduler, so it says nothing about the provider's health
+
+class LLMRouter(LLMHandler):
+    """
+    Routes each request to the fastest healthy provider among several LLM handlers.
+    Keeps a latency moving average, recent percentiles and error counts per provider. If the chosen provider has not
+    answered (or, when streaming, started answering) by its p95 latency, a hedged request goes to the next provider and
+    whichever answers first is used. Failed requests fail over to the next provider.
+    """
+    # Initializes a handler for each configured provider; providers that fail to initialize are skipped.
+    def __init__(self, providers=LLM_ROUTER_PROVIDERS, hedge=LLM_ROUTER_HEDGE):
+        self.providers = providers
+        self.hedge = hedge
+        self.lock = threading.Lock()
+        super().__init__()
+        self.handlers = self.client
+        self.stats = {name: ProviderStats() for name in self.handlers}
+        # Handlers may keep per-conversation state (e.g. Gemini's chat session), so each runs one request at a time
+        self.handler_locks = {name: threading.Lock() for name in self.handlers}
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2 * len(self.handlers), thread_name_prefix="llm-router"
+        )
+        print(f"LLM router providers: {', '.join(self.handlers)}")
+
+    # Creates the provider handlers. An empty result makes the base class raise ConnectionError.
+    def _initialize_client(self):
+        handlers = {}
+        for name in self.providers:
+            try:
+                handlers[name] = create_llm_handler(name)
+            except Exception as e:
+                print(f"LLM router: skipping {name}: {e}")
+        return handlers
+
+    # Opens the connections of all providers at the same time.
+    def warm_up(self):
+        list(self.executor.map(lambda handler: handler.warm_up(), self.handlers.values()))
+
+    # Gets a chat completion from the fastest healthy provider, hedging if it is slow.
+    def get_chat_completion(self, message_history):
+        def call(attempt):
+            return self.handlers[attempt.name].get_chat_completion(message_history)
+        return self._route(call, {"winner": None})
+
+    # Streams a chat completion. Only the first provider to produce text is streamed to on_delta; the others are aborted.
+    def stream_chat_completion(self, message_history, on_delta):
+        state = {"winner": None}
+        def call(attempt):
+            def attempt_on_delta(delta):
+                with self.lock:
+                    if attempt.first_delta is None:
+                        attempt.first_delta = time.monotonic()
+                    if state["winner"] is None:
+                        state["winner"] = attempt.name
+                    won = state["winner"] == attempt.name
+                if not won:
+                    attempt.aborted = True
+                    raise HedgeLost()
+                try:
+                    on_delta(delta)
+                except BaseException:
+                    attempt.aborted = True
+                    raise
+            return self.handlers[attempt.name].stream_chat_completion(message_history, attempt_on_delta)
+        return self._route(call, state)
+
+    # Runs a request on the ranked providers and returns the first successful result (or the streaming winner's).
+    # Raises ProviderBusy if every provider tried was too busy to take the request.
+    def _route(self, call, state):
+        ranked = self._ranked_providers()
+        pending = {}
+
+        def launch(name):
+            attempt = _Attempt(name)
+            with self.lock:
+                self.stats[name].in_flight += 1
+            pending[self.executor.submit(self._run_attempt, attempt, call)] = attempt
+
+        primary = ranked.pop(0)
+        print(f"LLM router: using {primary}.")
+        launch(primary)
+        hedge_delay = self._hedge_delay(primary)
+        hedge_at = time.monotonic() + hedge_delay if self.hedge and ranked else None
+        last_result = None
+        busy_error = None
+
+        while pending:
+            timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+            done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                hedge_at = None
+                name = self._next_idle(ranked) if state["winner"] is None else None
+                if name:
+                    ranked.remove(name)
+                    print(f"LLM router: no answer from {primary} after {hedge_delay:.1f}s, hedging with {name}.")
+                    launch(name)
+                continue
+
+            for future in done:
+                attempt = pending.pop(future)
+                try:
+                    result = future.result()
+                except BaseException:
+                    # The caller stopped the request (e.g. its turn was cancelled): nothing will be used
+                    self._discard_losers(pending.values())
+                    raise
+                # Once a stream has started, its result is final, even if it failed half way
+                if state["winner"] == attempt.name or (state["winner"] is None and not result.get("error")):
+                    self._discard_losers(pending.values())
+                    return result
+                if attempt.busy:
+                    busy_error = result["error"]
+                elif not attempt.aborted:
+                    last_result = result
+
+            # Every request so far has failed: fail over to the next provider
+            if not pending and ranked and state["winner"] is None:
+                name = ranked.pop(0)
+                print(f"LLM router: failing over to {name}.")
+                launch(name)
+
+        if last_result is None and busy_error:
+            raise ProviderBusy(busy_error)
+        return last_result or {"response": None, "usage": None, "error": "No LLM provider answered."}
+
+    # Returns the first of the ranked providers with no request running, or None. A hedge never waits for a provider.
+    def _next_idle(self, ranked):
+        with self.lock:
+            return next((name for name in ranked if self.stats[name].in_flight == 0), None)
+
+    # Marks the attempts whose results won't be used, discarding the state of those that have already finished.
+    # Those still running discard theirs when they finish.
+    def _discard_losers(self, attempts):
+        finished = []
+        with self.lock:
+            for attempt in attempts:
+                attempt.lost = True
+                if attempt.finished:
+                    finished.append(attempt)
+        for attempt in finished:
+            self.handlers[attempt.name].discard_response()
+
+    # Runs one attempt in a worker thread, after any earlier request to the same handler, and records its outcome.
+    # Exceptions raised by the caller's on_delta (e.g. TurnCancelled) are passed on once the outcome is recorded.
+    def _run_attempt(self, attempt, call):
+        result = {"response": None, "usage": None, "error": "Request stopped."}
+        try:
+            with self.handler_locks[attempt.name]:
+                try:
+                    result = call(attempt)
+                except ProviderBusy as e:
+                    attempt.busy = attempt.aborted = True
+                    result = {"response": None, "usage": None, "error": str(e)}
+                except Exception as e:
+                    result = {"response": None, "usage": None, "error": str(e)}
+                finally:
+                    with self.lock:
+                        attempt.finished = True
+                        lost = attempt.lost
+                    if lost:
+                        self.handlers[attempt.name].discard_response()
+        finally:
+            self._record_outcome(attempt, result)
+        return result
+
+    # Updates the provider's statistics with the outcome of a finished attempt.
+    def _record_outcome(self, attempt, result):
+        now = time.monotonic()
+        with self.lock:
+            stats = self.stats[attempt.name]
+            stats.in_flight -= 1
+            if result.get("error") and not attempt.aborted:
+                stats.record_failure(now)
+                print(f"LLM router: {attempt.name} failed ({stats.consecutive_failures} in a row).")
+            elif attempt.first_delta is not None:
+                # Streams are timed to their first text (what the user waits for), even if aborted afterwards
+                stats.record_success(attempt.first_delta - attempt.start)
+            elif not attempt.aborted:
+                stats.record_success(now - attempt.start)
+
+    # Returns the provider names, best first: healthy before failing, idle before busy, then by average latency.
+    # Providers without samples yet come first, so each one gets measured.
+    def _ranked_providers(self):
+        now = time.monotonic()
+        with self.lock:
+            def rank(name):
+                stats = self.stats[name]
+                return (not stats.is_healthy(now), stats.in_flight > 0, stats.ewma or 0.0)
+            return sorted(self.handlers, key=rank)
+
+    # Returns how long to wait for a provider before hedging: its p95 latency, within configured bounds.
+    def _hedge_delay(self, name):
+        with self.lock:
+            p95 = self.stats[name].percentile(95)
+        return max(LLM_ROUTER_HEDGE_MIN_SECONDS, p95 if p95 is not None else LLM_ROUTER_HEDGE_DEFAULT_SECONDS)
@@ -0,0 +1,115 @@
+# metrics.py
+import csv
+import json
+import time
+import threading
+import contextlib
+import collections
+
+from config import METRICS_WINDOW
+
+PERCENTILES = (50, 95, 99)
+
+class TurnMetrics:
+    """
+    Latency spans of one turn, measured with the monotonic clock from the moment the user stops recording.
+    Spans (e.g. 'transcribe', 'llm', 'tts') have a duration; a stage that runs several times in a turn, like TTS of
+    each sentence, adds up. Marks (e.g. 'playback_start') record how long after the start something first happened.
+    Safe to use from several threads.
+    """
+    # Initializes the metrics; the turn starts now.
+    def __init__(self):
+        self.start = time.monotonic()
+        self.durations = {}
+        self.marks = {}
+        self.message_index = None  # Index of the assistant message in the chat history, once recorded
+        self.lock = threading.Lock()
+
+    # Context manager that adds the time spent in its block to a span.
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    # Returns a function that runs function and adds its time to a span, e.g. for work handed to a thread.
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            with self.span(name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    # Adds a duration in seconds to a span.
+    def add(self, name, seconds):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    # Records the first time something happens in the turn; later calls with the same name are ignored.
+    def mark(self, name):
+        offset = time.monotonic() - self.start
+        with self.lock:
+            self.marks.setdefault(name, offset)
+
+    # Returns the spans and marks in seconds, rounded to the millisecond. Marks are named '<name>_at'.
+    def summary(self):
+        with self.lock:
+            result = {name: round(seconds, 3) for name, seconds in self.durations.items()}
+            result.update({f"{name}_at": round(offset, 3) for name, offset in self.marks.items()})
+        result["total"] = round(time.monotonic() - self.start, 3)
+        return result
+
+    # Returns a one-line description of the turn's latency for the console.
+    def describe(self):
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.summary().items())
+
+class LatencyStats:
+    """
+    Rolling latency statistics of the most recent turns: p50/p95/p99 of every span and mark, and CSV/JSON export.
+    """
+    # Initializes empty statistics keeping the last window turns.
+    def __init__(self, window=METRICS_WINDOW):
+        self.turns = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    # Adds the summary of a finished turn.
+    def record(self, turn_id, metrics):
+        with self.lock:
+            self.turns.append({"turn": turn_id, **metrics.summary()})
+
+    # Returns {metric: {"count": n, "p50": s, "p95": s, "p99": s}} over the recent turns.
+    def percentiles(self):
+        with self.lock:
+            turns = list(self.turns)
+        samples = collections.defaultdict(list)
+        for turn in turns:
+            for name, seconds in turn.items():
+                if name != "turn":
+                    samples[name].append(seconds)
+        result = {}
+        for name, values in samples.items():
+            values.sort()
+            result[name] = {"count": len(values)}
+            for percent in PERCENTILES:
+                result[name][f"p{percent}"] = values[min(len(values) - 1, int(len(values) * percent / 100))]
+        return result
+
+    # Writes one row per recent turn, with a column per span or mark. Returns the path.
+    def export_csv(self, path):
+        with self.lock:
+            turns = list(self.turns)
+        columns = ["turn"] + sorted({name for turn in turns for name in turn} - {"turn"})
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(turns)
+        return path
+
+    # Writes the percentiles and the recent turns as JSON. Returns the path.
+    def export_json(self, path):
+        with self.lock:
+            turns = list(self.turns)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"percentiles": self.percentiles(), "turns": turns}, f, indent=2)
+        return path
@@ -1,7 +1,9 @@
 import os
-import requests
+import json
 from dotenv import load_dotenv
-from config import MINIMAX_VOICE_ID, MINIMAX_MODEL
+
+import http_client
+from config import MINIMAX_VOICE_ID, MINIMAX_MODEL, MINIMAX_STREAM_FORMAT, MINIMAX_SAMPLE_RATE, MINIMAX_BASE_URL
 
 load_dotenv()
 
@@ -10,46 +12,70 @@ class MiniMaxTTSHandler:
         self.api_key = os.environ.get("MINIMAX_API_KEY")
         self.voice_id = MINIMAX_VOICE_ID
         self.model = MINIMAX_MODEL
-        self.url = "https://api.minimax.io/v1/t2a_v2"
-        
-        if not self.api_key:
-            print("Warning: MINIMAX_API_KEY is not set. Please set it in your .env file.")
-
+        self.url = f"{MINIMAX_BASE_URL}/v1/t2a_v2"
+        self.stream_format = MINIMAX_STREAM_FORMAT
+        self.sample_rate = MINIMAX_SAMPLE_RATE
+        self.supports_streaming = True
 
-    def synthesize_speech(self, text):
         if not self.api_key:
-            print("MiniMax API Key missing.")
-            return None
+            print("Warning: MINIMAX_API_KEY is not set. Please set it in your .env file.")
 
+    def _build_request(self, text, stream=False, audio_format="mp3"):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
+        audio_setting = {
+            "format": audio_format,
+            "channel": 1,
+            "sample_rate": self.sample_rate
+        }
+        if audio_format == "mp3":
+            audio_setting["bitrate"] = 128000
+
         payload = {
             "model": self.model,
             "text": text,
-            "stream": False,
+            "stream": stream,
             "voice_setting": {
                 "voice_id": self.voice_id,
                 "speed": 1.0,
                 "vol": 1.0,
                 "pitch": 0
             },
-            "audio_setting": {
-                "format": "mp3",
-                "channel": 1,
-                "sample_rate": 32000,
-                "bitrate": 128000
-            }
+            "audio_setting": audio_setting
+        }
+        return headers, payload
+
+    # Returns everything besides the text that determines the synthesized audio, used for TTS cache keys.
+    def cache_params(self, audio_format="mp3"):
+        _, payload = self._build_request("", audio_format=audio_format)
+        return {
+            "provider": "minimax",
+            "model": payload["model"],
+            "voice_setting": payload["voice_setting"],
+            "audio_setting": payload["audio_setting"]
         }
 
+    # Opens the connection to the MiniMax API ahead of the first synthesis.
+    def warm_up(self):
+        http_client.preconnect(self.url)
+
+    # Synthesizes speech as an MP3 file or, when audio_format is 'pcm', as raw 16-bit mono audio at self.sample_rate.
+    def synthesize_speech(self, text, audio_format="mp3"):
+        if not self.api_key:
+            print("MiniMax API Key missing.")
+            return None
+
+        headers, payload = self._build_request(text, audio_format=audio_format)
+
         try:
-            response = requests.post(self.url, headers=headers, json=payload)
+            response = http_client.post(self.url, headers=headers, json=payload)
             response.raise_for_status()
-            
+
             data = response.json()
-            
+
             # Check for API error status in body if status_code is 200 but logic failed
             if "base_resp" in data and data["base_resp"]["status_code"] != 0:
                  print(f"MiniMax API Error: {data['base_resp']['status_msg']}")
@@ -73,3 +99,43 @@ class MiniMaxTTSHandler:
             if 'response' in locals():
                 print(f"Response content: {response.text}")
             return None
+
+    # Streams synthesized speech, yielding decoded audio chunks as they arrive.
+    # With the 'pcm' format each chunk is raw 16-bit mono audio at self.sample_rate and can be played immediately.
+    # The generator returns True only if the stream completed successfully.
+    def stream_speech(self, text, audio_format=None):
+        if not self.api_key:
+            print("MiniMax API Key missing.")
+            return False
+
+        audio_format = audio_format or self.stream_format
+        headers, payload = self._build_request(text, stream=True, audio_format=audio_format)
+
+        try:
+            with http_client.stream_post(self.url, headers=headers, json=payload) as response:
+                response.raise_for_status()
+                chunk_count = 0
+                # The body is a server-sent event stream with one JSON object per 'data:' line
+                for line in response.iter_lines():
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = json.loads(line[5:])
+
+                    if "base_resp" in data and data["base_resp"]["status_code"] != 0:
+                        print(f"MiniMax API Error: {data['base_resp']['status_msg']}")
+                        return False
+
+                    chunk = data.get("data") or {}
+                    # Status 2 is the final summary event, which repeats the complete audio
+                    if chunk.get("status") == 2:
+                        break
+                    hex_audio = chunk.get("audio")
+                    if hex_audio:
+                        chunk_count += 1
+                        yield bytes.fromhex(hex_audio)
+            print(f"MiniMax speech streamed successfully ({chunk_count} chunks).")
+            return True
+
+        except Exception as e:
+            print(f"Error during MiniMax speech streaming: {e}")
+            return False
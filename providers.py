@@ -0,0 +1,36 @@
+# providers.py
+import importlib
+
+# Provider registry: for each kind of backend, the module and class of each provider by name.
+# Modules are imported only when their provider is created, so startup only pays for the configured providers.
+PROVIDERS = {
+    "llm": {
+        "groq": ("llm_api", "GroqLLMHandler"),
+        "gemini": ("llm_api", "GeminiLLMHandler"),
+        "openrouter": ("llm_api", "OpenRouterLLMHandler"),
+        "router": ("llm_router", "LLMRouter"),
+    },
+    "stt": {
+        "groq": ("groq_api", "GroqHandler"),
+    },
+    "tts": {
+        "google": ("google_cloud_api", "GoogleTTSHandler"),
+        "minimax": ("minimax_api", "MiniMaxTTSHandler"),
+    },
+}
+
+# Registers (or replaces) a provider, e.g. a plugin module outside this project.
+def register_provider(kind, name, module_name, class_name):
+    PROVIDERS.setdefault(kind, {})[name.lower()] = (module_name, class_name)
+
+# Imports and returns the handler class of a provider.
+def get_provider_class(kind, name):
+    try:
+        module_name, class_name = PROVIDERS[kind][name.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported {kind.upper()} provider: '{name}'. Check config.py.") from None
+    return getattr(importlib.import_module(module_name), class_name)
+
+# Creates the handler of a provider by kind ('llm', 'stt' or 'tts') and name.
+def create_provider(kind, name, *args, **kwargs):
+    return get_provider_class(kind, name)(*args, **kwargs)
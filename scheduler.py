@@ -0,0 +1,189 @@
+# scheduler.py
+import os
+import time
+import hashlib
+import threading
+import collections
+
+from config import (
+    SCHEDULER_LIMITS, SCHEDULER_DEFAULT_LIMITS, SCHEDULER_MAX_QUEUE, SCHEDULER_MAX_WAIT_SECONDS
+)
+
+# Environment variable holding the API key of each provider, to keep one scheduler per key.
+API_KEY_ENV = {
+    "groq": "GROQ_API_KEY",
+    "openrouter": "OPENROUTER_API_KEY",
+    "gemini": "GOOGLE_API_KEY",
+    "minimax": "MINIMAX_API_KEY",
+}
+
+class ProviderBusy(Exception):
+    """
+    Raised when a provider's queue is too long to admit a request within SCHEDULER_MAX_WAIT_SECONDS.
+    """
+
+class ProviderScheduler:
+    """
+    Admission control for one provider and API key, shared by every conversation in the process.
+    A request is admitted when it is first in line, a rate-limit token is available (token bucket of 'rate' requests
+    per second with bursts of up to 'burst') and fewer than 'concurrency' requests are in flight.
+    The line is fair: sessions take turns, so one busy conversation cannot starve the others.
+    A request that would wait longer than max_wait is refused at once rather than timing out late.
+    """
+    # Initializes the scheduler with full tokens and an empty queue.
+    def __init__(self, name, rate, burst, concurrency, max_queue=SCHEDULER_MAX_QUEUE, max_wait=SCHEDULER_MAX_WAIT_SECONDS):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.waiting = 0
+        self.queues = collections.OrderedDict()  # session -> deque of waiting tickets; the first session is served next
+        self.condition = threading.Condition()
+
+    # Waits until a request of the session is admitted. Raises ProviderBusy if it cannot be admitted in time.
+    def acquire(self, session):
+        with self.condition:
+            expected_wait = self._expected_wait()
+            if self.waiting >= self.max_queue or expected_wait > self.max_wait:
+                raise ProviderBusy(
+                    f"{self.name} is busy ({self.waiting} requests waiting, about {expected_wait:.0f}s); try again shortly."
+                )
+            ticket = object()
+            self.queues.setdefault(session, collections.deque()).append(ticket)
+            self.waiting += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while True:
+                    self._refill()
+                    if self._next_ticket() is ticket and self.in_flight < self.concurrency and self.tokens >= 1:
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        self._dequeue(session)
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._remove(session, ticket)
+                        raise ProviderBusy(f"{self.name} is busy; try again shortly.")
+                    # Without a token, wake up when the next one is due; otherwise a release or dequeue notifies
+                    token_wait = (1 - self.tokens) / self.rate if self.tokens < 1 and self.rate else remaining
+                    self.condition.wait(min(remaining, token_wait))
+            finally:
+                self.waiting -= 1
+                self.condition.notify_all()
+
+    # Marks an admitted request as finished.
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    # Adds the tokens earned since the last refill.
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Returns the approximate seconds a new request would wait for a token, given the requests ahead of it.
+    def _expected_wait(self):
+        self._refill()
+        if not self.rate:
+            return 0.0
+        return max(0.0, (self.waiting + 1 - self.tokens) / self.rate)
+
+    # Returns the ticket to be served next: the oldest one of the session whose turn it is.
+    def _next_ticket(self):
+        for tickets in self.queues.values():
+            return tickets[0]
+        return None
+
+    # Removes the admitted ticket of the first session and sends that session to the back of the line.
+    def _dequeue(self, session):
+        tickets = self.queues.pop(session)
+        tickets.popleft()
+        if tickets:
+            self.queues[session] = tickets
+
+    # Removes a ticket that gave up waiting.
+    def _remove(self, session, ticket):
+        tickets = self.queues.get(session)
+        if tickets is not None:
+            tickets.remove(ticket)
+            if not tickets:
+                del self.queues[session]
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+# Returns the shared scheduler of a provider ('stt', 'llm' or 'tts' and the provider name) and API key.
+# The key defaults to the provider's environment variable; only a fingerprint of it is kept.
+def get_scheduler(kind, provider, api_key=None):
+    api_key = api_key if api_key is not None else os.environ.get(API_KEY_ENV.get(provider, ""), "")
+    fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+    name = f"{kind}:{provider}"
+    with _schedulers_lock:
+        key = (name, fingerprint)
+        if key not in _schedulers:
+            limits = {**SCHEDULER_DEFAULT_LIMITS, **SCHEDULER_LIMITS.get(name, {})}
+            _schedulers[key] = ProviderScheduler(name, limits["rate"], limits["burst"], limits["concurrency"])
+        return _schedulers[key]
+
+class ScheduledHandler:
+    """
+    Wraps a transcription, LLM or TTS handler so each request of one conversation goes through a provider scheduler.
+    When the provider is too busy, transcription and LLM requests raise ProviderBusy, which fails the turn at once;
+    TTS requests return no audio, so the text response is still shown.
+    """
+    # Initializes the wrapper for a conversation (session) around the given handler.
+    def __init__(self, handler, scheduler, session):
+        self.handler = handler
+        self.scheduler = scheduler
+        self.session = session
+
+    # Delegates everything else (warm_up, stream_format, sample_rate, ...) to the wrapped handler.
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+    # Runs a request once the scheduler admits it.
+    def _call(self, function, *args, **kwargs):
+        self.scheduler.acquire(self.session)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.scheduler.release()
+
+    # Transcribes audio.
+    def transcribe(self, audio, filename="audio.wav"):
+        return self._call(self.handler.transcribe, audio, filename)
+
+    # Gets a chat completion.
+    def get_chat_completion(self, message_history):
+        return self._call(self.handler.get_chat_completion, message_history)
+
+    # Streams a chat completion.
+    def stream_chat_completion(self, message_history, on_delta):
+        return self._call(self.handler.stream_chat_completion, message_history, on_delta)
+
+    # Synthesizes speech, or returns None if the provider is too busy.
+    def synthesize_speech(self, text, audio_format="mp3"):
+        try:
+            return self._call(self.handler.synthesize_speech, text, audio_format)
+        except ProviderBusy as e:
+            print(f"TTS skipped: {e}")
+            return None
+
+    # Streams speech, holding the admission until the stream ends. Returns False if the provider is too busy.
+    def stream_speech(self, text, audio_format=None):
+        try:
+            self.scheduler.acquire(self.session)
+        except ProviderBusy as e:
+            print(f"TTS skipped: {e}")
+            return False
+        try:
+            return (yield from self.handler.stream_speech(text, audio_format=audio_format))
+        finally:
+            self.scheduler.release()
@@ -0,0 +1,64 @@
+# segment_transcriber.py
+import re
+
+MAX_OVERLAP_WORDS = 4
+WORD_PATTERN = re.compile(r'\w+')
+
+class SegmentTranscriber:
+    """
+    Transcribes the segments of a recording in the background while the user is still speaking.
+    Segments are cut at pauses by AudioRecorder and overlap slightly; their transcripts are stitched in order,
+    dropping the words repeated across each overlap.
+    """
+    # Initializes the transcriber. transcribe(samples) returns the text, or a string starting with "Error:".
+    def __init__(self, transcribe, executor):
+        self.transcribe = transcribe
+        self.executor = executor
+        self.futures = []
+
+    # Starts transcribing a segment (int16 samples) in the background. Safe to call from the audio thread.
+    def add_segment(self, samples):
+        if samples is None or not len(samples):
+            return
+        print(f"Transcribing segment {len(self.futures) + 1} in the background...")
+        self.futures.append(self.executor.submit(self.transcribe, samples))
+
+    # Cancels the segments that have not started transcribing yet.
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+
+    # Waits for all segments and returns the stitched transcript, or None if any segment failed or nothing was said.
+    def result(self):
+        texts = []
+        for future in self.futures:
+            try:
+                text = future.result()
+            except Exception as e:
+                print(f"Segment transcription failed: {e}")
+                return None
+            if text is None or text.startswith("Error:"):
+                return None
+            if text.strip():
+                texts.append(text.strip())
+        return stitch_transcripts(texts) or None
+
+# Joins segment transcripts, removing the words the end of one repeats at the start of the next.
+def stitch_transcripts(texts):
+    words = []
+    for text in texts:
+        next_words = text.split()
+        words.extend(next_words[_overlap_length(words, next_words):])
+    return " ".join(words)
+
+# Returns how many leading words of next_words repeat the last words of previous_words (ignoring case and punctuation).
+def _overlap_length(previous_words, next_words):
+    def normalize(word_list):
+        return ["".join(WORD_PATTERN.findall(word.lower())) for word in word_list]
+    max_length = min(len(previous_words), len(next_words), MAX_OVERLAP_WORDS)
+    tail = normalize(previous_words[-max_length:]) if max_length else []
+    head = normalize(next_words[:max_length])
+    for length in range(max_length, 0, -1):
+        if tail[-length:] == head[:length]:
+            return length
+    return 0
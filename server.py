@@ -0,0 +1,271 @@
+# server.py
+# Headless voice assistant server: many conversations over WebSocket, all on one event loop.
+# Run: python server.py (requires 'pip install websockets')
+#
+# Protocol, per connection (one conversation):
+#   client -> server  binary frames: 16-bit mono PCM audio at SAMPLE_RATE, appended to the current recording
+#                     {"type": "end_turn"}: the recording is complete; starts a turn (cancelling any turn in progress)
+#                     {"type": "cancel"}: cancels the turn in progress and discards the audio received so far
+#   server -> client  {"type": "session", "conversation_id": ..., "sample_rate": ...} once connected
+#                     {"type": "transcript", "turn": n, "text": ...}
+#                     {"type": "response", "turn": n, "text": ...}
+#                     {"type": "audio", "turn": n, "format": "mp3" | "pcm", "sample_rate": ...} followed by a binary frame
+#                     {"type": "audio_stop"}: discard any audio not yet played
+#                     {"type": "turn_end", "turn": n, "latency": {...}}
+#                     {"type": "error", "turn": n, "error": ..., "busy": bool}: busy if a provider was too loaded to
+#                     take the turn (see SCHEDULER_ENABLED); the client may retry shortly
+import json
+import uuid
+import asyncio
+import datetime
+import functools
+import concurrent.futures
+
+import numpy as np
+from scipy.io.wavfile import write
+
+from assistant import VoiceAssistant, create_tts_handler
+from providers import create_provider
+from turn_engine import TurnEngine
+from config import (
+    SAMPLE_RATE, CHANNELS, STT_PROVIDER, SERVER_HOST, SERVER_PORT, SERVER_MAX_SESSIONS, SERVER_IO_WORKERS,
+    SERVER_CPU_WORKERS, SERVER_TTS_WORKERS, SERVER_MAX_RECORDING_SECONDS
+)
+
+MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+
+class SessionRecorder:
+    """
+    Archives the recordings of a session; stands in for AudioRecorder in the turn engine.
+    """
+    # Saves a recording to a WAV file.
+    def save(self, filepath, recording):
+        try:
+            write(filepath, SAMPLE_RATE, recording)
+            return filepath
+        except Exception as e:
+            print(f"Failed to save audio to {filepath}: {e}")
+            return None
+
+class SessionAudioSink:
+    """
+    Sends a session's synthesized audio to its client; stands in for AudioPlayer in the turn engine.
+    Called from worker threads.
+    """
+    # Initializes the sink for a session.
+    def __init__(self, session):
+        self.session = session
+        self.turn_id = None  # The turn whose audio is being sent, set by the session when it submits the turn
+
+    # Sends the audio of a complete response.
+    def play(self, audio_bytes, on_start=None):
+        self.enqueue(audio_bytes, on_start=on_start)
+
+    # Sends an audio segment of a turn, in order with the segments before it.
+    # Playback happens on the client, so on_start is called once the segment has been sent to it.
+    # Submitting a turn cancels the previous one, whose audio stops being sent, so the audio is the current turn's.
+    def enqueue(self, audio_bytes, audio_format="mp3", sample_rate=None, on_start=None):
+        header = {"type": "audio", "turn": self.turn_id, "format": audio_format, "sample_rate": sample_rate}
+        self.session.send(json.dumps(header), audio_bytes, on_sent=on_start)
+
+    # Tells the client to drop the audio it has not played yet.
+    def stop(self):
+        self.session.send(json.dumps({"type": "audio_stop"}))
+
+    # Playback happens on the client.
+    def is_busy(self):
+        return False
+
+class Session:
+    """
+    One connected client: an isolated VoiceAssistant (its own history, LLM handler and conversation folder) and a
+    turn engine running on the server's event loop and shared worker pools.
+    """
+    # Initializes the session for a WebSocket connection.
+    def __init__(self, server, websocket):
+        self.server = server
+        self.websocket = websocket
+        self.conversation_id = f"{datetime.datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}"
+        self.loop = None
+        self.assistant = None
+        self.engine = None
+        self.audio_sink = None
+        self.outbox = asyncio.Queue()
+        self.send_failed = False  # Once sending fails, nothing more is queued for the client
+        self.audio_chunks = []
+        self.audio_bytes = 0
+        self.max_audio_bytes = int(SERVER_MAX_RECORDING_SECONDS * SAMPLE_RATE) * 2 * CHANNELS
+
+    # Queues messages for the client, in order; on_sent, if given, is called once they have been sent.
+    # Safe to call from any thread.
+    def send(self, *messages, on_sent=None):
+        self.loop.call_soon_threadsafe(self._queue_messages, messages, on_sent)
+
+    # Adds messages to the outbox, unless the connection has failed. Runs on the event loop.
+    def _queue_messages(self, messages, on_sent):
+        if not self.send_failed:
+            self.outbox.put_nowait((messages, on_sent))
+
+    # Runs the session until the client disconnects.
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        # Creating the assistant opens its log and LLM client, which blocks
+        self.assistant = await self.loop.run_in_executor(self.server.io_executor, functools.partial(
+            VoiceAssistant, self.conversation_id,
+            transcription_handler=self.server.transcription_handler, tts_handler=self.server.tts_handler,
+            tts_executor=self.server.tts_executor, cpu_executor=self.server.cpu_executor
+        ))
+        self.audio_sink = SessionAudioSink(self)
+        self.engine = TurnEngine(
+            self.assistant, SessionRecorder(), self.audio_sink, loop=self.loop,
+            executor=self.server.io_executor, cpu_executor=self.server.cpu_executor
+        )
+        sender = asyncio.create_task(self._send_loop())
+        self.send(json.dumps({"type": "session", "conversation_id": self.conversation_id, "sample_rate": SAMPLE_RATE}))
+        try:
+            async for message in self.websocket:
+                if isinstance(message, bytes):
+                    self._add_audio(message)
+                else:
+                    self._handle_command(message)
+        finally:
+            self.engine.close()
+            await self.loop.run_in_executor(self.server.io_executor, self.assistant.close)
+            sender.cancel()
+
+    # Sends queued messages to the client until the session ends.
+    async def _send_loop(self):
+        while True:
+            messages, on_sent = await self.outbox.get()
+            try:
+                for message in messages:
+                    await self.websocket.send(message)
+            except Exception as e:
+                print(f"Session {self.conversation_id}: could not send to the client: {e}")
+                await self._drop_connection()
+                return
+            if on_sent:
+                on_sent()
+
+    # Discards everything queued for a client that can no longer be reached, including the audio of the turn in
+    # progress, and closes the connection so the session ends.
+    async def _drop_connection(self):
+        self.send_failed = True
+        self.engine.cancel()
+        while not self.outbox.empty():
+            self.outbox.get_nowait()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    # Appends received audio to the current recording, up to SERVER_MAX_RECORDING_SECONDS.
+    def _add_audio(self, data):
+        if self.audio_bytes + len(data) > self.max_audio_bytes:
+            return
+        self.audio_chunks.append(data)
+        self.audio_bytes += len(data)
+
+    # Handles a JSON command from the client.
+    def _handle_command(self, message):
+        try:
+            command = json.loads(message).get("type")
+        except (ValueError, AttributeError):
+            command = None
+        if command == "end_turn":
+            self._submit_recording()
+        elif command == "cancel":
+            self.engine.cancel()
+            self._take_recording()
+        else:
+            self.send(json.dumps({"type": "error", "turn": None, "error": f"Unknown message: {message[:100]}"}))
+
+    # Returns the audio received since the last turn as int16 samples, and starts a new recording.
+    def _take_recording(self):
+        data = b"".join(self.audio_chunks)
+        self.audio_chunks = []
+        self.audio_bytes = 0
+        frame_bytes = 2 * CHANNELS
+        return np.frombuffer(data[:len(data) // frame_bytes * frame_bytes], dtype=np.int16).reshape(-1, CHANNELS)
+
+    # Starts a turn for the audio received so far.
+    def _submit_recording(self):
+        recording = self._take_recording()
+        if not len(recording):
+            self.send(json.dumps({"type": "error", "turn": None, "error": "No audio was received."}))
+            return
+        # The turn only starts once this returns to the event loop, so its audio is labelled with its id
+        self.audio_sink.turn_id = self.engine.submit_turn(recording, self._on_turn_update)
+
+    # Forwards turn events to the client. Called from the engine's event loop.
+    def _on_turn_update(self, turn_id, event, data):
+        if event == "transcribed":
+            message = {"type": "transcript", "turn": turn_id, "text": data["user_text"]}
+        elif event == "responded":
+            message = {"type": "response", "turn": turn_id, "text": data["assistant_ui_text"]}
+        elif event == "finished":
+            message = {"type": "turn_end", "turn": turn_id, "latency": data["latency"]}
+        else:
+            message = {"type": "error", "turn": turn_id, "error": data.get("error"), "busy": data.get("busy", False)}
+        self.send(json.dumps(message, ensure_ascii=False))
+
+class VoiceServer:
+    """
+    Serves many conversations on one event loop. Blocking provider calls, CPU work (audio encoding, archiving,
+    response cleaning) and the synthesis of streamed responses run in bounded thread pools shared by every session,
+    and the stateless transcription and TTS handlers (with their pooled connections) are shared too.
+    Streamed synthesis has its own pool because a turn running on the I/O pool waits for it.
+    """
+    # Creates the shared pools and handlers.
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, max_sessions=SERVER_MAX_SESSIONS):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.sessions = set()
+        self.io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SERVER_IO_WORKERS, thread_name_prefix="server-io")
+        self.cpu_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SERVER_CPU_WORKERS, thread_name_prefix="server-cpu")
+        self.tts_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SERVER_TTS_WORKERS, thread_name_prefix="server-tts")
+        self.transcription_handler = create_provider("stt", STT_PROVIDER)
+        self.tts_handler = create_tts_handler()
+
+    # Runs a session for a new connection, or refuses it when the server is full.
+    async def handle_connection(self, websocket):
+        if len(self.sessions) >= self.max_sessions:
+            await websocket.send(json.dumps({"type": "error", "turn": None, "error": "The server is busy."}))
+            await websocket.close(code=1013, reason="busy")
+            return
+        session = Session(self, websocket)
+        self.sessions.add(session)
+        print(f"Session {session.conversation_id} started ({len(self.sessions)} active).")
+        try:
+            await session.run()
+        except Exception as e:
+            print(f"Session {session.conversation_id} failed: {e}")
+        finally:
+            self.sessions.discard(session)
+            print(f"Session {session.conversation_id} ended ({len(self.sessions)} active).")
+
+    # Serves connections until cancelled.
+    async def serve(self):
+        import websockets
+        loop = asyncio.get_running_loop()
+        for handler in (self.transcription_handler, self.tts_handler):
+            if hasattr(handler, "warm_up"):
+                loop.run_in_executor(self.io_executor, handler.warm_up)
+        async with websockets.serve(self.handle_connection, self.host, self.port, max_size=MAX_MESSAGE_BYTES):
+            print(f"Voice assistant server listening on ws://{self.host}:{self.port}")
+            await asyncio.Future()
+
+def main():
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        print("The server requires the 'websockets' package (pip install websockets).")
+        return
+    try:
+        asyncio.run(VoiceServer().serve())
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# transcript.py
+import re
+import tkinter as tk
+from tkinter import scrolledtext, font
+
+from config import TRANSCRIPT_MAX_MESSAGES, TRANSCRIPT_PAGE_SIZE
+
+INLINE_STYLE_PATTERN = re.compile(r'(\*\*.*?\*\*)|(\*.*?\*)')
+NUMBERED_ITEM_PATTERN = re.compile(r'^\s*\d+\.')
+
+class TranscriptView:
+    """
+    Chat transcript widget. Each message is located by a Tk mark, so it can be replaced without searching the text,
+    and only the most recent messages are kept in the widget; older ones are paged back in when scrolling to the top.
+    """
+    # Creates the text widget inside the given parent.
+    def __init__(self, parent, max_messages=TRANSCRIPT_MAX_MESSAGES, page_size=TRANSCRIPT_PAGE_SIZE):
+        self.text_area = scrolledtext.ScrolledText(parent, wrap=tk.WORD, state=tk.DISABLED, font=("Arial", 12))
+        self.text_area.configure(yscrollcommand=self._on_yscroll)
+        self.max_messages = max_messages
+        self.page_size = page_size
+        self.messages = []  # (sender, text) of every message; the index is the message id
+        self.first_shown = 0  # Id of the oldest message currently in the widget
+        self.loading_page = False
+        self._setup_text_styles()
+
+    # Lays out the widget.
+    def pack(self, **kwargs):
+        self.text_area.pack(**kwargs)
+
+    # Configures text styles for the chat area.
+    def _setup_text_styles(self):
+        action_font = font.Font(family="Arial", size=12, slant="italic")
+        self.text_area.tag_configure("action", foreground="grey", font=action_font)
+        bold_font = font.Font(family="Arial", size=12, weight="bold")
+        self.text_area.tag_configure("bold", font=bold_font)
+        self.text_area.tag_configure("list_item", lmargin1=20, lmargin2=20)
+
+    # Returns the name of the mark at the start of a message.
+    @staticmethod
+    def _mark(message_id):
+        return f"message_{message_id}"
+
+    # Returns the index where a shown message ends (the start of the next message, or the end of the text).
+    def _message_end(self, message_id):
+        next_id = message_id + 1
+        if next_id < len(self.messages):
+            return self.text_area.index(self._mark(next_id))
+        return self.text_area.index("end-1c")
+
+    # Builds the arguments of a single insert() call for a message: alternating text and tag tuples.
+    @staticmethod
+    def _styled_segments(sender, text):
+        segments = [f"{sender}: ", ()]
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            line_tags = ("list_item",) if stripped.startswith(('-', '*')) or NUMBERED_ITEM_PATTERN.match(stripped) else ()
+            last_end = 0
+            for match in INLINE_STYLE_PATTERN.finditer(line):
+                start, end = match.span()
+                segments += [line[last_end:start], line_tags]
+                matched_text = match.group(0)
+                if matched_text.startswith('**') and matched_text.endswith('**'):
+                    segments += [matched_text[2:-2], ("bold",) + line_tags]
+                else:
+                    segments += [matched_text[1:-1], ("action",) + line_tags]
+                last_end = end
+            segments += [line[last_end:] + ('\n' if i < len(lines) - 1 else ''), line_tags]
+        segments += ["\n\n", ()]
+        # Drop empty text segments together with their tags
+        return [item for pair in zip(segments[::2], segments[1::2]) if pair[0] for item in pair]
+
+    # Inserts a message at the given index with one insert() call and marks its start.
+    def _insert_message(self, message_id, index):
+        sender, text = self.messages[message_id]
+        position = self.text_area.index(index)
+        self.text_area.insert(position, *self._styled_segments(sender, text))
+        # Right gravity keeps the mark after text inserted at the same position (e.g. older messages paged in)
+        self.text_area.mark_set(self._mark(message_id), position)
+        self.text_area.mark_gravity(self._mark(message_id), "right")
+
+    # Adds a new message to the end of the transcript and returns its id.
+    def add_message(self, sender, text):
+        message_id = len(self.messages)
+        self.messages.append((sender, text))
+        self.text_area.config(state=tk.NORMAL)
+        self._insert_message(message_id, "end-1c")
+        self._trim_oldest()
+        self.text_area.config(state=tk.DISABLED)
+        self.text_area.see(tk.END)
+        return message_id
+
+    # Replaces the text of a message in place.
+    def replace_message(self, message_id, text):
+        sender, _ = self.messages[message_id]
+        self.messages[message_id] = (sender, text)
+        if message_id < self.first_shown:
+            return
+        self.text_area.config(state=tk.NORMAL)
+        start = self.text_area.index(self._mark(message_id))
+        self.text_area.delete(start, self._message_end(message_id))
+        self._insert_message(message_id, start)
+        self.text_area.config(state=tk.DISABLED)
+        self.text_area.see(tk.END)
+
+    # Removes the oldest messages from the widget while it holds more than max_messages.
+    def _trim_oldest(self):
+        while len(self.messages) - self.first_shown > self.max_messages:
+            message_id = self.first_shown
+            self.text_area.delete(self._mark(message_id), self._message_end(message_id))
+            self.text_area.mark_unset(self._mark(message_id))
+            self.first_shown += 1
+
+    # Inserts the previous page of messages at the top, keeping the current view in place.
+    def _load_older_page(self):
+        self.loading_page = False
+        if self.first_shown == 0:
+            return
+        anchor = self._mark(self.first_shown)
+        page_start = max(0, self.first_shown - self.page_size)
+        self.text_area.config(state=tk.NORMAL)
+        for message_id in range(self.first_shown - 1, page_start - 1, -1):
+            self._insert_message(message_id, "1.0")
+        self.text_area.config(state=tk.DISABLED)
+        self.first_shown = page_start
+        self.text_area.yview(anchor)
+
+    # Updates the scrollbar and pages in older messages when the view reaches the top.
+    def _on_yscroll(self, first, last):
+        self.text_area.vbar.set(first, last)
+        if float(first) <= 0.0 and float(last) < 1.0 and self.first_shown > 0 and not self.loading_page:
+            self.loading_page = True
+            self.text_area.after_idle(self._load_older_page)
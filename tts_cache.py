@@ -0,0 +1,183 @@
+# tts_cache.py
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from config import TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES
+
+class TTSCache:
+    """
+    Content-addressed on-disk cache of synthesized speech with a byte budget and LRU eviction.
+    """
+    FILE_SUFFIX = ".audio"
+
+    # Initializes the cache and indexes the files already on disk, oldest first.
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        found = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(self.FILE_SUFFIX):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-len(self.FILE_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+        print(f"TTS cache ready: {len(self.entries)} entries, {self.total_bytes / (1024 * 1024):.1f} MB in {self.cache_dir}")
+        self._evict()
+
+    # Builds the cache key from the synthesis parameters and the normalized text.
+    @staticmethod
+    def make_key(params, text):
+        normalized_text = " ".join(unicodedata.normalize("NFC", text).split())
+        material = json.dumps(params, sort_keys=True, ensure_ascii=False) + "\0" + normalized_text
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    # Returns the path of the file holding the given key.
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.FILE_SUFFIX)
+
+    # Marks the key as recently used. Returns False if it is not cached.
+    def _touch(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return False
+            self.entries.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return True
+
+    # Removes an entry whose file has disappeared or is unreadable.
+    def _forget(self, key):
+        with self.lock:
+            size = self.entries.pop(key, None)
+            if size is not None:
+                self.total_bytes -= size
+
+    # Returns the cached audio for the key, or None on a miss.
+    def get(self, key):
+        if not self._touch(key):
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            self._forget(key)
+            return None
+
+    # Yields the cached audio for the key in chunks, so playback can start before the whole file is read.
+    # Returns False if nothing could be read.
+    def stream(self, key, chunk_size=32768):
+        if not self._touch(key):
+            return False
+        yielded = False
+        try:
+            with open(self._path(key), "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yielded = True
+                    yield chunk
+        except OSError:
+            self._forget(key)
+        return yielded
+
+    # Returns True if the key is cached.
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    # Stores audio under the key and evicts the least recently used entries if over budget.
+    def put(self, key, audio_content):
+        if not audio_content or len(audio_content) > self.max_bytes:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(audio_content)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Failed to write TTS cache entry: {e}")
+            return
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = len(audio_content)
+            self.total_bytes += len(audio_content)
+        self._evict()
+
+    # Deletes least recently used entries until the cache fits in its byte budget.
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self.entries:
+                    return
+                key, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+class CachedTTSHandler:
+    """
+    Wraps a TTS handler so repeated text is served from the TTS cache instead of the provider.
+    """
+    # Initializes the wrapper around the given handler.
+    def __init__(self, tts_handler, cache):
+        self.tts_handler = tts_handler
+        self.cache = cache
+
+    # Delegates everything else (stream_format, sample_rate, ...) to the wrapped handler.
+    def __getattr__(self, name):
+        return getattr(self.tts_handler, name)
+
+    # Synthesizes speech, returning the cached audio when the same text was already spoken.
+    def synthesize_speech(self, text, audio_format="mp3"):
+        key = self.cache.make_key(self.tts_handler.cache_params(audio_format=audio_format), text)
+        audio_content = self.cache.get(key)
+        if audio_content:
+            print("TTS cache hit.")
+            return audio_content
+        audio_content = self.tts_handler.synthesize_speech(text, audio_format)
+        self.cache.put(key, audio_content)
+        return audio_content
+
+    # Streams speech, reading from the cache on a hit and filling it once a streamed synthesis completes.
+    def stream_speech(self, text, audio_format=None):
+        audio_format = audio_format or self.tts_handler.stream_format
+        key = self.cache.make_key(self.tts_handler.cache_params(audio_format=audio_format), text)
+        if self.cache.contains(key):
+            print("TTS cache hit.")
+            hit = yield from self.cache.stream(key)
+            if hit:
+                return True
+
+        chunks = []
+        completed = yield from self._collect(self.tts_handler.stream_speech(text, audio_format=audio_format), chunks)
+        # Failed or abandoned streams are never cached
+        if completed:
+            self.cache.put(key, b"".join(chunks))
+        return completed
+
+    # Re-yields the chunks of a stream while keeping a copy, returning the stream's own return value.
+    @staticmethod
+    def _collect(stream, chunks):
+        while True:
+            try:
+                chunk = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            chunks.append(chunk)
+            yield chunk
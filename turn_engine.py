@@ -0,0 +1,253 @@
+# turn_engine.py
+import os
+import asyncio
+import functools
+import threading
+import concurrent.futures
+
+from assistant import TurnCancelled
+from scheduler import ProviderBusy
+from metrics import TurnMetrics, LatencyStats
+from audio_encoding import encode_audio
+from config import (
+    STREAMING_RESPONSE, TURN_DEADLINE_SECONDS, TURN_WORKER_THREADS, METRICS_EXPORT, SAMPLE_RATE,
+    TRANSCRIPTION_UPLOAD_FORMAT, PLAYBACK_START_TIMEOUT_SECONDS
+)
+
+class PlaybackStart:
+    """
+    Tracks when a turn's audio actually starts playing. The player calls on_start (from its audio thread) once the
+    device consumes the turn's first buffer, which marks 'playback_start' in the turn's metrics.
+    """
+    # Initializes the tracker for a turn's metrics, on the engine's event loop.
+    def __init__(self, loop, metrics):
+        self.loop = loop
+        self.metrics = metrics
+        self.queued = False  # Set once some of the turn's audio has been handed to the player
+        self.started = asyncio.Event()
+
+    # Records the start of playback. Safe to call from any thread, more than once.
+    def on_start(self):
+        self.metrics.mark("playback_start")
+        self.loop.call_soon_threadsafe(self.started.set)
+
+    # Waits until queued audio has started playing, up to timeout seconds.
+    async def wait(self, timeout=PLAYBACK_START_TIMEOUT_SECONDS):
+        if not self.queued:
+            return
+        try:
+            await asyncio.wait_for(self.started.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Audio playback did not start within {timeout}s.")
+
+class TurnEngine:
+    """
+    Runs conversation turns on one background asyncio event loop.
+    A turn is a chain of awaitable stages (transcribe, complete, synthesize, play). The blocking provider calls run in
+    worker threads and watch the turn's cancel event, so a cancelled turn stops at its next chunk, sentence or stage.
+    Submitting a new turn cancels the previous one. The engine owns the turn counter; callers only submit and observe.
+    Several engines (e.g. one per session of the server) can share one running event loop and worker pools.
+    """
+    # Initializes the engine. Without a loop, it starts its own event loop thread; without executors, it creates
+    # a pool for blocking provider calls, which is also used for CPU work (audio encoding, archiving) unless
+    # cpu_executor is given.
+    def __init__(self, assistant, recorder, audio_player, turn_deadline=TURN_DEADLINE_SECONDS,
+                 loop=None, executor=None, cpu_executor=None):
+        self.assistant = assistant
+        self.recorder = recorder
+        self.audio_player = audio_player
+        self.turn_deadline = turn_deadline
+        self.turn_counter = 0
+        self.current_turn = None  # (future, cancel_event) of the turn in progress
+        self.latency_stats = LatencyStats()
+
+        self.owns_executor = executor is None
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+            max_workers=TURN_WORKER_THREADS, thread_name_prefix="turn"
+        )
+        self.cpu_executor = cpu_executor or self.executor
+        self.owns_loop = loop is None
+        if self.owns_loop:
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            self.loop_thread.start()
+        else:
+            self.loop = loop
+
+    # Starts a turn for a recording, cancelling any previous turn, and returns the turn id.
+    # segments is the recording's SegmentTranscriber when it was transcribed segment by segment.
+    # on_update(turn_id, event, data) is called from the engine thread with the events
+    # 'transcribed' (user_text), 'responded' (assistant_ui_text), 'failed' (error, and busy when a provider refused
+    # the turn) and, once playback has started, 'finished' (latency).
+    # metrics is the turn's TurnMetrics, if the caller started timing it already (e.g. when the recording stopped).
+    def submit_turn(self, recording, on_update, segments=None, metrics=None):
+        self.cancel()
+        turn_id = self.turn_counter
+        self.turn_counter += 1
+        cancel_event = threading.Event()
+        metrics = metrics or TurnMetrics()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run_turn(turn_id, recording, segments, cancel_event, on_update, metrics), self.loop
+        )
+        self.current_turn = (future, cancel_event)
+        return turn_id
+
+    # Cancels the turn in progress (if any) and stops its playback. Safe to call from any thread.
+    def cancel(self):
+        in_flight = False
+        if self.current_turn:
+            future, cancel_event = self.current_turn
+            self.current_turn = None
+            in_flight = not future.done()
+            # The event reaches the worker threads, cancelling the future stops the coroutine
+            cancel_event.set()
+            if future.cancel():
+                print("Turn in progress cancelled.")
+        # The player is only stopped if there is something to stop (for the server, stopping messages the client)
+        if in_flight or self.audio_player.is_busy():
+            self.audio_player.stop()
+
+    # Cancels any turn in progress, stops the event loop and pool if they are the engine's own, and exports
+    # the latency statistics.
+    def close(self):
+        self.cancel()
+        if self.owns_loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
+        if METRICS_EXPORT and self.latency_stats.turns:
+            self.export_metrics(self.assistant.conversation_path)
+
+    # Writes the latency of the recent turns to latency.csv and their percentiles to latency.json in a folder.
+    def export_metrics(self, folder):
+        try:
+            self.latency_stats.export_csv(os.path.join(folder, "latency.csv"))
+            self.latency_stats.export_json(os.path.join(folder, "latency.json"))
+            print(f"Latency metrics saved to {folder}")
+        except OSError as e:
+            print(f"Failed to save latency metrics: {e}")
+
+    # Runs a turn within its deadline and reports its outcome.
+    async def _run_turn(self, turn_id, recording, segments, cancel_event, on_update, metrics):
+        try:
+            await asyncio.wait_for(
+                self._run_stages(turn_id, recording, segments, cancel_event, on_update, metrics), self.turn_deadline
+            )
+        except asyncio.TimeoutError:
+            cancel_event.set()
+            print(f"Turn {turn_id} exceeded its deadline of {self.turn_deadline}s.")
+            on_update(turn_id, "failed", {"error": "The assistant took too long to respond."})
+        except TurnCancelled:
+            pass
+        except ProviderBusy as e:
+            print(f"Turn {turn_id} refused: {e}")
+            on_update(turn_id, "failed", {"error": str(e), "busy": True})
+        except Exception as e:
+            print(f"Turn {turn_id} failed: {e}")
+            on_update(turn_id, "failed", {"error": f"Unexpected error: {e}"})
+
+    # Runs the stages of a turn in order.
+    async def _run_stages(self, turn_id, recording, segments, cancel_event, on_update, metrics):
+        transcription = await self.transcribe(turn_id, recording, segments, metrics, cancel_event)
+        if transcription.get("error"):
+            on_update(turn_id, "failed", transcription)
+            return
+        on_update(turn_id, "transcribed", transcription)
+
+        playback = PlaybackStart(self.loop, metrics)
+        on_audio = self._audio_sink(cancel_event, playback)
+        self._check_cancelled(cancel_event)
+        if STREAMING_RESPONSE:
+            # Completion and synthesis overlap sentence by sentence, so they run as one stage
+            response = await self._run_in_thread(
+                self.assistant.generate_assistant_response, turn_id, on_audio, cancel_event, metrics
+            )
+            if response.get("error"):
+                on_update(turn_id, "failed", response)
+                return
+        else:
+            processed_text = await self.complete(cancel_event, metrics)
+            if processed_text.get("error"):
+                on_update(turn_id, "failed", processed_text)
+                return
+            self._check_cancelled(cancel_event)
+            audio_content = await self.synthesize(processed_text, turn_id, on_audio, cancel_event, metrics)
+            response = {"assistant_ui_text": processed_text["for_ui"], "audio_content": audio_content, "error": None}
+
+        self._check_cancelled(cancel_event)
+        on_update(turn_id, "responded", response)
+        await self.play(response["audio_content"], playback)
+        # The turn's latency runs until the user hears the answer, not until its audio is queued
+        await playback.wait()
+        self._record_metrics(turn_id, metrics)
+        on_update(turn_id, "finished", {"latency": metrics.summary()})
+
+    # Stage 1: archives the recording and transcribes it, or collects the transcripts of its segments.
+    # The transcript is only added to the history if the turn hasn't been cancelled meanwhile.
+    async def transcribe(self, turn_id, recording, segments=None, metrics=None, cancel_event=None):
+        cancel_event = cancel_event or threading.Event()
+        metrics = metrics or TurnMetrics()
+        # The WAV is archived in a worker thread while the samples are uploaded straight from memory
+        user_audio_path = os.path.join(self.assistant.conversation_path, f"user_{turn_id}.wav")
+        self.loop.run_in_executor(self.cpu_executor, metrics.timed("wav_save", self.recorder.save), user_audio_path, recording)
+        with metrics.span("transcribe"):
+            if segments is not None:
+                transcribed_text = await self._run_in_thread(segments.result)
+                if transcribed_text:
+                    self._check_cancelled(cancel_event)
+                    return self.assistant.record_transcription(transcribed_text)
+                print("Segmented transcription failed; transcribing the whole recording.")
+            # Encoding is CPU work, uploading is I/O: each runs in its own pool
+            encoded_audio, filename = await self.loop.run_in_executor(
+                self.cpu_executor, encode_audio, recording, SAMPLE_RATE, TRANSCRIPTION_UPLOAD_FORMAT
+            )
+            transcribed_text = await self._run_in_thread(
+                self.assistant.transcription_handler.transcribe, encoded_audio, filename
+            )
+        self._check_cancelled(cancel_event)
+        return self.assistant.record_transcription(transcribed_text)
+
+    # Stage 2: gets and records the LLM response.
+    async def complete(self, cancel_event, metrics=None):
+        return await self._run_in_thread(self.assistant.complete_response, cancel_event, metrics)
+
+    # Stage 3: synthesizes the response. Returns the audio to play, or None if it was streamed to on_audio.
+    async def synthesize(self, processed_text, turn_id, on_audio, cancel_event, metrics=None):
+        return await self._run_in_thread(
+            self.assistant.synthesize_response, processed_text, turn_id, on_audio, cancel_event, metrics
+        )
+
+    # Stage 4: starts playing the audio. Playback is stopped when the turn is cancelled.
+    # If playback (a PlaybackStart) is given, the player reports to it when the audio actually starts playing.
+    async def play(self, audio_content, playback=None):
+        if audio_content:
+            if playback:
+                playback.queued = True
+                self.audio_player.play(audio_content, on_start=playback.on_start)
+            else:
+                self.audio_player.play(audio_content)
+
+    # Adds a finished turn's latency to the statistics and stores it with the turn in the conversation log.
+    def _record_metrics(self, turn_id, metrics):
+        self.assistant.record_turn_metrics(metrics)
+        self.latency_stats.record(turn_id, metrics)
+        print(f"Turn {turn_id} latency: {metrics.describe()}")
+
+    # Returns a callback that queues a turn's streamed audio for playback until the turn is cancelled.
+    # The player reports the start of playback to the turn's PlaybackStart.
+    def _audio_sink(self, cancel_event, playback):
+        def on_audio(audio_bytes, **kwargs):
+            if not cancel_event.is_set():
+                playback.queued = True
+                self.audio_player.enqueue(audio_bytes, on_start=playback.on_start, **kwargs)
+        return on_audio
+
+    # Runs a blocking function in a worker thread without blocking the event loop.
+    async def _run_in_thread(self, function, *args):
+        return await self.loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    # Raises TurnCancelled between stages once the turn has been cancelled.
+    @staticmethod
+    def _check_cancelled(cancel_event):
+        if cancel_event.is_set():
+            raise TurnCancelled()
@@ -1,16 +1,15 @@
 # ui.py
 import tkinter as tk
-from tkinter import scrolledtext, font
-import threading
-import os
+from tkinter import font
 import datetime
-import numpy as np
-import re
 
 from audio import AudioRecorder
-from audio_player import AudioPlayer
-from assistant import VoiceAssistant
-from config import CONVERSATIONS_DIR
+from waveform import WaveformRenderer
+from transcript import TranscriptView
+from turn_engine import TurnEngine
+from warmup import WarmUp
+from metrics import TurnMetrics
+from config import BARGE_IN_ENABLED, SEGMENTED_TRANSCRIPTION
 
 class Application(tk.Tk):
     # Initializes the main application window.
@@ -20,150 +19,214 @@ class Application(tk.Tk):
         self.geometry("480x480")
         self.resizable(False, False)
 
-        self.recorder = AudioRecorder(waveform_callback=self.update_waveform)
-        self.audio_player = AudioPlayer()
+        self.recorder = AudioRecorder(on_auto_stop=self.on_speech_ended)
+        # Created in the background by the warm-up, while the window is already usable
+        self.audio_player = None
+        self.assistant = None
+        self.turn_engine = None
         
         self.conversation_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.assistant = VoiceAssistant(self.conversation_id)
-        
-        self.turn_counter = 0
-        self.conversation_path = os.path.join(CONVERSATIONS_DIR, self.conversation_id)
+        self.active_turn = None  # Id of the turn whose updates are shown
+        self.segment_transcriber = None  # Transcribes the current recording segment by segment, if enabled
+        self.thinking_message_id = None
+        self.pending_recording = None  # Recording sent before the warm-up finished, as (recording, segments, metrics)
+        self.closed = False
         
         self.create_widgets()
         self.setup_idle_ui()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        WarmUp(self.conversation_id, self.recorder, self.on_warmup_ready, self.on_warmup_error).start()
+
+    # Saves the conversation and closes the window.
+    def on_close(self):
+        self.closed = True
+        self.recorder.stop()
+        if self.turn_engine:
+            self.turn_engine.close()
+        if self.assistant:
+            self.assistant.close()
+        if self.audio_player:
+            self.audio_player.close()
+        self.destroy()
+
+    # --- WARM-UP ---
+
+    # Called from a warm-up thread once the audio player and the assistant exist.
+    def on_warmup_ready(self, audio_player, assistant):
+        if self.closed:
+            assistant.close()
+            audio_player.close()
+            return
+        self.after(0, self._handle_warmup_ready, audio_player, assistant)
+
+    # Creates the turn engine and sends any recording that was waiting for it (runs on the main thread).
+    def _handle_warmup_ready(self, audio_player, assistant):
+        if self.closed:
+            assistant.close()
+            audio_player.close()
+            return
+        self.audio_player = audio_player
+        self.assistant = assistant
+        self.turn_engine = TurnEngine(self.assistant, self.recorder, self.audio_player)
+        if self.pending_recording:
+            recording, segments, metrics = self.pending_recording
+            self.pending_recording = None
+            self.submit_recording(recording, segments, metrics)
+
+    # Called from a warm-up thread if the assistant could not be created.
+    def on_warmup_error(self, error):
+        if not self.closed:
+            self.after(0, self._handle_warmup_error, error)
+
+    # Reports the startup failure, dropping any recording that was waiting (runs on the main thread).
+    def _handle_warmup_error(self, error):
+        self.add_message("System", f"The assistant could not be started: {error}")
+        if self.pending_recording:
+            self.pending_recording = None
+            self.setup_idle_ui()
 
     # Creates and lays out the main UI widgets.
     def create_widgets(self):
         self.control_frame = tk.Frame(self, height=60)
         self.control_frame.pack(side="bottom", fill="x", padx=10, pady=10)
         self.control_frame.pack_propagate(False)
-        self.text_area = scrolledtext.ScrolledText(self, wrap=tk.WORD, state=tk.DISABLED, font=("Arial", 12))
-        self.text_area.pack(pady=(10, 0), padx=10, expand=True, fill="both")
-        self.setup_text_styles()
+        self.transcript = TranscriptView(self)
+        self.transcript.pack(pady=(10, 0), padx=10, expand=True, fill="both")
         self.control_frame.grid_columnconfigure(0, weight=1)
         self.control_frame.grid_columnconfigure(1, weight=2)
         self.control_frame.grid_columnconfigure(2, weight=1)
         self.add_message("System", "Welcome! Press 'Record' to speak with the assistant.")
 
-    # Configures text styles for the chat area.
-    def setup_text_styles(self):
-        action_font = font.Font(family="Arial", size=12, slant="italic")
-        self.text_area.tag_configure("action", foreground="grey", font=action_font)
-        bold_font = font.Font(family="Arial", size=12, weight="bold")
-        self.text_area.tag_configure("bold", font=bold_font)
-        self.text_area.tag_configure("list_item", lmargin1=20, lmargin2=20)
-
-    # Inserts styled text into the chat area.
-    def _insert_styled_text(self, text, prefix=""):
-        self.text_area.config(state=tk.NORMAL)
-        self.text_area.insert(tk.END, prefix)
-        inline_pattern = re.compile(r'(\*\*.*?\*\*)|(\*.*?\*)')
-        lines = text.split('\n')
-        for i, line in enumerate(lines):
-            line_start_index = self.text_area.index(tk.END)
-            last_end = 0
-            for match in inline_pattern.finditer(line):
-                start, end = match.span()
-                self.text_area.insert(tk.END, line[last_end:start])
-                matched_text = match.group(0)
-                if matched_text.startswith('**') and matched_text.endswith('**'):
-                    self.text_area.insert(tk.END, matched_text[2:-2], "bold")
-                elif matched_text.startswith('*') and matched_text.endswith('*'):
-                    self.text_area.insert(tk.END, matched_text[1:-1], "action")
-                last_end = end
-            self.text_area.insert(tk.END, line[last_end:])
-            if line.strip().startswith(('-', '*')) or re.match(r'^\s*\d+\.', line.strip()):
-                self.text_area.tag_add("list_item", line_start_index, f"{line_start_index} lineend")
-            if i < len(lines) - 1:
-                self.text_area.insert(tk.END, '\n')
-        self.text_area.insert(tk.END, "\n\n")
-        self.text_area.config(state=tk.DISABLED)
-        self.text_area.see(tk.END)
-
-    # Adds a new message to the chat display.
+    # Adds a new message to the chat display and returns its id.
     def add_message(self, sender, text):
-        self._insert_styled_text(text, prefix=f"{sender}: ")
+        return self.transcript.add_message(sender, text)
 
     # Replaces the "Thinking..." message with the final response.
     def update_last_message(self, new_text):
-        self.text_area.config(state=tk.NORMAL)
-        search_text = "Assistant: Thinking..."
-        start_index = self.text_area.search(search_text, "1.0", stopindex="end", backwards=True)
-        if start_index:
-            end_index = f"{start_index} + {len(search_text)} chars"
-            self.text_area.delete(start_index, end_index)
-            self.text_area.mark_set("insert", start_index)
-            self._insert_styled_text(new_text, prefix="Assistant: ")
+        if self.thinking_message_id is not None:
+            self.transcript.replace_message(self.thinking_message_id, new_text)
+            self.thinking_message_id = None
         else:
             self.add_message("Assistant", new_text)
-        self.text_area.config(state=tk.DISABLED)
-        self.text_area.see(tk.END)
     
     # --- UI FLOW METHODS ---
 
-    # Starts the recording process.
+    # Starts the recording process, interrupting the turn in progress (if any).
+    # After a barge-in the recorder is already recording, and keeps doing so.
     def start_recording_flow(self):
-        self.audio_player.stop()
+        self.active_turn = None
+        self.pending_recording = None
+        if self.turn_engine:
+            self.turn_engine.cancel()
+        if self.thinking_message_id is not None:
+            self.update_last_message("(Interrupted)")
         self.setup_recording_ui()
-        self.recorder.start()
+        self._discard_segments()
+        if SEGMENTED_TRANSCRIPTION and self.assistant:
+            self.segment_transcriber = self.assistant.new_segment_transcriber()
+            self.recorder.start(on_segment=self.segment_transcriber.add_segment)
+        else:
+            self.recorder.start()
         self.add_message("System", "Listening... Press 'Send' when you're done.")
 
-    # Sends the recorded audio for processing.
+    # Stops recording and submits the recording as a new turn.
     def send_recording_flow(self):
+        # The turn is timed from the moment the user stops recording
+        metrics = TurnMetrics()
+        with metrics.span("record_stop"):
+            self.recorder.stop()
+        recording = self.recorder.get_recording()
+        if recording is None:
+            self._discard_segments()
+            self.add_message("System", "No audio was recorded.")
+            self.setup_idle_ui()
+            return
+        segments, self.segment_transcriber = self.segment_transcriber, None
+        if segments:
+            # Only this last part of the recording is still to be transcribed
+            segments.add_segment(self.recorder.get_final_segment())
+        if not self.turn_engine:
+            # Sent as soon as the warm-up has created the assistant
+            self.pending_recording = (recording, segments, metrics)
+            self.setup_processing_ui("Starting up...")
+            return
+        self.submit_recording(recording, segments, metrics)
+
+    # Submits a recording as a new turn.
+    def submit_recording(self, recording, segments=None, metrics=None):
         self.setup_processing_ui("Transcribing...")
-        threading.Thread(target=self._transcribe_audio_thread).start()
+        self.active_turn = self.turn_engine.submit_turn(recording, self.on_turn_update, segments, metrics)
+
+    # Sends the recording automatically when the voice activity detector hears the user stop speaking.
+    def on_speech_ended(self):
+        self.after(0, self._auto_send_recording)
+
+    # Sends the recording if it is still waiting for the Send button (runs on the main thread).
+    def _auto_send_recording(self):
+        if self.recorder.is_recording and hasattr(self, 'send_button') and self.send_button.winfo_exists():
+            self.send_recording_flow()
 
     # Cancels the current recording.
     def cancel_recording_flow(self):
         self.recorder.stop()
+        self._discard_segments()
         self.setup_idle_ui()
         self.add_message("System", "Recording canceled.")
 
-    # --- BACKGROUND THREADS AND HANDLERS ---
+    # Stops transcribing the segments of an abandoned recording.
+    def _discard_segments(self):
+        if self.segment_transcriber:
+            self.segment_transcriber.cancel()
+            self.segment_transcriber = None
 
-    # Handles audio saving and transcription in a background thread.
-    def _transcribe_audio_thread(self):
-        self.recorder.stop()
-        user_audio_path = os.path.join(self.conversation_path, f"user_{self.turn_counter}.wav")
-        saved_path = self.recorder.save(user_audio_path)
-        
-        if saved_path:
-            transcription_result = self.assistant.transcribe_and_update_history(saved_path)
-            self.after(0, self.handle_transcription_result, transcription_result)
-        else:
-            self.after(0, self.add_message, "System", "No audio was recorded.")
-            self.after(0, self.setup_idle_ui)
+    # --- TURN UPDATES ---
 
-    # Processes the transcription result in the main UI thread.
-    def handle_transcription_result(self, result):
-        if result.get("error"):
-            self.add_message("System", result["error"])
-            self.setup_idle_ui()
+    # Receives turn updates from the turn engine thread and hands them to the main UI thread.
+    def on_turn_update(self, turn_id, event, data):
+        self.after(0, self.handle_turn_update, turn_id, event, data)
+
+    # Updates the UI for a turn event (runs on the main thread). Events of interrupted turns are ignored.
+    def handle_turn_update(self, turn_id, event, data):
+        if turn_id != self.active_turn:
             return
+        if event == "transcribed":
+            self.add_message("You", data["user_text"])
+            self.thinking_message_id = self.add_message("Assistant", "Thinking...")
+            self.setup_processing_ui("Thinking...")
+            if BARGE_IN_ENABLED:
+                self.recorder.start_monitor(self.on_barge_in)
+                self._check_barge_in_monitor()
+        elif event == "responded":
+            self.update_last_message(data["assistant_ui_text"])
+            self.active_turn = None
+            self.setup_idle_ui()
+        elif event == "failed":
+            if self.thinking_message_id is not None:
+                self.update_last_message(data["error"])
+            else:
+                self.add_message("System", data["error"])
+            self.active_turn = None
+            self.setup_idle_ui()
 
-        self.add_message("You", result["user_text"])
-        
-        self.add_message("Assistant", "Thinking...")
-        self.setup_processing_ui("Thinking...")
-        
-        threading.Thread(target=self._get_assistant_response_thread).start()
+    # --- BARGE-IN ---
 
-    # Gets the assistant's response in a background thread.
-    def _get_assistant_response_thread(self):
-        response_result = self.assistant.generate_assistant_response(self.turn_counter)
-        self.after(0, self.handle_final_response, response_result)
+    # Called from the audio thread when the user speaks over the assistant; recording has already started.
+    def on_barge_in(self):
+        self.after(0, self._handle_barge_in)
 
-    # Processes the final assistant response in the main UI thread.
-    def handle_final_response(self, result):
-        if result.get("error"):
-            self.update_last_message(result["error"])
-            self.setup_idle_ui()
+    # Interrupts the turn and shows the recording UI (runs on the main thread).
+    def _handle_barge_in(self):
+        if self.recorder.is_recording:
+            self.start_recording_flow()
+
+    # Stops monitoring the microphone once the turn is over and the assistant has finished speaking.
+    def _check_barge_in_monitor(self):
+        if not self.recorder.is_monitoring:
             return
-        
-        self.update_last_message(result["assistant_ui_text"])
-        self.setup_idle_ui()
-        self.audio_player.play(result["audio_content"])
-        self.turn_counter += 1
+        if self.active_turn is None and not self.audio_player.is_busy():
+            self.recorder.stop_monitor()
+            return
+        self.after(250, self._check_barge_in_monitor)
 
     # --- UI SETUP METHODS ---
     
@@ -174,6 +237,9 @@ class Application(tk.Tk):
         loading_font = font.Font(family='Helvetica', size=14)
         self.loading_label = tk.Label(self.control_frame, text=text, font=loading_font)
         self.loading_label.place(relx=0.5, rely=0.5, anchor="center")
+        # Recording again interrupts the turn in progress
+        self.record_button = tk.Button(self.control_frame, text="Record", command=self.start_recording_flow)
+        self.record_button.place(relx=1.0, rely=0.5, anchor="e")
 
     # Sets up the UI for the idle state.
     def setup_idle_ui(self):
@@ -190,27 +256,8 @@ class Application(tk.Tk):
         self.cancel_button.grid(row=0, column=0, sticky="w")
         self.waveform_canvas = tk.Canvas(self.control_frame, height=40, bg="black")
         self.waveform_canvas.grid(row=0, column=1, sticky="ew", padx=10)
+        # The renderer polls the capture buffer, so audio blocks never post events to the Tk queue
+        self.waveform_renderer = WaveformRenderer(self.waveform_canvas, lambda count: self.recorder.buffer.latest(count))
+        self.waveform_renderer.start()
         self.send_button = tk.Button(self.control_frame, text="Send", command=self.send_recording_flow)
-        self.send_button.grid(row=0, column=2, sticky="e")
-
-    # --- WAVEFORM DRAWING ---
-
-    # Schedules a waveform update on the main thread.
-    def update_waveform(self, data):
-        self.after(0, self._draw_waveform, data)
-
-    # Draws the audio waveform on the canvas.
-    def _draw_waveform(self, data):
-        if not hasattr(self, 'waveform_canvas') or not self.waveform_canvas.winfo_exists(): return
-        canvas = self.waveform_canvas
-        canvas.delete("all")
-        width, height = canvas.winfo_width(), canvas.winfo_height()
-        center_y = height / 2
-        if width <= 1 or height <= 1: return
-        normalized_data = (data.flatten() / 32768.0) * center_y
-        step = max(1, len(normalized_data) // width)
-        coords = []
-        for i, sample in enumerate(normalized_data[::step]):
-            x = (i / (len(normalized_data[::step]) -1)) * width if len(normalized_data[::step]) > 1 else width / 2
-            coords.append((x, center_y - sample))
-        if len(coords) > 1: canvas.create_line(coords, fill="lime", width=1)
\ No newline at end of file
+        self.send_button.grid(row=0, column=2, sticky="e")
\ No newline at end of file
@@ -2,52 +2,249 @@
 import re
 from config import EXPRESSIONS_LIST
 
+# Code recognized by the cleaner: removed from both outputs before any other markup is matched, as the original
+# sequential passes did, so a '*' or '[' inside code never opens an action or a link. Code blocks may span lines.
+CODE_PATTERN = re.compile(r"(?s:```.*?```)|`[^`]*`")
+# Other markup recognized by the cleaner, in priority order. A single left-to-right scan finds every construct;
+# each stays on one line. The lookahead lets the scan skip plain text quickly.
+MARKUP_PATTERN = re.compile(r"""
+    (?=[!\[*])(?:
+          (?P<image>!\[(?P<image_alt>.*?)\]\(.*?\))
+        | (?P<link>\[(?P<link_text>.*?)\]\(.*?\))
+        | (?P<action>\*.*?\*\.?\s?)
+    )
+""", re.VERBOSE)
+MARKUP_CHARS = "[*"
+# Any character that isn't a word, space, or common punctuation in Spanish.
+TTS_DISALLOWED_PATTERN = re.compile(r'[^\w\s.,¡!¿?áéíóúÁÉÍÓÚñÑ]')
+# Where text for TTS may be split, from the most to the least natural: sentences, clauses, words.
+TTS_SPLIT_PATTERNS = (
+    re.compile(r'(?<=[.!?…])\s+|\n+'),
+    re.compile(r'(?<=[,;:])\s+'),
+    re.compile(r'\s+'),
+)
+
+EXPRESSIONS = frozenset(EXPRESSIONS_LIST)
+EXPRESSION_LENGTHS = sorted({len(expression) for expression in EXPRESSIONS_LIST}, reverse=True)
+
 # Parses and cleans the LLM response for UI display and Text-to-Speech.
 def parse_and_clean_llm_response(text: str) -> dict:
     if not isinstance(text, str):
         return {"for_ui": "", "for_tts": "", "expression": None}
 
-    raw_text = text.strip()
-    expression_found = None
-
-    # Check if the text ends with one of the expressions
-    for expression in EXPRESSIONS_LIST:
-        # Check if it ends with the expression (case insensitive or exact? User said exact list, but let's be safe with strip)
-        # Using regex to ensure it's the last word/line
-        if raw_text.endswith(expression):
-            expression_found = expression
-            # Remove the expression from the end
-            raw_text = raw_text[:-len(expression)].strip()
-            break
-
-    # --- 1. Generate text for the UI ---
-    # Remove unsupported markdown but keep simple styling.
-    ui_text = re.sub(r'```.*?```', '', raw_text, flags=re.DOTALL)
-    ui_text = re.sub(r'`[^`]*`', '', ui_text)
-    ui_text = re.sub(r'!\[.*?\]\(.*?\)', '', ui_text)
-    ui_text = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', ui_text)
-    ui_text = ui_text.strip()
-
-    # --- 2. Generate text for TTS (aggressive cleaning) ---
-    tts_text = raw_text
-    
-    # Remove code snippets.
-    tts_text = re.sub(r'`[^`]*`', '', tts_text)
-    # Remove links, keeping the text.
-    tts_text = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', tts_text)
-    # Remove phrases in asterisks (like actions) and any trailing period.
-    tts_text = re.sub(r'\s?\*.*?\*\.?\s?', ' ', tts_text)
-    # Remove double asterisks (bold).
-    tts_text = re.sub(r'\*\*(.*?)\*\*', r'\1', tts_text)
-    # Remove list markers and headers.
-    tts_text = re.sub(r'^\s*[-*#]+\s*', '', tts_text, flags=re.MULTILINE)
-    # Remove any character that isn't a word, space, or common punctuation in Spanish.
-    tts_text = re.sub(r'[^\w\s.,¡!¿?áéíóúÁÉÍÓÚñÑ]', '', tts_text)
-    # Collapse multiple spaces into one.
-    tts_text = re.sub(r'\s+', ' ', tts_text).strip()
+    raw_text, expression_found = split_expression(text.strip())
+    ui_text, tts_text = _clean_markup(raw_text)
 
     return {
-        "for_ui": ui_text,
-        "for_tts": tts_text,
+        "for_ui": ui_text.strip(),
+        "for_tts": _finish_tts_text(tts_text),
         "expression": expression_found
-    }
\ No newline at end of file
+    }
+
+# Splits the trailing expression (if any) from the text. Returns the remaining text and the expression.
+def split_expression(text: str):
+    for length in EXPRESSION_LENGTHS:
+        if text[-length:] in EXPRESSIONS:
+            return text[:-length].strip(), text[-length:]
+    return text, None
+
+# Cleans text aggressively so that only speakable content reaches the TTS engine.
+def clean_text_for_tts(text: str) -> str:
+    return _finish_tts_text(_clean_markup(text)[1])
+
+# Removes code, then scans the text once and returns its UI text (unsupported markdown removed, simple styling kept)
+# and its TTS text (links reduced to their text, *actions* removed).
+def _clean_markup(text):
+    if "`" in text:
+        text = CODE_PATTERN.sub("", text)
+    ui_parts = []
+    tts_parts = []
+    last_end = 0
+    for match in MARKUP_PATTERN.finditer(text):
+        start, end = match.span()
+        if start > last_end:
+            plain = text[last_end:start]
+            ui_parts.append(plain)
+            tts_parts.append(plain)
+        last_end = end
+
+        kind = match.lastgroup
+        if kind == "link":
+            link_text = match.group("link_text")
+            if any(char in link_text for char in MARKUP_CHARS):
+                link_ui, link_text = _clean_markup(link_text)
+                ui_parts.append(link_ui)
+            else:
+                ui_parts.append(link_text)
+            tts_parts.append(link_text)
+        elif kind == "image":
+            # Images are hidden in the UI; TTS reads them like links
+            tts_parts.append("!" + match.group("image_alt"))
+        elif kind == "action":
+            # The UI keeps actions for styling; only links inside them are cleaned
+            action = match.group(0)
+            if "[" in action:
+                close_star = action.rindex("*")
+                action = "*" + _clean_markup(action[1:close_star])[0] + action[close_star:]
+            ui_parts.append(action)
+            tts_parts.append(" ")
+
+    if last_end < len(text):
+        ui_parts.append(text[last_end:])
+        tts_parts.append(text[last_end:])
+    return "".join(ui_parts), "".join(tts_parts)
+
+# Removes unspeakable characters and collapses whitespace.
+def _finish_tts_text(text):
+    return " ".join(TTS_DISALLOWED_PATTERN.sub("", text).split())
+
+class IncrementalTTSCleaner:
+    """
+    Cleans streamed LLM text for TTS while it is being generated.
+    Text is only released up to the last safe boundary: a word start after whitespace outside any code span, link or *action*,
+    so every construct is cleaned as a whole and released text never changes. The last word is held back
+    until the stream ends, because it may be the trailing expression.
+    """
+    # Link states: outside a link, in its text, after "]" and in its URL.
+    LINK_NONE, LINK_TEXT, LINK_CLOSED, LINK_URL = range(4)
+
+    # Initializes an empty cleaner.
+    def __init__(self):
+        self.buffer = ""
+        self.scan_pos = 0
+        self.safe_end = 0
+        self.in_code = False
+        self.in_action = False
+        self.link_state = self.LINK_NONE
+        self.after_space = False
+
+    # Adds a text delta and returns the cleaned TTS text that became stable, followed by a space
+    # (or an empty string if nothing new can be released yet).
+    def feed(self, delta):
+        self.buffer += delta
+        self._scan()
+        if not self.safe_end:
+            return ""
+        # The state at a safe boundary is always the initial one, so the remainder needs no rescanning
+        released = self.buffer[:self.safe_end]
+        self.buffer = self.buffer[self.safe_end:]
+        self.scan_pos -= self.safe_end
+        self.safe_end = 0
+        tts_text = clean_text_for_tts(released)
+        return f"{tts_text} " if tts_text else ""
+
+    # Returns the cleaned remaining text, without the trailing expression, once the stream has finished.
+    def finish(self):
+        remainder, _ = split_expression(self.buffer.strip())
+        self.__init__()
+        return clean_text_for_tts(remainder)
+
+    # Advances the scan over new text, tracking open constructs and the last safe boundary.
+    def _scan(self):
+        buffer = self.buffer
+        for i in range(self.scan_pos, len(buffer)):
+            char = buffer[i]
+            # A word starting after whitespace outside any construct marks a safe boundary
+            if self.after_space and not char.isspace():
+                self.safe_end = i
+            if char == '`':
+                self.in_code = not self.in_code
+            elif self.in_code:
+                # Code is removed before anything else is matched, so even its line breaks don't end an action or link
+                pass
+            elif char == '\n':
+                # Actions and links never span lines
+                self.in_action = False
+                self.link_state = self.LINK_NONE
+            elif self.link_state == self.LINK_URL:
+                if char == ')':
+                    self.link_state = self.LINK_NONE
+            elif self.link_state == self.LINK_CLOSED and char == '(':
+                self.link_state = self.LINK_URL
+            else:
+                if self.link_state == self.LINK_CLOSED:
+                    self.link_state = self.LINK_NONE
+                if char == '*':
+                    self.in_action = not self.in_action
+                elif char == '[':
+                    self.link_state = self.LINK_TEXT
+                elif char == ']' and self.link_state == self.LINK_TEXT:
+                    self.link_state = self.LINK_CLOSED
+
+            self.after_space = char.isspace() and not (self.in_code or self.in_action or self.link_state)
+        self.scan_pos = len(buffer)
+
+class SentenceSegmenter:
+    """
+    Splits streamed LLM text into complete sentences as soon as they are available.
+    Sentence boundaries inside *action* spans are ignored so that actions are never cut in half.
+    """
+    SENTENCE_END = ".!?…"
+    TRAILING_CLOSERS = "\"')]»”’"
+
+    # Initializes an empty segmenter.
+    def __init__(self):
+        self.buffer = ""
+        self.scan_pos = 0
+        self.in_action = False
+
+    # Adds a text delta and returns the list of sentences completed by it.
+    def feed(self, delta):
+        self.buffer += delta
+        sentences = []
+        segment_start = 0
+        i = self.scan_pos
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '*':
+                self.in_action = not self.in_action
+            elif not self.in_action and (char == '\n' or char in self.SENTENCE_END):
+                end = i + 1
+                if char != '\n':
+                    while end < len(self.buffer) and self.buffer[end] in self.SENTENCE_END + self.TRAILING_CLOSERS:
+                        end += 1
+                    # The boundary is only confirmed once whitespace follows the punctuation
+                    if end >= len(self.buffer):
+                        break
+                    if not self.buffer[end].isspace():
+                        i = end
+                        continue
+                sentence = self.buffer[segment_start:end].strip()
+                if sentence:
+                    sentences.append(sentence)
+                segment_start = end
+                i = end
+                continue
+            i += 1
+        self.buffer = self.buffer[segment_start:]
+        self.scan_pos = i - segment_start
+        return sentences
+
+    # Returns whatever text remains once the stream has finished.
+    def flush(self):
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        self.scan_pos = 0
+        self.in_action = False
+        return remainder
+
+# Splits text for TTS into chunks of at most max_characters, at sentence boundaries where possible, then at clause
+# boundaries and between words. Consecutive pieces are packed into one chunk while they fit.
+def split_for_tts(text: str, max_characters: int) -> list:
+    return _split_text(text, max_characters, 0)
+
+def _split_text(text, max_characters, level):
+    text = text.strip()
+    if len(text) <= max_characters:
+        return [text] if text else []
+    if level == len(TTS_SPLIT_PATTERNS):
+        # A single word longer than the limit
+        return [text[i:i + max_characters] for i in range(0, len(text), max_characters)]
+    chunks = []
+    for part in TTS_SPLIT_PATTERNS[level].split(text):
+        for piece in _split_text(part, max_characters, level + 1):
+            if chunks and len(chunks[-1]) + 1 + len(piece) <= max_characters:
+                chunks[-1] += " " + piece
+            else:
+                chunks.append(piece)
+    return chunks
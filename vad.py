@@ -0,0 +1,127 @@
+# vad.py
+import numpy as np
+
+from config import (
+    SAMPLE_RATE, VAD_FRAME_MS, VAD_ENERGY_THRESHOLD_DB, VAD_NOISE_MARGIN_DB, VAD_INITIAL_NOISE_FLOOR_DB,
+    VAD_MAX_ZCR, VAD_TRAILING_SILENCE_SECONDS, VAD_MIN_SPEECH_SECONDS, VAD_PADDING_SECONDS
+)
+
+class VoiceActivityDetector:
+    """
+    Energy and zero-crossing-rate voice activity detector for int16 audio.
+    Works on whole blocks at once with NumPy, so it is cheap enough to run inside the audio callback.
+    """
+    # Initializes the detector state for a new recording.
+    # energy_threshold_db can be raised to only react to louder (closer) speech.
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=VAD_FRAME_MS,
+                 trailing_silence_seconds=VAD_TRAILING_SILENCE_SECONDS, energy_threshold_db=VAD_ENERGY_THRESHOLD_DB):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.energy_threshold_db = energy_threshold_db
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+        self.trailing_silence_frames = int(trailing_silence_seconds * 1000 / frame_ms)
+        self.min_speech_frames = max(1, int(VAD_MIN_SPEECH_SECONDS * 1000 / frame_ms))
+        self.padding_frames = int(VAD_PADDING_SECONDS * 1000 / frame_ms)
+        self.reset()
+
+    # Clears the state so the detector can be reused for another recording.
+    def reset(self):
+        self.noise_floor_db = self._clamp_noise_floor(VAD_INITIAL_NOISE_FLOOR_DB)
+        self.noise_measured = False  # True once the noise floor has been adapted to non-speech frames
+        self.carry = np.zeros(0, dtype=np.int16)
+        self.speech_frames = 0
+        self.speech_run = 0  # Consecutive speech frames at the end of the audio processed so far
+        self.silence_run = 0
+        self.endpoint_reached = False
+
+    # Splits mono samples into whole frames, returning the frames and the leftover samples.
+    def _frame(self, samples):
+        frame_count = len(samples) // self.frame_length
+        used = frame_count * self.frame_length
+        return samples[:used].reshape(frame_count, self.frame_length), samples[used:]
+
+    # Returns the energy (dBFS) and zero-crossing rate of each frame.
+    @staticmethod
+    def _features(frames):
+        as_float = frames.astype(np.float32) / 32768.0
+        rms = np.sqrt(np.mean(as_float * as_float, axis=1))
+        energy_db = 20.0 * np.log10(np.maximum(rms, 1e-6))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frames.shape[1]
+        return energy_db, zcr
+
+    # Classifies frames as speech from their energy relative to the noise floor.
+    # Quiet frames with a very high zero-crossing rate are treated as hiss rather than speech.
+    def _classify(self, energy_db, zcr, noise_floor_db):
+        threshold = max(self.energy_threshold_db, noise_floor_db + VAD_NOISE_MARGIN_DB)
+        hiss = (zcr > VAD_MAX_ZCR) & (energy_db < threshold + VAD_NOISE_MARGIN_DB)
+        return (energy_db > threshold) & ~hiss
+
+    # Keeps a noise floor estimate at or below the energy threshold, so loud audio cannot raise the bar above speech.
+    def _clamp_noise_floor(self, noise_floor_db):
+        return min(float(noise_floor_db), self.energy_threshold_db)
+
+    # Converts an audio block (frames x channels, or mono) to a 1-D int16 array.
+    @staticmethod
+    def _mono(block):
+        return block[:, 0] if block.ndim == 2 else block
+
+    # Processes a recorded block and returns True once speech has been followed by enough trailing silence.
+    def process(self, block):
+        samples = self._mono(block)
+        if len(self.carry):
+            samples = np.concatenate((self.carry, samples))
+        frames, self.carry = self._frame(samples)
+        if len(frames) == 0:
+            return self.endpoint_reached
+
+        energy_db, zcr = self._features(frames)
+        speech = self._classify(energy_db, zcr, self.noise_floor_db)
+
+        # Track the noise floor on non-speech frames only, rising slowly and falling quickly
+        if not speech.all():
+            quiet_level = float(np.mean(energy_db[~speech]))
+            rate = 0.05 if quiet_level > self.noise_floor_db else 0.5
+            self.noise_floor_db = self._clamp_noise_floor(
+                self.noise_floor_db + rate * (quiet_level - self.noise_floor_db)
+            )
+            self.noise_measured = True
+
+        self.speech_frames += int(np.count_nonzero(speech))
+        if speech.any():
+            # Silence run after the last speech frame of this block
+            self.silence_run = len(speech) - 1 - int(np.flatnonzero(speech)[-1])
+        else:
+            self.silence_run += len(speech)
+        if speech.all():
+            self.speech_run += len(speech)
+        else:
+            self.speech_run = len(speech) - 1 - int(np.flatnonzero(~speech)[-1])
+
+        if self.speech_frames >= self.min_speech_frames and self.silence_run >= self.trailing_silence_frames:
+            self.endpoint_reached = True
+        return self.endpoint_reached
+
+    # Returns True if the last processed audio ends with at least the given seconds of continuous speech.
+    def speaking_for(self, seconds):
+        return self.speech_run * self.frame_ms >= seconds * 1000
+
+    # Returns the recording with leading and trailing silence removed (keeping some padding).
+    # Recordings without any detected speech are returned unchanged.
+    def trim(self, recording):
+        samples = self._mono(recording)
+        frames, _ = self._frame(samples)
+        if len(frames) == 0:
+            return recording
+        energy_db, zcr = self._features(frames)
+        if self.noise_measured:
+            noise_floor_db = self.noise_floor_db
+        else:
+            noise_floor_db = self._clamp_noise_floor(np.percentile(energy_db, 10))
+        speech_indices = np.flatnonzero(self._classify(energy_db, zcr, noise_floor_db))
+        if len(speech_indices) == 0:
+            return recording
+        start_frame = max(0, int(speech_indices[0]) - self.padding_frames)
+        end_frame = min(len(frames), int(speech_indices[-1]) + 1 + self.padding_frames)
+        end_sample = len(samples) if end_frame == len(frames) else end_frame * self.frame_length
+        return recording[start_frame * self.frame_length:end_sample]
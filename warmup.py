@@ -0,0 +1,66 @@
+# warmup.py
+import time
+import concurrent.futures
+
+from audio_player import AudioPlayer
+from assistant import VoiceAssistant
+from config import WARMUP_CONNECTIONS, WARMUP_MICROPHONE, WARMUP_WORKERS
+
+class WarmUp:
+    """
+    Creates the slow components of the app concurrently in background threads while the window is already shown:
+    the audio player, the assistant (provider clients) and the connections to the configured providers, and primes
+    the microphone input device. The first turn then starts as fast as any later one.
+    """
+    # Initializes the warm-up. on_ready(audio_player, assistant) is called from a background thread as soon as
+    # both exist; connections may still be opening. on_error(error) is called instead if either fails.
+    def __init__(self, conversation_id, recorder, on_ready, on_error):
+        self.conversation_id = conversation_id
+        self.recorder = recorder
+        self.on_ready = on_ready
+        self.on_error = on_error
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup")
+        self.start_time = None
+
+    # Starts warming up in the background and returns immediately.
+    def start(self):
+        self.start_time = time.monotonic()
+        player_future = self.executor.submit(AudioPlayer)
+        assistant_future = self.executor.submit(VoiceAssistant, self.conversation_id)
+        if WARMUP_MICROPHONE:
+            self.executor.submit(self._run_step, "microphone", self.recorder.warm_up)
+        self.executor.submit(self._finish, player_future, assistant_future)
+
+    # Waits for the player and the assistant, reports them and warms up the assistant's connections.
+    def _finish(self, player_future, assistant_future):
+        try:
+            audio_player = player_future.result()
+            assistant = assistant_future.result()
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+            self.on_error(e)
+            self.executor.shutdown(wait=False)
+            return
+        print(f"Audio player and assistant ready after {time.monotonic() - self.start_time:.2f}s.")
+        self.on_ready(audio_player, assistant)
+
+        if WARMUP_CONNECTIONS:
+            handlers = {
+                "transcription": assistant.transcription_handler,
+                "LLM": assistant.llm_handler,
+                "TTS": assistant.tts_handler,
+            }
+            steps = [
+                self.executor.submit(self._run_step, name, handler.warm_up)
+                for name, handler in handlers.items() if hasattr(handler, "warm_up")
+            ]
+            concurrent.futures.wait(steps)
+        print(f"Warm-up finished after {time.monotonic() - self.start_time:.2f}s.")
+        self.executor.shutdown(wait=False)
+
+    # Runs a warm-up step. Failures are only reported, since the first turn will simply do the work itself.
+    def _run_step(self, name, function):
+        try:
+            function()
+        except Exception as e:
+            print(f"Warm-up of the {name} failed: {e}")
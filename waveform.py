@@ -0,0 +1,78 @@
+# waveform.py
+import numpy as np
+
+from config import SAMPLE_RATE, WAVEFORM_FPS, WAVEFORM_WINDOW_SECONDS
+
+class WaveformRenderer:
+    """
+    Draws the live microphone waveform on a Tk canvas at a fixed maximum frame rate.
+    Instead of redrawing on every audio block, it periodically reads the latest samples and updates a single
+    persistent line item with a min/max envelope computed by NumPy.
+    """
+    # Initializes the renderer. get_samples returns the most recent int16 samples (at most the given count).
+    def __init__(self, canvas, get_samples, fps=WAVEFORM_FPS, window_seconds=WAVEFORM_WINDOW_SECONDS):
+        self.canvas = canvas
+        self.get_samples = get_samples
+        self.interval_ms = max(1, int(1000 / fps))
+        self.window_samples = int(SAMPLE_RATE * window_seconds)
+        self.line = None
+        self.after_id = None
+        self.last_signature = None
+
+    # Starts the redraw loop.
+    def start(self):
+        if self.after_id is None:
+            self.after_id = self.canvas.after(self.interval_ms, self._tick)
+
+    # Stops the redraw loop.
+    def stop(self):
+        if self.after_id is not None:
+            try:
+                self.canvas.after_cancel(self.after_id)
+            except Exception:
+                pass
+            self.after_id = None
+
+    # Redraws the waveform if new audio arrived, then schedules the next frame.
+    def _tick(self):
+        self.after_id = None
+        if not self.canvas.winfo_exists():
+            return
+        self._draw()
+        self.after_id = self.canvas.after(self.interval_ms, self._tick)
+
+    # Returns the flat canvas coordinates of the min/max envelope of the samples, one column per pixel.
+    @staticmethod
+    def envelope_coords(samples, width, height):
+        center_y = height / 2
+        columns = min(width, len(samples))
+        usable = (len(samples) // columns) * columns
+        blocks = samples[len(samples) - usable:].reshape(columns, -1)
+        scale = center_y / 32768.0
+        peaks = np.empty((columns, 2), dtype=np.float32)
+        peaks[:, 0] = center_y - blocks.max(axis=1) * scale
+        peaks[:, 1] = center_y - blocks.min(axis=1) * scale
+        xs = np.repeat(np.linspace(0, width, columns, dtype=np.float32), 2)
+        return np.column_stack((xs, peaks.ravel())).ravel().tolist()
+
+    # Updates the line item with the current envelope.
+    def _draw(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            return
+        data = self.get_samples(self.window_samples)
+        if data is None or len(data) < 2:
+            return
+        samples = data[:, 0] if data.ndim == 2 else data
+
+        # Skip the redraw when neither the audio nor the canvas size changed
+        signature = (len(samples), int(samples[-1]), width, height)
+        if signature == self.last_signature:
+            return
+        self.last_signature = signature
+
+        coords = self.envelope_coords(samples, width, height)
+        if self.line is None:
+            self.line = self.canvas.create_line(coords, fill="lime", width=1)
+        else:
+            self.canvas.coords(self.line, coords)